@@ -0,0 +1,173 @@
+"""
+Mantém a tabela de inventário (INVENTORY_TABLE_NAME, ver comum/inventario.py) a partir dos
+eventos da EC2 entregues pelo EventBridge:
+
+- "EC2 Instance State-change Notification" (source aws.ec2): estado da instância
+- "Tag Change on Resource" (source aws.tag, service ec2, resource-type instance): tags,
+  nome e última ação (tag LastActionBy)
+
+Eventos de regiões/contas fora de EC2_TARGETS são ignorados. O evento
+{"sincronizar_inventario": true} (ex: agendado uma vez por dia) relê as instâncias de todos
+os alvos com describe_instances e regrava a tabela, cobrindo as instâncias anteriores à
+criação da regra e eventos perdidos.
+
+Os eventos ficam no formato do EventBridge, então podem ser reprocessados localmente:
+
+    python lambda_function.py eventos.json    (um evento, uma lista ou um evento por linha)
+"""
+import json
+import logging
+import sys
+from datetime import datetime, timezone
+
+from comum import alvos, inventario, metrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+inventory_store = inventario.store_from_env()
+
+STATE_CHANGE_EVENT = 'EC2 Instance State-change Notification'
+TAG_CHANGE_EVENT = 'Tag Change on Resource'
+
+
+def parse_event_time(value):
+    """Horário do evento ('time', ex: 2026-10-17T12:00:00Z); o atual se ausente."""
+    if not value:
+        return datetime.now(timezone.utc)
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def own_account(context):
+    """Conta da própria Lambda, extraída do ARN da função (None na execução local)."""
+    arn = getattr(context, 'invoked_function_arn', None)
+    return arn.split(':')[4] if arn else None
+
+
+def event_location(event, context):
+    """(alvo, {alvo, regiao, conta}) da região/conta do evento, ou (None, None) se não gerenciada."""
+    target = alvos.find_target(event.get('region'), event.get('account'), own_account(context))
+    if target is None:
+        return None, None
+    location = {'alvo': target.id, 'regiao': event.get('region')}
+    if event.get('account'):
+        location['conta'] = event['account']
+    return target, location
+
+
+def complete_from_ec2(target, instance_id, account):
+    """Completa com describe_instances o que os eventos ainda não trouxeram (instância nova na tabela)."""
+    with metrics.phase('ec2_describe'):
+        reservations = target.ec2().describe_instances(InstanceIds=[instance_id])['Reservations']
+    for r in reservations:
+        for inst in r['Instances']:
+            with metrics.phase('inventory_write'):
+                inventory_store.fill_missing(inventario.instance_to_item(inst, target, account))
+            metrics.add_value('InstanciasCompletadas', 1)
+
+
+def handle_state_change(event, target, location):
+    detail = event.get('detail', {})
+    instance_id, state = detail.get('instance-id'), detail.get('state')
+    if not instance_id or not state:
+        logger.warning(f"Evento de estado sem instância ou estado: {detail}")
+        return None
+    with metrics.phase('inventory_write'):
+        item = inventory_store.apply_state(instance_id, state, parse_event_time(event.get('time')), location)
+    if item is None:
+        logger.info(f"Evento atrasado ignorado: {instance_id} {state} em {event.get('time')}")
+        metrics.add_value('EventosAtrasados', 1)
+    elif 'tags_versao' not in item and state != 'terminated':
+        complete_from_ec2(target, instance_id, location.get('conta'))
+    return item
+
+
+def handle_tag_change(event, target, location):
+    detail = event.get('detail', {})
+    if detail.get('service') != 'ec2' or detail.get('resource-type') != 'instance':
+        return None
+    version = int(detail.get('version', 0))
+    item = None
+    for arn in event.get('resources', []):
+        instance_id = arn.rsplit('/', 1)[-1]
+        with metrics.phase('inventory_write'):
+            item = inventory_store.apply_tags(instance_id, detail.get('tags') or {}, version,
+                                              parse_event_time(event.get('time')), location)
+        if item is None:
+            logger.info(f"Evento de tags atrasado ignorado: {instance_id} versão {version}")
+            metrics.add_value('EventosAtrasados', 1)
+        elif 'estado' not in item:
+            complete_from_ec2(target, instance_id, location.get('conta'))
+    return item
+
+
+def sync_inventory(context):
+    """
+    Regrava a tabela com as instâncias de todos os alvos (describe_instances paginado), sem
+    sobrescrever as instâncias alteradas por eventos durante a sincronização (ver InventoryStore.sync).
+    """
+    account = own_account(context)
+
+    def sync_target(target):
+        now = datetime.now(timezone.utc)
+        items = []
+        with metrics.phase('ec2_describe'):
+            for page in target.ec2().get_paginator('describe_instances').paginate():
+                for r in page['Reservations']:
+                    items.extend(inventario.instance_to_item(inst, target, target.account or account, now)
+                                 for inst in r['Instances'])
+        with metrics.phase('inventory_write'):
+            kept = inventory_store.sync(items, now)
+        return len(items), kept
+
+    results, errors = alvos.fan_out(sync_target, timeout=None)
+    synced = {target_id: total for target_id, (total, _) in results.items()}
+    kept = sum(k for _, k in results.values())
+    logger.info(f"Inventário sincronizado: {sum(synced.values())} instância(s) em {len(results)} alvo(s), "
+                f"{kept} mantida(s) por eventos mais novos")
+    metrics.add_value('InstanciasSincronizadas', sum(synced.values()))
+    metrics.add_value('InstanciasMantidas', kept)
+    return {'sincronizadas': synced, 'alvos_com_erro': sorted(errors)}
+
+
+@metrics.instrumented('AtualizaInventarioEC2')
+def lambda_handler(event, context):
+    if inventory_store is None:
+        raise RuntimeError("INVENTORY_TABLE_NAME não configurada")
+    event = event or {}
+    if event.get('sincronizar_inventario'):
+        return sync_inventory(context)
+
+    detail_type = event.get('detail-type')
+    target, location = event_location(event, context)
+    if target is None:
+        logger.info(f"Evento de região/conta não gerenciada ignorado: {event.get('account')}/{event.get('region')}")
+        metrics.add_value('EventosIgnorados', 1)
+        return {'atualizado': False}
+    if detail_type == STATE_CHANGE_EVENT:
+        item = handle_state_change(event, target, location)
+    elif detail_type == TAG_CHANGE_EVENT:
+        item = handle_tag_change(event, target, location)
+    else:
+        logger.warning(f"Tipo de evento não suportado: {detail_type}")
+        metrics.add_value('EventosIgnorados', 1)
+        return {'atualizado': False}
+    return {'atualizado': item is not None}
+
+
+def read_events(text):
+    """Eventos de um arquivo: um objeto JSON, uma lista ou um objeto por linha."""
+    text = text.strip()
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return parsed if isinstance(parsed, list) else [parsed]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sources = [open(path, encoding='utf-8').read() for path in sys.argv[1:]] or [sys.stdin.read()]
+    for source in sources:
+        for replayed in read_events(source):
+            print(json.dumps(lambda_handler(replayed, None), ensure_ascii=False))
@@ -1,56 +1,573 @@
-import boto3
+import heapq
 import logging
 import os
-from datetime import datetime, timezone
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta, timezone
+
+from comum import alvos, historico, limitador, metrics, uso
+from comum.acoes import EC2_ACTIONS, run_ec2_action
+from comum.recorrencia import next_occurrence
+from comum.aws import LazyAWS, get_resource, get_table
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
-ec2 = boto3.client('ec2')
-tabela = dynamodb.Table(os.environ['DYNAMODB_TABLE_NAME'])
+DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', 'EC2InstanceSchedules')
 
-def lambda_handler(event, context):
-    now_utc = datetime.now(timezone.utc).isoformat()
-    response = tabela.scan(
-        FilterExpression="#s = :pendente AND horario <= :agora",
-        ExpressionAttributeNames={
-            "#s": "status"
-        },
-        ExpressionAttributeValues={
-            ":pendente": "pendente",
-            ":agora": now_utc
-        }
+# Clientes AWS construídos apenas no primeiro uso (ver comum/aws.py). Os clientes EC2 são
+# os da região/conta gravada em cada agendamento ('alvo', ver comum/alvos.py).
+tabela = LazyAWS(get_table, DYNAMODB_TABLE_NAME)
+# Cliente do recurso (thread-safe, ao contrário do Table) usado pelas tarefas do pool
+ddb_client = LazyAWS(lambda: get_resource('dynamodb').meta.client)
+
+# Índice secundário global (GSI) esparso com os agendamentos pendentes.
+# Chave de partição: 'fila' (presente apenas enquanto o agendamento está pendente)
+# Chave de ordenação: 'horario'
+# Ao finalizar um agendamento o atributo 'fila' é removido e o item sai do índice,
+# de modo que o custo da consulta depende apenas do que está pendente, e não do histórico.
+PENDING_INDEX_NAME = os.environ.get('DYNAMODB_PENDING_INDEX', 'fila-horario-index')
+PENDING_QUEUE = 'pendente'
+# Status (e partição do índice) dos agendamentos reivindicados por uma execução em andamento
+RUNNING_STATUS = 'executando'
+# Validade (s) de uma reivindicação ('reivindicado_em'): se a invocação que reivindicou um
+# agendamento morrer antes de finalizá-lo (timeout, erro), outro tick o reivindica depois desse
+# prazo. Deve ser estritamente maior que o timeout da Lambda (no máximo 900 s), senão uma
+# execução ainda em andamento pode ter seus agendamentos reivindicados e executados de novo.
+EXECUTOR_CLAIM_LEASE_SECONDS = int(os.environ.get('EXECUTOR_CLAIM_LEASE_SECONDS', '960'))
+# Atributos de controle da execução, que não vão para o item finalizado
+CLAIM_ATTRIBUTES = ('fila', 'reivindicado_em')
+
+# Quantidade máxima de instâncias por chamada de start/stop
+EC2_BATCH_SIZE = int(os.environ.get('EC2_BATCH_SIZE', '50'))
+
+# Concorrência máxima do pool de execução (1 = execução sequencial)
+EXECUTOR_MAX_WORKERS = int(os.environ.get('EXECUTOR_MAX_WORKERS', '8'))
+# Margem (ms) antes do timeout da Lambda a partir da qual nenhum trabalho novo é iniciado
+EXECUTOR_TIME_MARGIN_MS = int(os.environ.get('EXECUTOR_TIME_MARGIN_MS', '10000'))
+
+# Janela de antecipação (s): agendamentos que vencem dentro dela são reivindicados já neste tick
+# e disparados no horário exato por um heap de timers em memória (0 = desligado)
+EXECUTOR_LOOKAHEAD_SECONDS = int(os.environ.get('EXECUTOR_LOOKAHEAD_SECONDS', '0'))
+# Agendamentos antecipados com horários a menos desta distância (s) são disparados no mesmo lote
+# (atraso máximo extra aceito em troca de menos chamadas à EC2)
+EXECUTOR_FIRE_TOLERANCE_SECONDS = float(os.environ.get('EXECUTOR_FIRE_TOLERANCE_SECONDS', '0.5'))
+
+# Agendamentos finalizados e arquivados recebem 'expira_em' (epoch, atributo de TTL da tabela) para
+# daqui a HISTORY_TTL_DAYS dias (0 = nunca expiram). O histórico completo fica no arquivo
+# (comum/historico.py); sem ele, os itens finalizados ficam na tabela.
+HISTORY_TTL_DAYS = int(os.environ.get('HISTORY_TTL_DAYS', '30'))
+TERMINAL_STATUSES = ('executado', 'erro', 'conflito', 'substituido')
+# Arquivo de histórico (None = desligado, ver HISTORY_BUCKET / HISTORY_DIR)
+history_store = historico.store_from_env()
+# Relatório de uso: transições e agregados diários de tempo ligado (ver comum/uso.py)
+usage_store = uso.store_from_env()
+
+
+def query_queue(fila, now_utc, **extra):
+    """Itens da partição 'fila' do índice com horário até 'now_utc', seguindo 'LastEvaluatedKey'."""
+    from boto3.dynamodb.conditions import Key
+
+    query_kwargs = {
+        'IndexName': PENDING_INDEX_NAME,
+        'KeyConditionExpression': Key('fila').eq(fila) & Key('horario').lte(now_utc),
+        **extra,
+    }
+    agendamentos = []
+    while True:
+        response = tabela.query(**query_kwargs)
+        agendamentos.extend(response.get('Items', []))
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return agendamentos
+        query_kwargs['ExclusiveStartKey'] = last_key
+
+
+def get_due_schedules(now_utc):
+    """
+    Retorna os agendamentos pendentes com horário até 'now_utc', em ordem de horário.
+    Consulta o índice de pendentes seguindo 'LastEvaluatedKey' até a última página.
+    """
+    return query_queue(PENDING_QUEUE, now_utc)
+
+
+def get_expired_claims(now_utc, now):
+    """
+    Agendamentos 'executando' cuja reivindicação expirou (ver EXECUTOR_CLAIM_LEASE_SECONDS):
+    a invocação que os reivindicou terminou sem finalizá-los. A partição só tem os agendamentos
+    em execução naquele momento, então a consulta costuma voltar vazia.
+    """
+    from boto3.dynamodb.conditions import Attr
+
+    limite = int(now.timestamp()) - EXECUTOR_CLAIM_LEASE_SECONDS
+    return query_queue(
+        RUNNING_STATUS, now_utc,
+        FilterExpression=Attr('reivindicado_em').lt(limite)
     )
 
-    agendamentos = response.get("Items", [])
-    logger.info(f"{len(agendamentos)} agendamento(s) a processar")
 
-    for ag in agendamentos:
+def chunks(items, size):
+    """Divide uma lista em blocos de no máximo 'size' elementos."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def next_run_item(ag, status, now):
+    """
+    Item de um agendamento recorrente após uma execução: volta para a fila de pendentes com
+    'horario' avançado para a próxima ocorrência e o resultado em 'ultima_execucao'/'ultimo_status'.
+    Se a expressão não tiver mais ocorrências, o agendamento é finalizado com status 'erro'.
+    """
+    item = {k: v for k, v in ag.items() if k not in CLAIM_ATTRIBUTES}
+    item['ultima_execucao'] = now.isoformat()
+    item['ultimo_status'] = status
+    try:
+        proximo = next_occurrence(ag['recorrencia'], max(now, datetime.fromisoformat(ag['horario'])))
+    except ValueError as e:
+        logger.error(f"Erro ao calcular a próxima ocorrência do agendamento {ag['id']}: {str(e)}")
+        item['status'] = 'erro'
+        return item
+    item['horario'] = proximo.isoformat()
+    item['status'] = PENDING_QUEUE
+    item['fila'] = PENDING_QUEUE
+    return item
+
+
+def save_schedule_results(resultados, arquivados=None):
+    """
+    Grava o status final dos agendamentos em lote (BatchWriteItem, 25 itens por chamada).
+    O atributo 'fila' é removido para que o item saia do índice de pendentes; agendamentos
+    recorrentes continuam na fila com a próxima ocorrência (ver next_run_item).
+    'expira_em' só é definido para os IDs em 'arquivados', de modo que um agendamento nunca
+    expira da tabela sem ter ido para o histórico; sem arquivo (None), nenhum item expira.
+    """
+    now = datetime.now(timezone.utc)
+    expira_em = int((now + timedelta(days=HISTORY_TTL_DAYS)).timestamp())
+    with tabela.batch_writer(overwrite_by_pkeys=['id']) as batch:
+        for ag, status in resultados:
+            if ag.get('recorrencia'):
+                batch.put_item(Item=next_run_item(ag, status, now))
+                continue
+            item = {k: v for k, v in ag.items() if k not in CLAIM_ATTRIBUTES}
+            item['status'] = status
+            if HISTORY_TTL_DAYS and arquivados is not None and ag['id'] in arquivados:
+                item['expira_em'] = expira_em
+            batch.put_item(Item=item)
+
+
+def archive_records(pool, registros):
+    """
+    Acrescenta as execuções ao arquivo de histórico, um objeto por parte e dia
+    (historico.group_records), em paralelo: um tick grava no máximo HISTORY_SHARDS objetos por
+    dia, qualquer que seja o número de instâncias.
+    Retorna o conjunto de IDs de agendamento arquivados (falhas são logadas e ignoradas).
+    """
+    grupos = historico.group_records(registros)
+
+    def append(item):
+        (parte, dia), lista = item
         try:
-            instancia_id = ag["instancia"]
-            acao = ag["acao"]
-            ag_id = ag["id"]
-
-            if acao == "start":
-                ec2.start_instances(InstanceIds=[instancia_id])
-            elif acao == "stop":
-                ec2.stop_instances(InstanceIds=[instancia_id])
-            else:
-                raise ValueError("Ação inválida")
+            history_store.append(parte, dia, lista)
+            return True
+        except Exception as e:
+            logger.error(f"Erro ao arquivar o histórico da parte {parte} de {dia}: {str(e)}")
+            return False
+
+    arquivados = set()
+    for (_, lista), ok in zip(grupos.items(), pool.map(append, grupos.items())):
+        if ok:
+            arquivados.update(r['id'] for r in lista)
+    return arquivados
+
+
+def record_usage(pool, transicoes):
+    """
+    Registra no relatório de uso as transições [(instance_id, acao, solicitante), ...] que de
+    fato mudaram o estado da instância; falhas no registro não afetam os agendamentos.
+    """
+    if usage_store is None or not transicoes:
+        return
+    now = datetime.now(timezone.utc)
+    try:
+        with metrics.phase('usage_write'):
+            usage_store.record([(instance_id, acao, now, solicitante) for instance_id, acao, solicitante in transicoes],
+                               'agendamento', pool)
+    except Exception as e:
+        logger.warning(f"Não foi possível registrar {len(transicoes)} transição(ões) no relatório de uso: {str(e)}")
+
+
+def finish_schedules(pool, resultados, transicoes=()):
+    """Arquiva as execuções no histórico (se configurado), grava o status final na tabela e registra o uso."""
+    arquivados = None
+    if history_store is not None and resultados:
+        now = datetime.now(timezone.utc)
+        with metrics.phase('archive'):
+            arquivados = archive_records(pool, [historico.build_record(ag, status, now) for ag, status in resultados])
+    with metrics.phase('dynamodb_write'):
+        save_schedule_results(resultados, arquivados)
+    record_usage(pool, transicoes)
+
+
+def archive_finished_backlog(pool, context):
+    """
+    Migração única: move para o histórico os agendamentos finalizados antes da existência do
+    arquivo (sem 'expira_em') e os apaga da tabela. Disparada pelo evento
+    {"arquivar_historico": true}; para ao se aproximar do timeout e pode ser reexecutada
+    até retornar "concluido": true.
+    """
+    from boto3.dynamodb.conditions import Attr
 
-            tabela.update_item(
-                Key={"id": ag_id},
-                UpdateExpression="SET #s = :ok",
+    if history_store is None:
+        logger.error("Arquivo de histórico não configurado (HISTORY_BUCKET ou HISTORY_DIR)")
+        return {"arquivados": 0, "concluido": False}
+
+    scan_kwargs = {'FilterExpression': Attr('status').is_in(list(TERMINAL_STATUSES)) & Attr('expira_em').not_exists()}
+    total = 0
+    while has_time_left(context):
+        page = tabela.scan(**scan_kwargs)
+        finalizados = page.get('Items', [])
+        registros = [
+            historico.build_record(ag, ag['status'], datetime.fromisoformat(ag['horario']))
+            for ag in finalizados
+        ]
+        arquivados = archive_records(pool, registros)
+        with tabela.batch_writer() as batch:
+            for ag in finalizados:
+                if ag['id'] in arquivados:
+                    batch.delete_item(Key={'id': ag['id']})
+        total += len(arquivados)
+        if not page.get('LastEvaluatedKey'):
+            logger.info(f"Arquivamento concluído: {total} agendamento(s) movido(s) para o histórico")
+            return {"arquivados": total, "concluido": True}
+        scan_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+    logger.warning(f"Tempo da invocação esgotando: arquivamento interrompido após {total} agendamento(s)")
+    return {"arquivados": total, "concluido": False}
+
+
+def backfill_pending_queue(pool, context):
+    """
+    Migração única: grava 'fila' = pendente nos agendamentos pendentes criados antes do índice
+    de pendentes, que de outra forma nunca seriam consultados nem executados. Disparada pelo
+    evento {"preencher_fila": true}; para ao se aproximar do timeout e pode ser reexecutada
+    até retornar "concluido": true.
+    """
+    from boto3.dynamodb.conditions import Attr
+    from botocore.exceptions import ClientError
+
+    def fill(ag):
+        try:
+            ddb_client.update_item(
+                TableName=DYNAMODB_TABLE_NAME,
+                Key={"id": ag["id"]},
+                UpdateExpression="SET fila = :pendente",
+                ConditionExpression="#s = :pendente AND attribute_not_exists(fila)",
                 ExpressionAttributeNames={"#s": "status"},
-                ExpressionAttributeValues={":ok": "executado"}
+                ExpressionAttributeValues={":pendente": PENDING_QUEUE}
             )
-            logger.info(f"Ação {acao} aplicada à instância {instancia_id}")
-        except Exception as e:
-            logger.error(f"Erro no agendamento {ag.get('id')}: {str(e)}")
-            tabela.update_item(
-                Key={"id": ag.get("id")},
-                UpdateExpression="SET #s = :erro",
-                ExpressionAttributeNames={"#s": "status"},
-                ExpressionAttributeValues={":erro": "erro"}
-            )
\ No newline at end of file
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.error(f"Erro ao preencher a fila do agendamento {ag['id']}: {str(e)}")
+            return False
+
+    scan_kwargs = {
+        'FilterExpression': Attr('status').eq(PENDING_QUEUE) & Attr('fila').not_exists(),
+        'ProjectionExpression': 'id',
+    }
+    total = 0
+    while has_time_left(context):
+        page = tabela.scan(**scan_kwargs)
+        total += sum(pool.map(fill, page.get('Items', [])))
+        if not page.get('LastEvaluatedKey'):
+            logger.info(f"Fila preenchida: {total} agendamento(s) pendente(s) entraram no índice")
+            return {"preenchidos": total, "concluido": True}
+        scan_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+    logger.warning(f"Tempo da invocação esgotando: preenchimento interrompido após {total} agendamento(s)")
+    return {"preenchidos": total, "concluido": False}
+
+
+def claim_schedule(ag):
+    """
+    Reivindica o agendamento de forma atômica (pendente -> executando), gravando o momento em
+    'reivindicado_em'. Uma reivindicação expirada (EXECUTOR_CLAIM_LEASE_SECONDS) pode ser
+    tomada por outra execução. Retorna False se outra execução já o reivindicou ou se ele
+    deixou de estar pendente.
+    """
+    from botocore.exceptions import ClientError
+
+    now = int(time.time())
+    try:
+        ddb_client.update_item(
+            TableName=DYNAMODB_TABLE_NAME,
+            Key={"id": ag["id"]},
+            UpdateExpression="SET #s = :executando, fila = :executando, reivindicado_em = :agora",
+            ConditionExpression="#s = :pendente OR (#s = :executando AND reivindicado_em < :limite)",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={
+                ":executando": RUNNING_STATUS,
+                ":pendente": PENDING_QUEUE,
+                ":agora": now,
+                ":limite": now - EXECUTOR_CLAIM_LEASE_SECONDS
+            }
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            logger.error(f"Erro ao reivindicar o agendamento {ag['id']}: {str(e)}")
+        return False
+
+
+def release_schedule(ag):
+    """Devolve à fila de pendentes um agendamento reivindicado que não chegou a ser executado."""
+    from botocore.exceptions import ClientError
+
+    try:
+        ddb_client.update_item(
+            TableName=DYNAMODB_TABLE_NAME,
+            Key={"id": ag["id"]},
+            UpdateExpression="SET #s = :pendente, fila = :pendente REMOVE reivindicado_em",
+            ConditionExpression="#s = :executando",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={
+                ":executando": RUNNING_STATUS,
+                ":pendente": PENDING_QUEUE
+            }
+        )
+    except ClientError as e:
+        logger.error(f"Erro ao devolver o agendamento {ag['id']} para a fila: {str(e)}")
+
+
+def run_ec2_batch(lote):
+    """
+    Executa um lote (acao, alvo, instance_ids) no pool, convertendo falhas inesperadas em erros por instância.
+    Retorna None se a EC2 continuar limitando a taxa após as retentativas do cliente.
+    """
+    from botocore.exceptions import ClientError
+
+    acao, alvo, instance_ids = lote
+    try:
+        return run_ec2_action(acao, instance_ids, alvo)
+    except ClientError as e:
+        if limitador.is_throttle_error(e):
+            logger.warning(f"Lote de {acao} com {len(instance_ids)} instância(s) de {alvo.id} limitado pela EC2: {str(e)}")
+            return None
+        return set(), {instance_id: str(e) for instance_id in instance_ids}
+    except Exception as e:
+        return set(), {instance_id: str(e) for instance_id in instance_ids}
+
+
+def has_time_left(context, wait_seconds=0):
+    """Indica se ainda há tempo na invocação para iniciar um novo trabalho (após esperar 'wait_seconds')."""
+    if context is None:
+        return True
+    return context.get_remaining_time_in_millis() - wait_seconds * 1000 > EXECUTOR_TIME_MARGIN_MS
+
+
+def run_in_pool(pool, fn, items, context):
+    """
+    Executa fn(item) no pool mantendo no máximo EXECUTOR_MAX_WORKERS tarefas em andamento.
+    Deixa de iniciar novas tarefas quando o tempo restante da invocação fica abaixo da margem.
+    Retorna ([(item, resultado), ...], itens não iniciados).
+    """
+    em_andamento = {}
+    concluidos = []
+    restantes = list(items)
+    while restantes:
+        if len(em_andamento) >= EXECUTOR_MAX_WORKERS:
+            prontos, _ = wait(em_andamento, return_when=FIRST_COMPLETED)
+            for future in prontos:
+                concluidos.append((em_andamento.pop(future), future.result()))
+        if not has_time_left(context):
+            logger.warning(f"Tempo da invocação esgotando: {len(restantes)} tarefa(s) adiada(s)")
+            break
+        item = restantes.pop(0)
+        em_andamento[pool.submit(fn, item)] = item
+
+    for future in as_completed(em_andamento):
+        concluidos.append((em_andamento[future], future.result()))
+    return concluidos, restantes
+
+
+def schedule_lag_seconds(ag, now):
+    """Atraso entre o horário agendado e o momento da execução."""
+    return round((now - datetime.fromisoformat(ag["horario"])).total_seconds(), 3)
+
+
+def schedule_minute(ag):
+    """Minuto (UTC) do horário de um agendamento, usado para agrupar ações coincidentes."""
+    return datetime.fromisoformat(ag["horario"]).astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M')
+
+
+def coalesce_schedules(agendamentos):
+    """
+    Reduz os agendamentos de cada instância a uma única ação efetiva antes de chamar a EC2:
+    - vale o minuto mais recente; agendamentos de minutos anteriores ficam 'substituido';
+    - no minuto efetivo, repetições da mesma ação viram uma só (as demais seguem o resultado
+      da principal); ações contraditórias (start e stop) não são executadas e ficam 'conflito'.
+    Retorna (principais, {id da principal: [repetidos]}, [(agendamento, status), ...]).
+    """
+    por_instancia = {}
+    for ag in agendamentos:
+        por_instancia.setdefault(ag["instancia"], []).append(ag)
+
+    principais, repetidos, resultados = [], {}, []
+    for instance_id, lista in por_instancia.items():
+        ultimo_minuto = max(schedule_minute(ag) for ag in lista)
+        efetivos = []
+        for ag in lista:
+            if schedule_minute(ag) == ultimo_minuto:
+                efetivos.append(ag)
+            else:
+                resultados.append((ag, "substituido"))
+        if len({ag["acao"] for ag in efetivos}) > 1:
+            logger.error(f"Ações contraditórias para a instância {instance_id} em {ultimo_minuto}: "
+                         f"{', '.join(ag['id'] for ag in efetivos)}")
+            resultados.extend((ag, "conflito") for ag in efetivos)
+            continue
+        principal, *outros = efetivos
+        principais.append(principal)
+        if outros:
+            repetidos[principal["id"]] = outros
+    return principais, repetidos, resultados
+
+
+def execute_schedules(pool, reivindicados, context):
+    """
+    Executa agendamentos já reivindicados: reduz a uma ação por instância (coalesce_schedules),
+    agrupa por ação e por região/conta ('alvo' do agendamento; os antigos, sem ele, usam o
+    alvo padrão), dispara os lotes de start/stop no pool e devolve à fila os que não
+    chegaram a ser iniciados por falta de tempo ou que a EC2 limitou.
+    Retorna ([(agendamento, status final), ...] para gravação, [(instance_id, acao, solicitante), ...]
+    das instâncias que mudaram de estado, para o relatório de uso).
+    """
+    resultados = []
+    transicoes = []
+    validos = []
+    for ag in reivindicados:
+        if ag.get("acao") not in EC2_ACTIONS:
+            logger.error(f"Erro no agendamento {ag.get('id')}: Ação inválida")
+            resultados.append((ag, "erro"))
+            continue
+        validos.append(ag)
+
+    # Uma ação efetiva por instância (repetidas, substituídas e contraditórias não chamam a EC2)
+    principais, repetidos, coalescidos = coalesce_schedules(validos)
+    resultados.extend(coalescidos)
+    if len(principais) < len(validos):
+        metrics.add_value('Coalescidos', len(validos) - len(principais))
+
+    agendamentos_por_acao = {}
+    for ag in principais:
+        agendamentos_por_acao.setdefault(ag["acao"], []).append(ag)
+
+    lotes = []
+    for acao, lista in agendamentos_por_acao.items():
+        # Cada lote vai para o cliente de uma única região/conta; os lotes rodam em paralelo no pool
+        for alvo, do_alvo in alvos.group_by_target(lista, lambda ag: ag.get("alvo")).items():
+            instance_ids = [ag["instancia"] for ag in do_alvo]
+            lotes.extend((acao, alvo, lote) for lote in chunks(instance_ids, EC2_BATCH_SIZE))
+
+    for _, _, lote in lotes:
+        metrics.add_value('TamanhoLote', len(lote))
+    with metrics.phase('ec2_action'):
+        executados, adiados = run_in_pool(pool, run_ec2_batch, lotes, context)
+
+    aceitas, erros = {}, {}
+    for (acao, alvo, lote), resultado in executados:
+        if resultado is None:
+            # Limitado pela EC2: volta para a fila em vez de virar erro
+            adiados.append((acao, alvo, lote))
+            continue
+        aceitas_lote, erros_lote = resultado
+        aceitas.setdefault(acao, {}).update(aceitas_lote)
+        erros.setdefault(acao, {}).update(erros_lote)
+    nao_iniciadas = {(acao, instance_id) for acao, _, lote in adiados for instance_id in lote}
+
+    for acao, lista in agendamentos_por_acao.items():
+        for ag in lista:
+            grupo = [ag] + repetidos.get(ag["id"], [])
+            if (acao, ag["instancia"]) in nao_iniciadas:
+                for item in grupo:
+                    release_schedule(item)
+            elif ag["instancia"] in aceitas.get(acao, {}):
+                resultados.extend((item, "executado") for item in grupo)
+                # Instância que já estava no estado pedido: executado, mas sem transição de uso
+                if aceitas[acao][ag["instancia"]]:
+                    transicoes.append((ag["instancia"], acao, ag.get("solicitante")))
+                metrics.add_value('AtrasoAgendamento', schedule_lag_seconds(ag, datetime.now(timezone.utc)), 'Seconds')
+            else:
+                logger.error(f"Erro no agendamento {ag['id']}: {erros.get(acao, {}).get(ag['instancia'])}")
+                resultados.extend((item, "erro") for item in grupo)
+        logger.info(f"Ação {acao} aplicada a {len(aceitas.get(acao, {}))} instância(s)")
+    return resultados, transicoes
+
+
+def fire_on_schedule(pool, antecipados, context):
+    """
+    Dispara agendamentos antecipados (já reivindicados) no horário exato, usando um heap de
+    timers ordenado por horário. Horários a menos de EXECUTOR_FIRE_TOLERANCE_SECONDS do
+    primeiro da fila saem no mesmo lote, disparado no horário do último. Os que não cabem no tempo restante da invocação
+    voltam para a fila de pendentes e ficam para o próximo tick.
+    """
+    timers = [(datetime.fromisoformat(ag["horario"]), n, ag) for n, ag in enumerate(antecipados)]
+    heapq.heapify(timers)
+    while timers:
+        limite = timers[0][0] + timedelta(seconds=EXECUTOR_FIRE_TOLERANCE_SECONDS)
+        lote = []
+        while timers and timers[0][0] <= limite:
+            disparo, _, ag = heapq.heappop(timers)
+            lote.append(ag)
+
+        # O lote dispara no maior horário do grupo: nenhum agendamento é executado antes da hora
+        espera = max(0.0, (disparo - datetime.now(timezone.utc)).total_seconds())
+        if not has_time_left(context, espera):
+            logger.warning(f"Tempo da invocação esgotando: {len(lote) + len(timers)} agendamento(s) antecipado(s) devolvido(s) à fila")
+            for ag in lote + [ag for _, _, ag in timers]:
+                release_schedule(ag)
+            return
+        if espera:
+            with metrics.phase('lookahead_wait'):
+                time.sleep(espera)
+
+        finish_schedules(pool, *execute_schedules(pool, lote, context))
+
+
+@metrics.instrumented('ExecutaAgendamentosEC2')
+def lambda_handler(event, context):
+    if (event or {}).get('arquivar_historico'):
+        with ThreadPoolExecutor(max_workers=EXECUTOR_MAX_WORKERS) as pool:
+            return archive_finished_backlog(pool, context)
+    if (event or {}).get('preencher_fila'):
+        with ThreadPoolExecutor(max_workers=EXECUTOR_MAX_WORKERS) as pool:
+            return backfill_pending_queue(pool, context)
+
+    now = datetime.now(timezone.utc)
+    horizonte = now + timedelta(seconds=EXECUTOR_LOOKAHEAD_SECONDS)
+    with metrics.phase('query'):
+        agendamentos = get_due_schedules(horizonte.isoformat())
+        # Reivindicações abandonadas por invocações que terminaram antes de finalizá-las
+        expirados = get_expired_claims(horizonte.isoformat(), now)
+    if expirados:
+        logger.warning(f"{len(expirados)} agendamento(s) com reivindicação expirada voltam a ser executados")
+        metrics.add_value('ReivindicacoesExpiradas', len(expirados))
+        agendamentos = sorted(agendamentos + expirados, key=lambda ag: ag["horario"])
+    vencidos = [ag for ag in agendamentos if datetime.fromisoformat(ag["horario"]) <= now]
+    logger.info(f"{len(vencidos)} agendamento(s) a processar, {len(agendamentos) - len(vencidos)} antecipado(s)")
+    metrics.add_value('Backlog', len(vencidos))
+    if EXECUTOR_LOOKAHEAD_SECONDS:
+        metrics.add_value('Antecipados', len(agendamentos) - len(vencidos))
+
+    with ThreadPoolExecutor(max_workers=EXECUTOR_MAX_WORKERS) as pool:
+        # 1. Reivindica os agendamentos (inclusive os antecipados, para que o próximo tick
+        #    não os dispare de novo); os que outra execução já pegou são ignorados
+        with metrics.phase('claim'):
+            reivindicacoes, _ = run_in_pool(pool, claim_schedule, agendamentos, context)
+        reivindicados = [ag for ag, ok in reivindicacoes if ok]
+        logger.info(f"{len(reivindicados)} agendamento(s) reivindicado(s)")
+        vencidos_ids = {ag["id"] for ag in vencidos}
+
+        # 2. Executa os vencidos imediatamente, em lotes paralelos
+        finish_schedules(pool, *execute_schedules(pool, [ag for ag in reivindicados if ag["id"] in vencidos_ids], context))
+
+        # 3. Aguarda e dispara os antecipados no horário exato
+        fire_on_schedule(pool, [ag for ag in reivindicados if ag["id"] not in vencidos_ids], context)
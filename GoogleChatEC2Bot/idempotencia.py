@@ -0,0 +1,162 @@
+"""
+Idempotência do webhook do Google Chat.
+
+Quando a Lambda demora, o Google Chat reenvia o mesmo evento. Sem proteção, o reenvio
+executaria de novo start_instances/create_tags ou criaria um segundo agendamento.
+
+Cada evento recebe uma chave derivada da sua identidade (nome da mensagem, horário do
+evento, ação do botão e usuário). A primeira entrega reivindica a chave com uma escrita
+condicional no DynamoDB (registro com TTL curto em 'expira_em'), processa o comando e
+grava a resposta no registro. Um reenvio encontra a resposta:
+- primeiro em um LRU em memória (container "quente", nenhuma chamada à AWS);
+- depois no registro do DynamoDB (outro container).
+Se a primeira entrega ainda estiver em processamento, o reenvio recebe uma resposta vazia.
+
+Os registros ficam por padrão na própria tabela de agendamentos, com IDs prefixados por
+'idempotencia#' e sem os atributos dos índices ('fila', 'instancia').
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from comum.aws import get_table
+
+logger = logging.getLogger()
+
+IDEMPOTENCY_TABLE_NAME = os.environ.get('IDEMPOTENCY_TABLE_NAME') or os.environ.get('DYNAMODB_TABLE_NAME', 'EC2InstanceSchedules')
+# Validade (s) do registro no DynamoDB e das respostas no LRU
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '600'))
+# Quantidade de respostas mantidas no LRU em memória
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '256'))
+
+KEY_PREFIX = 'idempotencia#'
+IN_PROGRESS = 'processando'
+DONE = 'concluido'
+
+# Resposta a um reenvio cuja primeira entrega ainda não terminou: corpo vazio, nenhuma mensagem nova no chat
+IN_PROGRESS_RESPONSE = {
+    'statusCode': 200,
+    'body': '{}',
+    'headers': {'Content-Type': 'application/json'}
+}
+
+
+def event_key(body):
+    """
+    Chave de idempotência do evento, ou None se o evento não tiver identidade
+    (sem nome de mensagem nem horário do evento).
+    """
+    message = body.get('message', {})
+    if not message.get('name') and not body.get('eventTime'):
+        return None
+    action = body.get('action', {})
+    user = body.get('user') or message.get('sender') or {}
+    identity = "|".join([
+        body.get('type', ''),
+        message.get('name', ''),
+        body.get('eventTime', ''),
+        action.get('actionMethodName', ''),
+        json.dumps(action.get('parameters', []), sort_keys=True),
+        user.get('name') or user.get('email', ''),
+    ])
+    return KEY_PREFIX + hashlib.sha256(identity.encode('utf-8')).hexdigest()[:32]
+
+
+class ResponseCache:
+    """LRU de respostas com validade, seguro entre threads."""
+
+    def __init__(self, max_size=IDEMPOTENCY_CACHE_SIZE, ttl_seconds=IDEMPOTENCY_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+class IdempotencyStore:
+    """LRU em memória na frente de um registro condicional com TTL no DynamoDB."""
+
+    def __init__(self, table_name=IDEMPOTENCY_TABLE_NAME, ttl_seconds=IDEMPOTENCY_TTL_SECONDS,
+                 cache_size=IDEMPOTENCY_CACHE_SIZE):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.cache = ResponseCache(cache_size, ttl_seconds)
+
+    def _claim(self, table, key):
+        """Reivindica a chave; False se outra entrega do mesmo evento já a reivindicou."""
+        now = int(time.time())
+        try:
+            table.put_item(
+                Item={'id': key, 'estado': IN_PROGRESS, 'expira_em': now + self.ttl_seconds},
+                # Registros vencidos ainda não removidos pelo TTL podem ser reaproveitados
+                ConditionExpression="attribute_not_exists(id) OR expira_em < :agora",
+                ExpressionAttributeValues={":agora": now}
+            )
+            return True
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def run(self, key, process):
+        """
+        Executa process() uma única vez por chave. Retorna (resposta, repetido), onde
+        'repetido' indica que a resposta veio de uma entrega anterior do mesmo evento.
+        Falhas do DynamoDB não bloqueiam o comando: ele é processado sem a proteção.
+        """
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached, True
+
+        table = get_table(self.table_name)
+        try:
+            claimed = self._claim(table, key)
+        except Exception as e:
+            logger.warning(f"Idempotência indisponível, processando sem proteção: {e}")
+            return process(), False
+
+        if not claimed:
+            item = table.get_item(Key={'id': key}, ConsistentRead=True).get('Item') or {}
+            if item.get('estado') == DONE:
+                result = json.loads(item['resposta'])
+                self.cache.put(key, result)
+                return result, True
+            return IN_PROGRESS_RESPONSE, True
+
+        try:
+            result = process()
+        except Exception:
+            # Libera a chave para que um reenvio possa tentar de novo
+            table.delete_item(Key={'id': key})
+            raise
+
+        self.cache.put(key, result)
+        try:
+            table.update_item(
+                Key={'id': key},
+                UpdateExpression="SET estado = :concluido, resposta = :resposta",
+                ExpressionAttributeValues={":concluido": DONE, ":resposta": json.dumps(result)}
+            )
+        except Exception as e:
+            logger.warning(f"Não foi possível gravar a resposta de idempotência {key}: {e}")
+        return result, False
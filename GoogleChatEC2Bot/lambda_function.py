@@ -1,19 +1,49 @@
+import fnmatch
 import json
-import boto3
 import logging
+import os
+import random
+import time
 import uuid
 from datetime import datetime, timedelta, timezone
 
+import idempotencia
+import renderizacao
+import resposta_diferida
+from comum import alvos, historico, inventario, limitador, metrics, recorrencia, uso
+from comum.acoes import run_ec2_action, state_changes
+from comum.aws import LazyAWS, get_table
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Inicializa clientes AWS
-ec2 = boto3.client('ec2')
-dynamodb = boto3.resource('dynamodb')
-
-# Nome da tabela DynamoDB para agendamentos (substitua pelo seu nome de tabela)
-DYNAMODB_TABLE_NAME = 'EC2InstanceSchedules' 
-tabela_agendamentos = dynamodb.Table(DYNAMODB_TABLE_NAME)
+# Nome da tabela DynamoDB para agendamentos (variável de ambiente DYNAMODB_TABLE_NAME)
+DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', 'EC2InstanceSchedules')
+# Índice esparso de pendentes (fila + horario), o mesmo consultado pelo ExecutaAgendamentosEC2
+PENDING_INDEX_NAME = os.environ.get('DYNAMODB_PENDING_INDEX', 'fila-horario-index')
+# Índice por instância (instancia + horario) usado para detectar agendamentos no mesmo minuto
+INSTANCE_INDEX_NAME = os.environ.get('DYNAMODB_INSTANCE_INDEX', 'instancia-horario-index')
+
+# Clientes AWS construídos apenas no primeiro uso (ver comum/aws.py). Os clientes EC2 são
+# os de cada região/conta configurada em EC2_TARGETS (ver comum/alvos.py).
+tabela_agendamentos = LazyAWS(get_table, DYNAMODB_TABLE_NAME)
+# Quantidade de agendamentos por página do comando 'agendamentos'
+SCHEDULES_PAGE_SIZE = 10
+
+# Histórico de execuções (arquivo gravado pelo ExecutaAgendamentosEC2, ver comum/historico.py)
+history_store = historico.store_from_env()
+# Dias consultados pelo comando 'historico' e quantidade máxima de execuções exibidas
+HISTORY_QUERY_DAYS = int(os.environ.get('HISTORY_QUERY_DAYS', '7'))
+HISTORY_MAX_ENTRIES = int(os.environ.get('HISTORY_MAX_ENTRIES', '20'))
+
+# Relatório de uso (tempo ligado e custo estimado, ver comum/uso.py)
+usage_store = uso.store_from_env()
+USAGE_REPORT_DEFAULT_DAYS = 7
+USAGE_REPORT_MAX_DAYS = int(os.environ.get('USAGE_REPORT_MAX_DAYS', '90'))
+# Instâncias listadas no relatório, das que ficaram mais tempo ligadas
+USAGE_REPORT_TOP = 10
+# Limite de valores por filtro da API da EC2
+EC2_FILTER_MAX_VALUES = 200
 
 # --- Configurações de Usuários e Permissões (PERSONALIZÁVEL) ---
 # Lista de e-mails de usuários permitidos para ações restritas (ex: deletar agendamentos)
@@ -36,28 +66,239 @@ UNRESTRICTED_INSTANCES_BY_NAME = ["dev-server", "test-env"]
 def response(msg, card_data=None):
     """
     Constrói a resposta formatada para a plataforma de chat.
-    Pode ser texto simples ou um card (para o menu ou lista de agendamentos).
-    """
-    if card_data:
-        return {
-            'statusCode': 200,
-            'body': json.dumps(card_data),
-            'headers': {'Content-Type': 'application/json'}
-        }
-    else:
-        return {
-            'statusCode': 200,
-            'body': json.dumps({'text': msg}),
-            'headers': {'Content-Type': 'application/json'}
-        }
+    Pode ser texto simples ou um card (para o menu ou lista de agendamentos); o card
+    pode vir já serializado (ver renderizacao.card_body).
+    """
+    with metrics.phase('render'):
+        if card_data:
+            return {
+                'statusCode': 200,
+                'body': card_data if isinstance(card_data, str) else renderizacao.dumps(card_data),
+                'headers': {'Content-Type': 'application/json'}
+            }
+        else:
+            return {
+                'statusCode': 200,
+                'body': renderizacao.dumps({'text': msg}),
+                'headers': {'Content-Type': 'application/json'}
+            }
+
+
+def error_response(e):
+    """Resposta de erro do comando; limitações de taxa da AWS viram um aviso para tentar de novo."""
+    if limitador.is_throttle_error(e):
+        return response("⏳ A AWS está limitando as requisições no momento. Tente novamente em alguns segundos.")
+    return response(f"Erro ao processar comando: {str(e)}")
+
+# Comandos de texto reconhecidos (usados como dimensão das métricas)
+KNOWN_COMMANDS = ("start", "stop", "status", "aguardar", "agendar", "menu", "agendamentos", "deletar", "historico", "relatorio")
+
+# --- Resposta diferida (ver resposta_diferida.py) ---
+# Quando habilitada, comandos lentos respondem na hora com uma mensagem provisória e são
+# concluídos por uma continuação assíncrona que atualiza a mensagem com o resultado final.
+DEFERRED_RESPONSES = os.environ.get('DEFERRED_RESPONSES', 'false').lower() == 'true'
+dispatcher = resposta_diferida.LambdaSelfInvokeDispatcher()
+messenger = resposta_diferida.GoogleChatMessenger()
+
+# --- Idempotência (ver idempotencia.py) ---
+# Reenvios do mesmo evento pelo Google Chat recebem a resposta da primeira entrega,
+# sem repetir ações na EC2 nem gravar outro agendamento.
+IDEMPOTENCY_ENABLED = os.environ.get('IDEMPOTENCY_ENABLED', 'true').lower() == 'true'
+idempotency = idempotencia.IdempotencyStore()
+# Só os comandos que alteram estado passam pela proteção: repetir uma leitura não tem efeito
+# e não vale as duas escritas no DynamoDB por evento
+SIDE_EFFECT_COMMANDS = ("start", "stop", "agendar", "deletar")
+
+# --- Renderização dos cards (ver renderizacao.py) ---
+# Trechos já serializados do menu e da lista de agendamentos, reaproveitados entre cliques.
+render_cache = renderizacao.RenderCache()
+
+# --- Menu de instâncias ---
+# Quantidade de instâncias por página do card do menu
+MENU_PAGE_SIZE = int(os.environ.get('MENU_PAGE_SIZE', '20'))
+# Estados aceitos como filtro no comando 'menu'
+INSTANCE_STATES = ["pending", "running", "stopping", "stopped", "shutting-down", "terminated"]
+
+# --- Cache de inventário de instâncias ---
+# Mantido no escopo do módulo, é reaproveitado enquanto o container da Lambda estiver "quente".
+# Guarda um índice ID -> instância e um índice nome (minúsculo) -> ID, evitando um
+# describe_instances por comando. É atualizado localmente após start/stop/create_tags feitos pelo bot.
+# 'version' muda a cada recarga ou alteração local e faz parte das chaves do cache de renderização.
+INVENTORY_TTL_SECONDS = int(os.environ.get('INVENTORY_TTL_SECONDS', '60'))
+# Idade mínima do cache para recarregá-lo quando um nome/ID não é encontrado (ex: instância recém-criada)
+INVENTORY_MISS_REFRESH_SECONDS = int(os.environ.get('INVENTORY_MISS_REFRESH_SECONDS', '10'))
+
+_inventory = {'loaded_at': None, 'version': 0, 'by_id': {}, 'by_name': {}}
+
+# Tabela de inventário mantida pelo AtualizaInventarioEC2 a partir dos eventos da EC2 (ver
+# comum/inventario.py). Quando configurada, o cache é carregado dela (Scan) e, com o cache
+# frio, uma instância é buscada sozinha (GetItem ou Query no índice de nomes); a EC2 só é
+# consultada quando a instância não está na tabela.
+inventory_store = inventario.store_from_env()
+
+
+def _instance_name(inst):
+    """Retorna o valor da tag 'Name' de uma instância (ou o próprio ID)."""
+    for tag in inst.get('Tags', []):
+        if tag['Key'] == 'Name':
+            return tag['Value']
+    return inst['InstanceId']
+
+
+def _preferred(instances):
+    """Entre instâncias com o mesmo nome, a primeira não encerrada ('terminated')."""
+    return next((inst for inst in instances if inst['State']['Name'] != 'terminated'), instances[0] if instances else None)
+
+
+def ec2_for(instance):
+    """Cliente EC2 da região/conta da instância (campo 'Alvo' do inventário)."""
+    return alvos.get_target(instance.get('Alvo')).ec2()
+
+
+def _load_target_instances(target):
+    """Instâncias de um alvo (describe_instances paginado), só com os campos usados pelo bot."""
+    instances = []
+    for page in target.ec2().get_paginator('describe_instances').paginate():
+        for r in page['Reservations']:
+            for inst in r['Instances']:
+                # Guarda apenas os campos usados pelo bot para manter o cache pequeno
+                slim = {
+                    'InstanceId': inst['InstanceId'],
+                    'State': {'Name': inst['State']['Name']},
+                    'Tags': inst.get('Tags', []),
+                    'Alvo': target.id,
+                }
+                if inst.get('LaunchTime'):
+                    slim['LaunchTime'] = inst['LaunchTime']
+                if inst.get('InstanceType'):
+                    slim['InstanceType'] = inst['InstanceType']
+                instances.append(slim)
+    return instances
+
+
+def _load_table_instances():
+    """Instâncias da tabela de inventário; None se desligada, vazia ou indisponível."""
+    if inventory_store is None:
+        return None
+    try:
+        with metrics.phase('inventory_table'):
+            return inventory_store.scan() or None
+    except Exception as e:
+        logger.warning(f"Tabela de inventário indisponível, usando a EC2: {e}")
+        return None
+
+
+def _set_inventory(by_id):
+    by_name = {}
+    for inst in by_id.values():
+        name = _instance_name(inst).lower()
+        current = by_id.get(by_name.get(name))
+        if current is None or (current['State']['Name'] == 'terminated'
+                               and inst['State']['Name'] != 'terminated'):
+            by_name[name] = inst['InstanceId']
+    _inventory.update(loaded_at=time.monotonic(), version=_inventory['version'] + 1, by_id=by_id, by_name=by_name)
+    return _inventory
+
+
+def load_inventory(from_ec2=False):
+    """
+    Recarrega o inventário completo e reconstrói os índices: da tabela de inventário, se
+    configurada, ou de todos os alvos (describe_instances paginado em cada região/conta, ao
+    mesmo tempo). 'from_ec2' ignora a tabela (ex: instância que ainda não está nela). Um
+    alvo indisponível mantém as instâncias da carga anterior.
+    """
+    instances = None if from_ec2 else _load_table_instances()
+    if instances is not None:
+        _set_inventory({inst['InstanceId']: inst for inst in instances})
+        logger.info(f"Inventário recarregado da tabela: {len(instances)} instância(s)")
+        return _inventory
+
+    by_id = {}
+    with metrics.phase('load_inventory'):
+        results, errors = alvos.fan_out(_load_target_instances)
+    for target_id in errors:
+        by_id.update((i, inst) for i, inst in _inventory['by_id'].items() if inst.get('Alvo') == target_id)
+    for instances in results.values():
+        by_id.update((inst['InstanceId'], inst) for inst in instances)
+    _set_inventory(by_id)
+    logger.info(f"Inventário recarregado: {len(by_id)} instância(s)")
+    return _inventory
+
+
+def _inventory_is_fresh():
+    loaded_at = _inventory['loaded_at']
+    return loaded_at is not None and time.monotonic() - loaded_at <= INVENTORY_TTL_SECONDS
+
+
+def get_inventory():
+    """Retorna o inventário em cache, recarregando-o se expirado."""
+    if not _inventory_is_fresh():
+        return load_inventory()
+    return _inventory
+
+
+def lookup_instance(target):
+    """Uma única instância na tabela de inventário (GetItem pelo ID ou Query pelo nome); None se ausente."""
+    try:
+        with metrics.phase('inventory_table'):
+            if target.startswith("i-"):
+                return inventory_store.get(target)
+            return _preferred(inventory_store.find_by_name(target))
+    except Exception as e:
+        logger.warning(f"Tabela de inventário indisponível, usando a EC2: {e}")
+        return None
+
+
+def find_instance(target):
+    """
+    Busca uma instância pelo ID ou pelo nome (tag 'Name', sem diferenciar maiúsculas).
+    Com a tabela de inventário e o cache frio, consulta só essa instância na tabela.
+    Em caso de falha, recarrega o inventário da EC2 uma vez se o cache não for recente.
+    """
+    with metrics.phase('resolve_instance'):
+        if inventory_store is not None and not _inventory_is_fresh():
+            instance = lookup_instance(target)
+            if instance:
+                return instance
+            # Ausente da tabela (ex: evento ainda não processado): recorre à EC2
+            inventory = load_inventory(from_ec2=True)
+        else:
+            inventory = get_inventory()
+        for attempt in range(2):
+            instance_id = target if target.startswith("i-") else inventory['by_name'].get(target.lower())
+            instance = inventory['by_id'].get(instance_id)
+            if instance or time.monotonic() - inventory['loaded_at'] < INVENTORY_MISS_REFRESH_SECONDS:
+                return instance
+            if attempt == 0:
+                inventory = load_inventory(from_ec2=True)
+        return None
+
+
+def update_cached_instance(instance_id, state=None, tags=None, launch_time=None):
+    """Atualiza no cache o estado, as tags e/ou o LaunchTime de uma instância após uma ação do próprio bot."""
+    instance = _inventory['by_id'].get(instance_id)
+    if not instance:
+        return
+    before = (instance['State'], instance.get('LaunchTime'), instance.get('Tags'))
+    if state:
+        instance['State'] = {'Name': state}
+    if launch_time:
+        instance['LaunchTime'] = launch_time
+    if tags:
+        merged = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+        merged.update({tag['Key']: tag['Value'] for tag in tags})
+        instance['Tags'] = [{'Key': k, 'Value': v} for k, v in merged.items()]
+    # O status em lote reconfirma estados inalterados: só uma mudança real invalida os cards em cache
+    if (instance['State'], instance.get('LaunchTime'), instance.get('Tags')) != before:
+        _inventory['version'] += 1
+
 
 def get_instance_name_from_id(instance_id):
     """Obtém o nome da tag 'Name' de uma instância EC2 dado seu ID."""
     try:
-        res = ec2.describe_instances(InstanceIds=[instance_id])
-        if res['Reservations']:
-            tags = {tag['Key']: tag['Value'] for tag in res['Reservations'][0]['Instances'][0].get('Tags', [])}
-            return tags.get('Name', instance_id)
+        instance = get_inventory()['by_id'].get(instance_id)
+        if instance:
+            return _instance_name(instance)
     except Exception as e:
         logger.warning(f"Não foi possível obter o nome da instância {instance_id}: {e}")
     return instance_id # Retorna o ID se o nome não for encontrado ou houver erro
@@ -97,32 +338,85 @@ def mention_admin_users(requester_name, action, instance_identifier):
         "actionResponse": {"type": "NEW_MESSAGE"}
     })
 
-def build_instance_menu():
+def parse_menu_filters(filter_terms):
     """
-    Constrói um card com botões para iniciar/parar instâncias, 
-    buscando todas as instâncias EC2.
+    Converte os termos do comando 'menu' em filtros da API da EC2:
+    - estado (running, stopped, ...)  -> instance-state-name
+    - tag:<chave>=<valor>              -> tag:<chave>
+    - qualquer outro termo             -> prefixo da tag 'Name'
     """
-    res = ec2.describe_instances()
-    widgets = []
+    filters = []
+    for term in filter_terms:
+        tag = parse_tag_target(term)
+        if term in INSTANCE_STATES:
+            filters.append({'Name': 'instance-state-name', 'Values': [term]})
+        elif tag:
+            filters.append({'Name': f"tag:{tag[0]}", 'Values': [tag[1]]})
+        else:
+            filters.append({'Name': 'tag:Name', 'Values': [f"{term}*"]})
+    return filters
 
-    for r in res['Reservations']:
-        for inst in r['Instances']:
-            instance_id = inst['InstanceId']
-            state = inst['State']['Name']
-            tags = {tag['Key']: tag['Value'] for tag in inst.get('Tags', [])}
-            name = tags.get('Name', instance_id)
 
-            widgets.append({
+def matches_menu_filters(inst, filter_terms):
+    """Aplica a uma instância do inventário os mesmos filtros de parse_menu_filters (com os curingas da EC2)."""
+    tags = {tag['Key']: tag['Value'] for tag in inst.get('Tags', [])}
+    for flt in parse_menu_filters(filter_terms):
+        name, value = flt['Name'], flt['Values'][0]
+        if name == 'instance-state-name':
+            if inst['State']['Name'] != value:
+                return False
+        elif name[len('tag:'):] not in tags or not fnmatch.fnmatchcase(tags[name[len('tag:'):]], value):
+            return False
+    return True
+
+
+def get_menu_page(filter_text, cursor):
+    """
+    Retorna (instâncias da página, cursor da próxima página ou None).
+    Sem filtro a página é recortada do inventário em cache (cursor = posição);
+    com filtro, é lida com o paginador da EC2 e filtros no servidor (cursor = token do paginador).
+    """
+    if not filter_text or alvos.is_multi_target():
+        # Com vários alvos o filtro é aplicado ao inventário (já reunido de todos eles),
+        # para que um único cursor percorra as páginas de todas as regiões/contas
+        offset = int(cursor or 0)
+        instances = list(get_inventory()['by_id'].values())
+        if filter_text:
+            instances = [inst for inst in instances if matches_menu_filters(inst, filter_text.split())]
+        next_offset = offset + MENU_PAGE_SIZE
+        return instances[offset:next_offset], (str(next_offset) if next_offset < len(instances) else None)
+
+    # O paginador conta reservas, e uma reserva pode conter várias instâncias: o cursor
+    # guarda também quantas instâncias da página atual já foram exibidas ("<token>|<posição>")
+    token, _, skip = (cursor or '').partition('|')
+    skip = int(skip or 0)
+    result = alvos.DEFAULT_TARGET.ec2().get_paginator('describe_instances').paginate(
+        Filters=parse_menu_filters(filter_text.split()),
+        PaginationConfig={'MaxItems': MENU_PAGE_SIZE, 'PageSize': MENU_PAGE_SIZE, 'StartingToken': token or None}
+    ).build_full_result()
+    instances = [inst for r in result.get('Reservations', []) for inst in r['Instances']][skip:]
+    if len(instances) > MENU_PAGE_SIZE:
+        return instances[:MENU_PAGE_SIZE], f"{token}|{skip + MENU_PAGE_SIZE}"
+    return instances, result.get('NextToken')
+
+
+def _menu_instance_widgets(inst):
+    """Widgets de uma instância no menu, já serializados (em cache por ID, nome e estado)."""
+    instance_id = inst['InstanceId']
+    state = inst['State']['Name']
+    name = _instance_name(inst)
+
+    def build():
+        # Botão para solicitar ação (start/stop)
+        action_name = f"solicitar_start_{instance_id}" if state != 'running' else f"solicitar_stop_{instance_id}"
+        action_text = "Solicitar LIGAR" if state != 'running' else "Solicitar DESLIGAR"
+        return [
+            {
                 "textParagraph": {
                     "text": f"<b>{name}</b> ({instance_id}) - {state}"
                 }
-            })
-
-            # Botão para solicitar ação (start/stop)
-            action_name = f"solicitar_start_{instance_id}" if state != 'running' else f"solicitar_stop_{instance_id}"
-            action_text = "Solicitar LIGAR" if state != 'running' else "Solicitar DESLIGAR"
-
-            widgets.append({
+            },
+            {
                 "buttons": [
                     {
                         "textButton": {
@@ -135,116 +429,718 @@ def build_instance_menu():
                         }
                     }
                 ]
-            })
+            }
+        ]
+
+    return render_cache.render(('menu_instancia', instance_id, name, state), build)
+
+
+def build_instance_menu(filter_text="", cursor=None, page_number=1):
+    """
+    Constrói um card com botões para iniciar/parar instâncias, uma página por vez
+    (MENU_PAGE_SIZE instâncias). O botão "Próxima página" carrega o filtro e o cursor
+    da continuação, de modo que cada clique processa apenas uma página.
+
+    Sem filtro, a página inteira fica em cache pela versão do inventário (o card é o
+    mesmo para qualquer usuário); com filtro, só os widgets de cada instância.
+    """
+    page_key = None
+    if not filter_text:
+        page_key = ('menu_pagina', get_inventory()['version'], cursor or '', page_number)
+        cached = render_cache.get(page_key)
+        if cached is not None:
+            return response(None, cached)
+
+    instances, next_cursor = get_menu_page(filter_text, cursor)
+    with metrics.phase('render'):
+        widgets = [_menu_instance_widgets(inst) for inst in instances]
+
+        if not widgets:
+            widgets.append(renderizacao.dumps([{"textParagraph": {"text": "Nenhuma instância encontrada."}}]))
+
+        if next_cursor:
+            widgets.append(renderizacao.dumps([{
+                "buttons": [
+                    {
+                        "textButton": {
+                            "text": "Próxima página ➡️",
+                            "onClick": {
+                                "action": {
+                                    "actionMethodName": "menu_proxima_pagina",
+                                    "parameters": [
+                                        {"key": "filtro", "value": filter_text},
+                                        {"key": "cursor", "value": next_cursor},
+                                        {"key": "pagina", "value": str(page_number + 1)}
+                                    ]
+                                }
+                            }
+                        }
+                    }
+                ]
+            }]))
+
+        subtitle = 'Clique para solicitar uma ação'
+        if filter_text:
+            subtitle += f" | Filtro: {filter_text}"
+        body = renderizacao.card_body(
+            {'title': f'Menu de Instâncias EC2 (página {page_number})', 'subtitle': subtitle},
+            [renderizacao.section(widgets)],
+            # Cliques em "Próxima página" substituem o card anterior em vez de criar outra mensagem
+            {'type': 'UPDATE_MESSAGE'} if page_number > 1 else None
+        )
+        if page_key:
+            render_cache.put(page_key, body)
+    return response(None, body)
+
+def chunks(items, size):
+    """Divide uma lista em blocos de no máximo 'size' elementos."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def action_tags(command, user_name):
+    """Tags de rastreamento gravadas nas instâncias após um start/stop feito pelo bot."""
+    tags = [{'Key': 'LastActionBy', 'Value': f"{user_name} - {command}"}]
+    if command == "stop":
+        tags.append({'Key': 'StoppedAt', 'Value': datetime.now(timezone(timedelta(hours=-3))).isoformat()}) # Armazena o tempo em UTC-3
+    return tags
+
+
+def record_usage(command, instance_ids, user_email):
+    """Registra as transições no relatório de uso; falhas no registro não afetam o comando."""
+    if usage_store is None or not instance_ids:
+        return
+    now = datetime.now(timezone.utc)
+    try:
+        with metrics.phase('usage_write'):
+            usage_store.record([(instance_id, command, now, user_email) for instance_id in instance_ids], 'bot')
+    except Exception as e:
+        logger.warning(f"Não foi possível registrar {command} de {len(instance_ids)} instância(s) no relatório de uso: {e}")
+
+
+# --- Ações em massa (start/stop tag:<chave>=<valor> ou start/stop <padrão do nome>) ---
+# Instâncias por chamada de start/stop/create_tags
+BULK_ACTION_BATCH_SIZE = int(os.environ.get('BULK_ACTION_BATCH_SIZE', '100'))
+# Nomes listados por categoria no card de resumo
+BULK_SUMMARY_MAX_NAMES = 30
+# Estados em que cada ação é aplicada; as demais instâncias do conjunto são apenas listadas.
+# Uma instância 'pending' não pode ser parada (IncorrectInstanceState): fica para um novo stop.
+BULK_ACTION_STATES = {"start": ("stopped",), "stop": ("running",)}
+
+
+def parse_tag_target(target):
+    """(chave, valor) de um alvo tag:<chave>=<valor>, ou None se o alvo não for de tag."""
+    if target[:len('tag:')].lower() == 'tag:' and '=' in target:
+        key, value = target[len('tag:'):].split('=', 1)
+        return key, value
+    return None
+
+
+def is_bulk_target(target):
+    """Indica se o alvo seleciona um conjunto de instâncias: tag:<chave>=<valor> ou nome com '*'/'?'."""
+    return parse_tag_target(target) is not None or '*' in target or '?' in target
+
+
+def bulk_target_filters(target):
+    """
+    Filtros da EC2 para o alvo de uma ação em massa (instâncias encerradas ficam de fora).
+    Como os filtros da EC2, diferenciam maiúsculas de minúsculas (ver matches_bulk_target).
+    """
+    tag = parse_tag_target(target)
+    if tag:
+        target_filter = {'Name': f"tag:{tag[0]}", 'Values': [tag[1]]}
+    else:
+        target_filter = {'Name': 'tag:Name', 'Values': [target]}
+    return [target_filter, {'Name': 'instance-state-name', 'Values': ["pending", "running", "stopping", "stopped"]}]
+
+
+def resolve_bulk_target(target):
+    """
+    Resolve o conjunto inteiro com um describe_instances paginado e filtrado na EC2 por
+    alvo (todas as regiões/contas ao mesmo tempo). As instâncias recebem o campo 'Alvo'.
+    """
+    def describe(alvo):
+        pages = alvo.ec2().get_paginator('describe_instances').paginate(
+            Filters=bulk_target_filters(target),
+            PaginationConfig={'PageSize': 1000}
+        )
+        return [{**inst, 'Alvo': alvo.id} for page in pages for r in page['Reservations'] for inst in r['Instances']]
+
+    with metrics.phase('resolve_instance'):
+        results, _ = alvos.fan_out(describe)
+    return [inst for instances in results.values() for inst in instances]
+
+
+def run_bulk_action(command, instances, tags):
+    """
+    Aplica start/stop e as tags de rastreamento em blocos de BULK_ACTION_BATCH_SIZE instâncias,
+    com o cliente da região/conta de cada uma (os alvos são processados ao mesmo tempo).
+    Retorna ({id aplicado: mudou de estado}, {id: erro}): um ID rejeitado pela EC2 (ex: estado que não aceita a
+    ação) vira erro só dele, e a falha de um bloco não interrompe os demais.
+    """
+    def run(alvo, instance_ids):
+        ec2 = alvo.ec2()
+        aplicadas, erros = {}, {}
+        for lote in chunks(instance_ids, BULK_ACTION_BATCH_SIZE):
+            try:
+                # IDs rejeitados pela EC2 são isolados sem perder o restante do bloco
+                aceitas, erros_lote = run_ec2_action(command, lote, alvo)
+            except ec2.exceptions.ClientError as e:
+                logger.error(f"Erro ao aplicar {command} em {len(lote)} instância(s) de {alvo.id}: {str(e)}")
+                erros.update((instance_id, "limitada pela AWS, tente novamente") for instance_id in lote)
+                continue
+            for instance_id, motivo in erros_lote.items():
+                logger.error(f"Erro ao aplicar {command} na instância {instance_id}: {motivo}")
+            aplicadas.update((instance_id, aceitas[instance_id]) for instance_id in lote if instance_id in aceitas)
+            erros.update(erros_lote)
+        for lote in chunks(list(aplicadas), BULK_ACTION_BATCH_SIZE):
+            try:
+                ec2.create_tags(Resources=lote, Tags=tags)
+            except ec2.exceptions.ClientError as e:
+                logger.warning(f"Não foi possível gravar as tags de rastreamento em {len(lote)} instância(s): {str(e)}")
+        return aplicadas, erros
+
+    grupos = {alvo.id: [inst['InstanceId'] for inst in lista]
+              for alvo, lista in alvos.group_by_target(instances, lambda inst: inst.get('Alvo')).items()}
+    aplicadas, erros = {}, {}
+    with metrics.phase('ec2_action'):
+        # Sem timeout: uma ação já enviada não é dada como falha enquanto ainda pode ser aplicada
+        results, falhas = alvos.fan_out(lambda alvo: run(alvo, grupos[alvo.id]),
+                                        [alvos.get_target(target_id) for target_id in grupos], timeout=None) if grupos else ({}, {})
+    for aplicadas_alvo, erros_alvo in results.values():
+        aplicadas.update(aplicadas_alvo)
+        erros.update(erros_alvo)
+    for target_id, erro in falhas.items():
+        erros.update((instance_id, f"região/conta {target_id} indisponível") for instance_id in grupos[target_id])
+    return aplicadas, erros
+
+
+def _bulk_names(instances):
+    names = sorted(_instance_name(inst) for inst in instances)
+    text = ", ".join(names[:BULK_SUMMARY_MAX_NAMES])
+    if len(names) > BULK_SUMMARY_MAX_NAMES:
+        text += f" e mais {len(names) - BULK_SUMMARY_MAX_NAMES}"
+    return text
+
+
+def bulk_instance_action(command, target, user_name, user_email):
+    """
+    start/stop em massa: resolve o conjunto, aplica as permissões (ALLOWED_ADMIN_USERS /
+    UNRESTRICTED_INSTANCES_BY_NAME) instância a instância, executa a ação em blocos e
+    responde com um único card de resumo.
+    """
+    instances = resolve_bulk_target(target)
+    if not instances:
+        return response(f"Nenhuma instância encontrada para '{target}'.")
+
+    is_admin = user_email in ALLOWED_ADMIN_USERS
+    alvo, ignoradas, negadas = [], [], []
+    for inst in instances:
+        if not is_admin and _instance_name(inst).lower() not in UNRESTRICTED_INSTANCES_BY_NAME:
+            negadas.append(inst)
+        elif inst['State']['Name'] not in BULK_ACTION_STATES[command]:
+            ignoradas.append(inst)
+        else:
+            alvo.append(inst)
+
+    tags = action_tags(command, user_name)
+    aplicadas, erros = run_bulk_action(command, alvo, tags)
+    for instance_id in aplicadas:
+        if command == "start":
+            update_cached_instance(instance_id, state='pending', tags=tags, launch_time=datetime.now(timezone.utc))
+        else:
+            update_cached_instance(instance_id, state='stopping', tags=tags)
+    # Só as que mudaram de estado entram no relatório de uso
+    record_usage(command, [instance_id for instance_id, mudou in aplicadas.items() if mudou], user_email)
+    metrics.add_value('InstanciasEmMassa', len(aplicadas))
 
-    card = {
+    by_id = {inst['InstanceId']: inst for inst in instances}
+    verbo = "iniciada(s)" if command == "start" else "desligada(s)"
+    widgets = []
+    if aplicadas:
+        widgets.append({"textParagraph": {"text": f"<b>✅ {len(aplicadas)} {verbo}:</b> {_bulk_names(by_id[i] for i in aplicadas)}"}})
+    if ignoradas:
+        widgets.append({"textParagraph": {"text": f"<b>⏭️ {len(ignoradas)} já em outro estado:</b> {_bulk_names(ignoradas)}"}})
+    if negadas:
+        widgets.append({"textParagraph": {"text": f"<b>🚫 {len(negadas)} sem permissão:</b> {_bulk_names(negadas)}"}})
+    erros_por_motivo = {}
+    for instance_id, motivo in erros.items():
+        erros_por_motivo.setdefault(motivo, []).append(by_id[instance_id])
+    for motivo, lista in erros_por_motivo.items():
+        widgets.append({"textParagraph": {"text": f"<b>❌ {len(lista)} com erro ({motivo}):</b> {_bulk_names(lista)}"}})
+
+    return response(None, {
         'cards': [
             {
                 'header': {
-                    'title': 'Menu de Instâncias EC2',
-                    'subtitle': 'Clique para solicitar uma ação'
+                    'title': f"{'🚀' if command == 'start' else '🛑'} {command.upper()} em massa: {target}",
+                    'subtitle': f"{len(instances)} instância(s) encontrada(s) | por {user_name}"
                 },
-                'sections': [
-                    {
-                        'widgets': widgets
-                    }
-                ]
+                'sections': [{'widgets': widgets}]
             }
         ]
+    })
+
+
+def resolve_instance_names(instance_ids):
+    """
+    Retorna {id: nome} para os IDs informados (sem repetição).
+    Usa o inventário em cache e consulta a EC2 apenas para os IDs ausentes, em blocos
+    e com filtro 'instance-id', que ao contrário de InstanceIds não falha por causa de
+    um único ID inexistente (ex: instância encerrada).
+    """
+    names = {}
+    missing = []
+    try:
+        by_id = get_inventory()['by_id']
+    except Exception as e:
+        logger.warning(f"Não foi possível carregar o inventário: {e}")
+        by_id = {}
+    for instance_id in dict.fromkeys(instance_ids):
+        if instance_id in by_id:
+            names[instance_id] = _instance_name(by_id[instance_id])
+        else:
+            missing.append(instance_id)
+
+    def describe(alvo):
+        found = {}
+        paginator = alvo.ec2().get_paginator('describe_instances')
+        for chunk in chunks(missing, EC2_FILTER_MAX_VALUES):
+            for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': chunk}]):
+                for r in page['Reservations']:
+                    for inst in r['Instances']:
+                        found[inst['InstanceId']] = _instance_name(inst)
+        return found
+
+    if missing:
+        # Um ID ausente do inventário pode estar em qualquer região/conta
+        try:
+            results, _ = alvos.fan_out(describe)
+            for found in results.values():
+                names.update(found)
+        except Exception as e:
+            logger.warning(f"Não foi possível obter nomes das instâncias: {e}")
+    return names
+
+
+def get_pending_schedules_page(cursor):
+    """
+    Lê uma página de agendamentos pendentes em ordem de horário pelo índice de pendentes.
+    Retorna (agendamentos, cursor da próxima página ou None). O cursor é a chave do
+    último item exibido serializada em JSON.
+    """
+    query_kwargs = {
+        'IndexName': PENDING_INDEX_NAME,
+        'KeyConditionExpression': "fila = :pendente",
+        'ExpressionAttributeValues': {":pendente": "pendente"},
+        # Um item a mais indica se existe próxima página sem precisar de outra consulta
+        'Limit': SCHEDULES_PAGE_SIZE + 1,
     }
-    return response(None, card)
+    if cursor:
+        query_kwargs['ExclusiveStartKey'] = json.loads(cursor)
+    agendamentos = tabela_agendamentos.query(**query_kwargs).get('Items', [])
+    if len(agendamentos) <= SCHEDULES_PAGE_SIZE:
+        return agendamentos, None
+    agendamentos = agendamentos[:SCHEDULES_PAGE_SIZE]
+    last = agendamentos[-1]
+    return agendamentos, json.dumps({'id': last['id'], 'fila': last['fila'], 'horario': last['horario']})
 
-def list_scheduled_tasks(requesting_user_email):
+
+def _schedule_section(agendamento, instance_display_name, is_admin):
+    """
+    Seção de um agendamento, já serializada. A chave do cache inclui os campos exibidos,
+    o nome da instância e a classe de permissão de quem vê (admins têm o botão "Deletar").
     """
-    Lista todos os agendamentos pendentes de ações em instâncias EC2.
+    def build():
+        horario_utc = datetime.fromisoformat(agendamento['horario'])
+        # Ajuste o timezone conforme sua região (ex: UTC-3 para Brasília)
+        horario_local = horario_utc.astimezone(timezone(timedelta(hours=-3)))
+
+        requester_email = agendamento.get('solicitante', 'desconhecido@example.com')
+        requester_display = requester_email.split('@')[0] # Nome simples do e-mail
+
+        widgets = []
+        widgets.append({
+            "textParagraph": {
+                "text": (f"<b>{horario_local.strftime('%d/%m %H:%M')}</b> | "
+                         f"<b>{agendamento['acao'].upper()}</b> | "
+                         f"{instance_display_name} ({agendamento['instancia']})\n"
+                         + (f"🔁 {recorrencia.describe(agendamento['recorrencia'])}\n" if agendamento.get('recorrencia') else "")
+                         + f"<i>Solicitado por: {requester_display}</i>")
+            }
+        })
+
+        # Adiciona botão de deletar apenas para usuários com permissão
+        if is_admin:
+            widgets.append({
+                "buttons": [
+                    {
+                        "textButton": {
+                            "text": "Deletar",
+                            "onClick": {
+                                "action": {
+                                    "actionMethodName": f"deletar_agendamento_{agendamento['id']}"
+                                }
+                            }
+                        }
+                    }
+                ]
+            })
+        return {'widgets': widgets}
+
+    key = ('agendamento', agendamento['id'], agendamento['horario'], agendamento['acao'], agendamento['instancia'],
+           agendamento.get('recorrencia'), agendamento.get('solicitante'), instance_display_name, is_admin)
+    return render_cache.render(key, build)
+
+
+def list_scheduled_tasks(requesting_user_email, cursor=None, page_number=1):
+    """
+    Lista os agendamentos pendentes de ações em instâncias EC2, uma página por vez.
     Permite deletar agendamentos para usuários permitidos.
+
+    A página é sempre lida do índice de pendentes (a tabela também é alterada pelo
+    executor e por outros containers): o próprio resultado da consulta é a versão, e
+    cada agendamento reaproveita a seção já serializada enquanto seus campos não mudam.
     """
     try:
-        response_db = tabela_agendamentos.scan(
-            FilterExpression=boto3.dynamodb.conditions.Attr('status').eq('pendente')
-        )
-        agendamentos = response_db['Items']
+        agendamentos, next_cursor = get_pending_schedules_page(cursor)
 
         if not agendamentos:
             return response("📋 Não há agendamentos pendentes no momento.")
 
         # Obtém nomes das instâncias para melhor exibição
-        instance_ids = [a['instancia'] for a in agendamentos]
-        instance_names = {}
-        if instance_ids:
-            try:
-                res = ec2.describe_instances(InstanceIds=instance_ids)
-                for r in res['Reservations']:
-                    for inst in r['Instances']:
-                        tags = {tag['Key']: tag['Value'] for tag in inst.get('Tags', [])}
-                        instance_names[inst['InstanceId']] = tags.get('Name', inst['InstanceId'])
-            except Exception as e:
-                logger.warning(f"Não foi possível obter nomes das instâncias: {e}")
-
-        card_sections = []
-        sorted_agendamentos = sorted(agendamentos, key=lambda x: x['horario'])
-
-        for agendamento in sorted_agendamentos:
-            horario_utc = datetime.fromisoformat(agendamento['horario'])
-            # Ajuste o timezone conforme sua região (ex: UTC-3 para Brasília)
-            horario_local = horario_utc.astimezone(timezone(timedelta(hours=-3))) 
-            
-            instance_display_name = instance_names.get(agendamento['instancia'], agendamento['instancia'])
-            
-            requester_email = agendamento.get('solicitante', 'desconhecido@example.com')
-            requester_display = requester_email.split('@')[0] # Nome simples do e-mail
+        instance_names = resolve_instance_names([a['instancia'] for a in agendamentos])
+        is_admin = requesting_user_email in ALLOWED_ADMIN_USERS
 
-            widgets = []
-            widgets.append({
-                "textParagraph": {
-                    "text": (f"<b>{horario_local.strftime('%d/%m %H:%M')}</b> | "
-                             f"<b>{agendamento['acao'].upper()}</b> | "
-                             f"{instance_display_name} ({agendamento['instancia']})\n"
-                             f"<i>Solicitado por: {requester_display}</i>")
-                }
-            })
+        with metrics.phase('render'):
+            card_sections = [
+                _schedule_section(agendamento, instance_names.get(agendamento['instancia'], agendamento['instancia']), is_admin)
+                for agendamento in agendamentos
+            ]
 
-            # Adiciona botão de deletar apenas para usuários com permissão
-            if requesting_user_email in ALLOWED_ADMIN_USERS:
-                widgets.append({
-                    "buttons": [
-                        {
-                            "textButton": {
-                                "text": "Deletar",
-                                "onClick": {
-                                    "action": {
-                                        "actionMethodName": f"deletar_agendamento_{agendamento['id']}"
+            if next_cursor:
+                card_sections.append(renderizacao.dumps({
+                    'widgets': [{
+                        "buttons": [
+                            {
+                                "textButton": {
+                                    "text": "Próxima página ➡️",
+                                    "onClick": {
+                                        "action": {
+                                            "actionMethodName": "agendamentos_proxima_pagina",
+                                            "parameters": [
+                                                {"key": "cursor", "value": next_cursor},
+                                                {"key": "pagina", "value": str(page_number + 1)}
+                                            ]
+                                        }
                                     }
                                 }
                             }
-                        }
-                    ]
-                })
-            
-            card_sections.append({
-                'widgets': widgets
-            })
-        
-        if not card_sections:
-            return response("📋 Não há agendamentos pendentes no momento.")
+                        ]
+                    }]
+                }))
 
-        card = {
-            'cards': [
-                {
-                    'header': {
-                        'title': '📋 Agendamentos Pendentes',
-                        'subtitle': 'Gerencie seus agendamentos'
-                    },
-                    'sections': card_sections
-                }
-            ]
-        }
-        return response(None, card)
+            body = renderizacao.card_body(
+                {'title': f'📋 Agendamentos Pendentes (página {page_number})', 'subtitle': 'Gerencie seus agendamentos'},
+                card_sections,
+                {'type': 'UPDATE_MESSAGE'} if page_number > 1 else None
+            )
+        return response(None, body)
 
     except Exception as e:
         logger.error("Erro ao listar agendamentos:", exc_info=True)
         return response(f"Erro ao listar agendamentos: {str(e)}")
 
+# --- Status em lote e 'aguardar' ---
+# IDs por chamada de describe_instance_status (máximo da API) e tamanho da página sem IDs
+STATUS_BATCH_SIZE = 100
+STATUS_PAGE_SIZE = 1000
+# Linhas de instâncias exibidas na resposta do status em lote
+STATUS_MAX_LINES = 50
+# Espera máxima (s) do 'aguardar' na continuação diferida e quando processado de forma síncrona.
+# A síncrona fica em poucos segundos: o webhook precisa responder rápido, senão o Google Chat reenvia
+# o evento e o reenvio começa outra espera
+WAIT_MAX_SECONDS = int(os.environ.get('WAIT_MAX_SECONDS', '300'))
+WAIT_SYNC_MAX_SECONDS = int(os.environ.get('WAIT_SYNC_MAX_SECONDS', '3'))
+# Intervalo inicial e máximo (s) entre as consultas do 'aguardar' (backoff exponencial com jitter)
+WAIT_POLL_INITIAL_SECONDS = float(os.environ.get('WAIT_POLL_INITIAL_SECONDS', '2'))
+WAIT_POLL_MAX_SECONDS = float(os.environ.get('WAIT_POLL_MAX_SECONDS', '15'))
+# Estados que podem ser aguardados e estados dos quais a instância não sai mais
+WAIT_TARGET_STATES = ("running", "stopped")
+FINAL_STATES = ("shutting-down", "terminated")
+
+
+def matches_bulk_target(inst, target):
+    """
+    Aplica a uma instância do inventário em cache o mesmo critério de bulk_target_filters:
+    chave e valor exatos (com '*'/'?'), diferenciando maiúsculas de minúsculas como a EC2.
+    """
+    tag = parse_tag_target(target)
+    if tag:
+        tags = {t['Key']: t['Value'] for t in inst.get('Tags', [])}
+        return tag[0] in tags and fnmatch.fnmatchcase(tags[tag[0]], tag[1])
+    return fnmatch.fnmatchcase(_instance_name(inst), target)
+
+
+def resolve_targets(targets):
+    """
+    Resolve vários alvos (IDs, nomes, tag:<chave>=<valor> ou padrões com '*'/'?') pelo
+    inventário em cache, sem chamadas à EC2. Retorna (instâncias sem repetição, alvos não encontrados).
+    """
+    found, missing = {}, []
+    for target in targets:
+        if is_bulk_target(target):
+            matches = [inst for inst in get_inventory()['by_id'].values()
+                       if inst['State']['Name'] not in FINAL_STATES and matches_bulk_target(inst, target)]
+        else:
+            instance = find_instance(target)
+            matches = [instance] if instance else []
+        if not matches:
+            missing.append(target)
+        for inst in matches:
+            found[inst['InstanceId']] = inst
+    return list(found.values()), missing
+
+
+def describe_states(instances):
+    """
+    Estado atual e verificações de saúde das instâncias resolvidas (com 'Alvo'), com uma
+    chamada de describe_instance_status para cada STATUS_BATCH_SIZE IDs (limite da API).
+    Para conjuntos grandes, paginar a conta inteira (STATUS_PAGE_SIZE por página) e descartar
+    as demais instâncias sai mais barato, mas só quando o tamanho da frota do alvo é conhecido
+    pelo inventário em cache. Cada região/conta é consultada com o próprio cliente, ao mesmo
+    tempo. Retorna {id: (estado, verificações)}.
+    """
+    grupos = {alvo.id: [inst['InstanceId'] for inst in insts] for alvo, insts in alvos.group_by_target(
+        instances, lambda inst: inst.get('Alvo')).items()}
+    fleet_sizes = {}
+    for inst in _inventory['by_id'].values():
+        fleet_sizes[inst.get('Alvo')] = fleet_sizes.get(inst.get('Alvo'), 0) + 1
+
+    def describe(alvo):
+        ids = grupos[alvo.id]
+        ec2 = alvo.ec2()
+        fleet_size = fleet_sizes.get(alvo.id, 0)
+        if fleet_size and -(-len(ids) // STATUS_BATCH_SIZE) > -(-fleet_size // STATUS_PAGE_SIZE):
+            pages = ec2.get_paginator('describe_instance_status').paginate(
+                IncludeAllInstances=True, PaginationConfig={'PageSize': STATUS_PAGE_SIZE})
+        else:
+            pages = (ec2.describe_instance_status(InstanceIds=lote, IncludeAllInstances=True)
+                     for lote in chunks(ids, STATUS_BATCH_SIZE))
+        return [st for res in pages for st in res.get('InstanceStatuses', [])]
+
+    results, _ = alvos.fan_out(describe, [alvos.get_target(target_id) for target_id in grupos]) if grupos else ({}, {})
+    wanted = {inst['InstanceId'] for inst in instances}
+    states = {}
+    for statuses in results.values():
+        for st in statuses:
+            if st['InstanceId'] not in wanted:
+                continue
+            state = st['InstanceState']['Name']
+            checks = {st.get('InstanceStatus', {}).get('Status'), st.get('SystemStatus', {}).get('Status')}
+            states[st['InstanceId']] = (state, checks)
+            update_cached_instance(st['InstanceId'], state=state)
+    return states
+
+
+def _checks_text(checks):
+    if 'impaired' in checks:
+        return " ⚠️ verificações com falha"
+    if 'initializing' in checks:
+        return " ⏳ verificações em andamento"
+    if checks == {'ok'}:
+        return " ✅ verificações ok"
+    return ""
+
+
+def _missing_text(missing):
+    return f"\n❓ Não encontrada(s): {', '.join(missing)}" if missing else ""
+
+
+def batch_status(targets):
+    """Status de várias instâncias (ou de uma tag/padrão) com describe_instance_status em lote."""
+    instances, missing = resolve_targets(targets)
+    if not instances:
+        return response(f"Nenhuma instância encontrada para '{' '.join(targets)}'.")
+    with metrics.phase('ec2_status'):
+        states = describe_states(instances)
+
+    por_estado = {}
+    linhas = []
+    for inst in sorted(instances, key=lambda i: _instance_name(i).lower()):
+        state, checks = states.get(inst['InstanceId'], (inst['State']['Name'], set()))
+        por_estado[state] = por_estado.get(state, 0) + 1
+        linhas.append(f"• {_instance_name(inst)} ({inst['InstanceId']}): {state}{_checks_text(checks)}")
+    if len(linhas) > STATUS_MAX_LINES:
+        linhas = linhas[:STATUS_MAX_LINES] + [f"... e mais {len(linhas) - STATUS_MAX_LINES}"]
+
+    resumo = ", ".join(f"{n} {state}" for state, n in sorted(por_estado.items()))
+    return response(f"📊 Status de {len(instances)} instância(s): {resumo}\n" + "\n".join(linhas) + _missing_text(missing))
+
+
+def wait_for_state(target_state, targets, max_wait_seconds):
+    """
+    Consulta o estado das instâncias com backoff até todas chegarem a 'target_state' ou a
+    espera passar de max_wait_seconds. Cada consulta é uma única chamada de
+    describe_instance_status para o conjunto inteiro (até STATUS_BATCH_SIZE instâncias).
+    Responde com uma única mensagem de conclusão.
+    """
+    instances, missing = resolve_targets(targets)
+    if not instances:
+        return response(f"Nenhuma instância encontrada para '{' '.join(targets)}'.")
+    names = {inst['InstanceId']: _instance_name(inst) for inst in instances}
+
+    started = time.monotonic()
+    delay = WAIT_POLL_INITIAL_SECONDS
+    consultas = 0
+    with metrics.phase('wait_state'):
+        while True:
+            states = describe_states(instances)
+            consultas += 1
+            pendentes = {i: states.get(i, ('desconhecido', set()))[0] for i in names}
+            pendentes = {i: state for i, state in pendentes.items() if state != target_state}
+            # Instâncias encerradas nunca chegarão ao estado pedido: não adianta esperar por elas
+            if all(state in FINAL_STATES for state in pendentes.values()):
+                break
+            if time.monotonic() - started + delay > max_wait_seconds:
+                break
+            time.sleep(delay * random.uniform(0.8, 1.2))
+            delay = min(delay * 2, WAIT_POLL_MAX_SECONDS)
+    metrics.add_value('ConsultasAguardar', consultas)
+
+    elapsed = int(time.monotonic() - started)
+    prontas = len(names) - len(pendentes)
+    if not pendentes:
+        msg = f"✅ {prontas} instância(s) em {target_state} após {elapsed}s: {', '.join(sorted(names.values()))}"
+    else:
+        titulo = "⛔ Instância(s) encerrada(s)" if all(state in FINAL_STATES for state in pendentes.values()) \
+            else f"⏱ Limite de espera de {max_wait_seconds}s atingido"
+        msg = (f"{titulo}: {prontas} de {len(names)} em {target_state}.\n"
+               f"Pendentes: {', '.join(f'{names[i]} ({state})' for i, state in sorted(pendentes.items(), key=lambda p: names[p[0]]))}")
+        if not DEFERRED_RESPONSES and not all(state in FINAL_STATES for state in pendentes.values()):
+            msg += f"\nℹ️ Sem resposta diferida (DEFERRED_RESPONSES) a espera é limitada a {max_wait_seconds}s; repita o comando ou habilite-a."
+    return response(msg + _missing_text(missing))
+
+
+def usage_report(days):
+    """
+    Horas ligadas e custo estimado da frota nos últimos 'days' dias (UTC-3), somando os
+    agregados diários de comum/uso.py e os intervalos das instâncias ainda ligadas.
+    Nomes e tipos vêm do inventário em cache.
+    """
+    if usage_store is None:
+        return response("📈 O relatório de uso não está configurado (USAGE_TABLE_NAME).")
+
+    now = datetime.now(timezone.utc)
+    today = now.astimezone(recorrencia.LOCAL_TZ).date()
+    first_day = today - timedelta(days=days - 1)
+    dias = [(first_day + timedelta(days=n)).isoformat() for n in range(days)]
+    with metrics.phase('usage_read'):
+        rollups, running = usage_store.read(dias)
+    por_dia, por_instancia = uso.summarize(
+        rollups, running, datetime.combine(first_day, datetime.min.time(), tzinfo=recorrencia.LOCAL_TZ), now)
+    if not por_instancia:
+        return response(f"📈 Nenhum tempo ligado registrado nos últimos {days} dia(s).")
+
+    inventory = get_inventory()['by_id']
+    custos = {
+        instance_id: seconds / 3600 * uso.hourly_cost(inventory.get(instance_id, {}).get('InstanceType'))
+        for instance_id, seconds in por_instancia.items()
+    }
+    horas_total = sum(por_instancia.values()) / 3600
+    linhas = [f"📈 Uso dos últimos {days} dia(s): {horas_total:.1f} h ligadas, custo estimado US$ {sum(custos.values()):.2f}",
+              f"💻 {len(por_instancia)} instância(s), {len(running)} ligada(s) agora", "", "Por dia:"]
+    for dia in dias:
+        linhas.append(f"• {datetime.fromisoformat(dia).strftime('%d/%m')}: {por_dia.get(dia, 0) / 3600:.1f} h")
+    linhas += ["", "Mais tempo ligadas:"]
+    for instance_id, seconds in sorted(por_instancia.items(), key=lambda p: -p[1])[:USAGE_REPORT_TOP]:
+        nome = _instance_name(inventory[instance_id]) if instance_id in inventory else instance_id
+        linhas.append(f"• {nome}: {seconds / 3600:.1f} h (US$ {custos[instance_id]:.2f})")
+    return response("\n".join(linhas))
+
+
+def show_history(target):
+    """
+    Lista as últimas execuções de agendamentos de uma instância, lendo do arquivo de
+    histórico apenas as partições da instância nos últimos HISTORY_QUERY_DAYS dias.
+    """
+    if history_store is None:
+        return response("📚 O histórico de execuções não está configurado.")
+
+    instance = find_instance(target)
+    if instance:
+        instance_id = instance['InstanceId']
+    elif target.startswith("i-"):
+        # Instâncias já encerradas não estão no inventário, mas podem ter histórico
+        instance_id = target
+    else:
+        return response(f"Instância '{target}' não encontrada por ID ou Name.")
+
+    since_day = (datetime.now(timezone.utc) - timedelta(days=HISTORY_QUERY_DAYS)).date().isoformat()
+    with metrics.phase('history_read'):
+        registros = history_store.read(instance_id, since_day)
+    if not registros:
+        return response(f"📚 Nenhuma execução de agendamento para {instance_id} nos últimos {HISTORY_QUERY_DAYS} dias.")
+
+    linhas = []
+    for registro in reversed(registros[-HISTORY_MAX_ENTRIES:]):
+        executado_local = datetime.fromisoformat(registro['executado_em']).astimezone(timezone(timedelta(hours=-3)))
+        icone = "✅" if registro['status'] == 'executado' else "❌"
+        recorrente = " 🔁" if registro.get('recorrencia') else ""
+        solicitante = registro.get('solicitante', 'desconhecido').split('@')[0]
+        linhas.append(f"{icone} {executado_local.strftime('%d/%m %H:%M')} | {registro['acao'].upper()}{recorrente} | {solicitante}")
+
+    nome = get_instance_name_from_id(instance_id)
+    return response(f"📚 Histórico de {nome} ({instance_id}), últimas {len(linhas)} execução(ões):\n" + "\n".join(linhas))
+
+def schedule_slot_id(instance_id, horario):
+    """
+    ID determinístico de um agendamento único: derivado da instância e do minuto, de modo que
+    dois pedidos simultâneos para o mesmo minuto disputem o mesmo item na escrita condicional.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"ec2-chatops:{instance_id}:{horario[:16]}"))
+
+
+def find_same_minute_schedules(instance_id, horario):
+    """Agendamentos ainda na fila (pendentes ou em execução) da instância no mesmo minuto."""
+    return tabela_agendamentos.query(
+        IndexName=INSTANCE_INDEX_NAME,
+        KeyConditionExpression="instancia = :instancia AND begins_with(horario, :minuto)",
+        FilterExpression="attribute_exists(fila)",
+        ExpressionAttributeValues={":instancia": instance_id, ":minuto": horario[:16]},
+    ).get('Items', [])
+
+
+def merge_into_existing(existentes, action, user_email):
+    """
+    Trata um novo agendamento que coincide (mesma instância e minuto) com agendamentos existentes:
+    ação contraditória é rejeitada; a mesma ação é unida ao agendamento existente com uma escrita
+    condicional (o solicitante entra em 'solicitantes_adicionais').
+    Retorna a resposta ao usuário, ou None se nada coincide e o agendamento pode ser criado.
+    """
+    for ag in existentes:
+        if ag['acao'] != action:
+            return response(f"⚠️ Conflito: já existe um {ag['acao'].upper()} agendado para esta instância no mesmo horário "
+                            f"(ID {ag['id']}). Delete-o antes de agendar {action.upper()}.")
+    for ag in existentes:
+        if ag.get('fila') != 'pendente':
+            return response(f"ℹ️ Um {action.upper()} para esta instância neste horário já está sendo executado (ID {ag['id']}).")
+        try:
+            with metrics.phase('dynamodb_write'):
+                tabela_agendamentos.update_item(
+                    Key={'id': ag['id']},
+                    UpdateExpression="ADD solicitantes_adicionais :email",
+                    ConditionExpression="fila = :pendente",
+                    ExpressionAttributeValues={":email": {user_email}, ":pendente": "pendente"}
+                )
+        except tabela_agendamentos.meta.client.exceptions.ConditionalCheckFailedException:
+            # Reivindicado pelo executor entre a consulta e a escrita
+            return response(f"ℹ️ Um {action.upper()} para esta instância neste horário já está sendo executado (ID {ag['id']}).")
+        return response(f"ℹ️ Já existe um {action.upper()} agendado para esta instância no mesmo horário (ID {ag['id']}). "
+                        f"Seu pedido foi unido a ele.")
+    return None
+
+
 def delete_scheduled_task(schedule_id):
     """Deleta um agendamento específico do DynamoDB."""
     try:
@@ -257,24 +1153,173 @@ def delete_scheduled_task(schedule_id):
         if item.get('status') != 'pendente':
             return response(f"❌ Agendamento com ID '{schedule_id}' não está mais pendente ou já foi processado.")
 
-        tabela_agendamentos.delete_item(Key={'id': schedule_id})
+        with metrics.phase('dynamodb_write'):
+            tabela_agendamentos.delete_item(Key={'id': schedule_id})
         return response(f"✅ Agendamento '{schedule_id}' deletado com sucesso!")
     except Exception as e:
         logger.error(f"Erro ao deletar agendamento {schedule_id}:", exc_info=True)
         return response(f"Erro ao deletar agendamento '{schedule_id}': {str(e)}")
 
+def extract_command_text(body, lowercase=True):
+    """Extrai o comando de texto do evento (sem a menção ao bot), em minúsculas se 'lowercase'."""
+    message = body.get('argumentText', '').strip()
+    if not message:
+        # Se não há argumentText (e.g., mensagem direta ou com menção no início)
+        text_raw = body.get('message', {}).get('text', '')
+        # Remove menções do bot para extrair o comando limpo
+        for a in body.get('message', {}).get('annotations', []):
+            if a.get('type') == 'USER_MENTION':
+                start = a.get('startIndex', 0)
+                length = a.get('length', 0)
+                text_raw = (text_raw[:start] + text_raw[start + length:]).strip()
+                break
+        message = text_raw
+    return message.lower() if lowercase else message
+
+
+def menu_filter_text(body):
+    """
+    Termos do comando 'menu' na grafia original: os filtros de tag e de nome da EC2 (e
+    matches_menu_filters) diferenciam maiúsculas. Só os estados vão para minúsculas.
+    """
+    terms = extract_command_text(body, lowercase=False).split()[1:]
+    return " ".join(term.lower() if term.lower() in INSTANCE_STATES else term for term in terms)
+
+
+def command_parts(body, message):
+    """
+    Palavras do comando em minúsculas, exceto os alvos de tag/padrão (is_bulk_target), que
+    mantêm a grafia original: os filtros da EC2 e matches_bulk_target diferenciam maiúsculas.
+    """
+    parts = message.split()
+    original = extract_command_text(body, lowercase=False).split()
+    if len(original) != len(parts):
+        return parts
+    return [raw if is_bulk_target(part) else part for part, raw in zip(parts, original)]
+
+
+def should_defer(body):
+    """
+    Indica se o comando é lento o suficiente para usar resposta diferida:
+    'menu', 'agendamentos', 'aguardar' e start/stop por nome ou em massa. Cliques em botões e os demais
+    comandos continuam no caminho síncrono.
+    """
+    if not DEFERRED_RESPONSES or body.get('action', {}).get('actionMethodName'):
+        return False
+    parts = extract_command_text(body).split()
+    if not parts:
+        return False
+    if parts[0] in ("menu", "agendamentos", "aguardar"):
+        return True
+    return len(parts) == 2 and parts[0] in ("start", "stop") and not parts[1].startswith("i-")
+
+
+def defer_response(body):
+    """
+    Cria a mensagem provisória, agenda a continuação e devolve a resposta imediata ao webhook.
+    Retorna None se não for possível adiar (o comando então é processado de forma síncrona).
+    """
+    space_name = body.get('space', {}).get('name')
+    if not space_name or not messenger.available():
+        return None
+    try:
+        placeholder = {'text': f"⏳ Processando '{extract_command_text(body)}'..."}
+        message_name = messenger.create_message(
+            space_name,
+            placeholder,
+            thread_name=body.get('message', {}).get('thread', {}).get('name'),
+            message_id=resposta_diferida.placeholder_message_id(body)
+        )
+        dispatcher.dispatch({'continuacao': {'body': body, 'message_name': message_name}})
+    except Exception:
+        logger.error("Erro ao adiar resposta; processando de forma síncrona:", exc_info=True)
+        return None
+    # Corpo vazio: a mensagem provisória já foi criada pela API do Chat
+    return {'statusCode': 200, 'body': '{}', 'headers': {'Content-Type': 'application/json'}}
+
+
+def handle_continuation(continuation):
+    """Processa o comando adiado e substitui a mensagem provisória pelo resultado final."""
+    result = process_chat_event(continuation['body'], deferred=True)
+    payload = json.loads(result['body'])
+    payload.pop('actionResponse', None)
+    try:
+        messenger.update_message(continuation['message_name'], payload)
+    except Exception:
+        logger.error("Erro ao atualizar a mensagem provisória:", exc_info=True)
+    return result
+
+
+def has_side_effects(body):
+    """Indica se o evento altera estado: start/stop (inclusive em massa), agendar ou deletar agendamento (texto ou botão)."""
+    action_method = body.get('action', {}).get('actionMethodName')
+    if action_method:
+        return action_method.startswith("deletar_agendamento_")
+    parts = extract_command_text(body).split()
+    return bool(parts) and parts[0] in SIDE_EFFECT_COMMANDS
+
+
+def command_metric_name(body):
+    """Nome do comando usado como dimensão das métricas (sem IDs, para limitar a cardinalidade)."""
+    action_method = body.get('action', {}).get('actionMethodName')
+    if action_method:
+        for prefix in ("solicitar_start", "solicitar_stop", "deletar_agendamento"):
+            if action_method.startswith(prefix):
+                return f"botao:{prefix}"
+        return f"botao:{action_method}"
+    parts = extract_command_text(body).split()
+    if parts and parts[0] in KNOWN_COMMANDS:
+        return parts[0]
+    return "invalido"
+
+
+@metrics.instrumented('GoogleChatEC2Bot')
 def lambda_handler(event, context):
     """
     Função principal do AWS Lambda que processa os eventos.
     """
+    if 'continuacao' in event:
+        metrics.set_dimension('Comando', 'continuacao')
+        return handle_continuation(event['continuacao'])
+
     try:
-        logger.info("Evento recebido:")
-        logger.info(json.dumps(event))
+        metrics.log_event_sample(logger, event)
 
         if 'body' not in event:
             return response("⚠️ Evento inválido: sem body.")
-        body = json.loads(event['body'])
+        with metrics.phase('parse'):
+            body = json.loads(event['body'])
+            metrics.set_dimension('Comando', command_metric_name(body))
+
+        key = idempotencia.event_key(body) if IDEMPOTENCY_ENABLED and has_side_effects(body) else None
+        if key is None:
+            return handle_chat_event(body)
+        result, repeated = idempotency.run(key, lambda: handle_chat_event(body))
+        if repeated:
+            logger.info("Evento repetido: devolvendo a resposta da primeira entrega")
+            metrics.add_value('EventoRepetido', 1)
+        return result
+
+    except Exception as e:
+        logger.error("Erro ao processar comando:", exc_info=True)
+        return error_response(e)
+
+
+def handle_chat_event(body):
+    """Responde ao evento, de forma diferida quando o comando é lento (ver should_defer)."""
+    if should_defer(body):
+        deferred = defer_response(body)
+        if deferred:
+            return deferred
+    return process_chat_event(body)
 
+
+def process_chat_event(body, deferred=False):
+    """
+    Processa um evento do chat (clique de botão ou comando de texto) e retorna a resposta.
+    'deferred' indica que o evento é uma continuação assíncrona, sem o limite de tempo do webhook.
+    """
+    try:
         action_method = body.get('action', {}).get('actionMethodName')
         user_info = body.get('user', {})
         user_name = user_info.get('displayName', 'Um usuário')
@@ -294,6 +1339,14 @@ def lambda_handler(event, context):
                 # Menciona admins para aprovação de stop
                 return mention_admin_users(user_name, "DESLIGAR", get_instance_name_from_id(instance_id))
             
+            elif action_method == "menu_proxima_pagina":
+                params = {p.get('key'): p.get('value') for p in body.get('action', {}).get('parameters', [])}
+                return build_instance_menu(params.get('filtro', ''), params.get('cursor'), int(params.get('pagina', 2)))
+
+            elif action_method == "agendamentos_proxima_pagina":
+                params = {p.get('key'): p.get('value') for p in body.get('action', {}).get('parameters', [])}
+                return list_scheduled_tasks(user_email, params.get('cursor'), int(params.get('pagina', 2)))
+
             elif action_method.startswith("deletar_agendamento_"):
                 if user_email not in ALLOWED_ADMIN_USERS:
                     return response("🚫 Você não tem permissão para deletar agendamentos.")
@@ -307,73 +1360,68 @@ def lambda_handler(event, context):
         user_name = sender_info.get('displayName', 'desconhecido')
         user_email = sender_info.get('email', '').lower()
 
-        message = body.get('argumentText', '').strip().lower()
-        if not message:
-            # Se não há argumentText (e.g., mensagem direta ou com menção no início)
-            text_raw = body.get('message', {}).get('text', '').lower()
-            # Remove menções do bot para extrair o comando limpo
-            for a in body.get('message', {}).get('annotations', []):
-                if a.get('type') == 'USER_MENTION':
-                    start = a.get('startIndex', 0)
-                    length = a.get('length', 0)
-                    text_raw = (text_raw[:start] + text_raw[start + length:]).strip()
-                    break
-            message = text_raw
+        message = extract_command_text(body)
 
         logger.info(f"Mensagem processada: '{message}'")
-        parts = message.split()
+        parts = command_parts(body, message)
 
-        # Comando: agendar <acao> <instancia> <hora> (formato 24h: HH:mm)
+        # Comando: agendar <acao> <instancia> <hora> [dias] (formato 24h: HH:mm)
+        #          agendar <acao> <instancia> cron <minuto> <hora> <dia> <mês> <dia-da-semana>
         if message.startswith("agendar "):
             agendar_parts = message.split()
-            if len(agendar_parts) != 4:
-                return response("Uso correto: agendar <start|stop> <nome ou id da instância> <HH:mm>")
+            if len(agendar_parts) not in (4, 5, 9) or (len(agendar_parts) == 9) != (agendar_parts[3] == "cron"):
+                return response("Uso correto: agendar <start|stop> <nome ou id da instância> <HH:mm> [dias, ex: seg-sex]\n"
+                                "ou: agendar <start|stop> <nome ou id da instância> cron <min> <hora> <dia> <mês> <dia-semana>")
 
-            _, action, target, time_str = agendar_parts
+            _, action, target, time_str = agendar_parts[:4]
             action = action.lower()
 
             if action not in ["start", "stop"]:
                 return response("Ação inválida. Use 'start' ou 'stop'.")
 
-            try:
-                # O timezone aqui deve corresponder ao fuso horário que você espera para a entrada do usuário
-                # Ex: UTC-3 para Brasília. Ajuste conforme sua necessidade.
-                local_time = datetime.strptime(time_str, "%H:%M")
-                now_local = datetime.now(timezone(timedelta(hours=-3))) 
-                scheduled_local = now_local.replace(hour=local_time.hour, minute=local_time.minute, second=0, microsecond=0)
-                
-                # Se o horário agendado já passou para hoje, agenda para o dia seguinte
-                if scheduled_local < now_local:
-                    scheduled_local += timedelta(days=1)
-                
-                # Converte para UTC para armazenamento no DynamoDB
-                scheduled_utc = scheduled_local.astimezone(timezone.utc).isoformat()
-            except ValueError:
-                return response("Horário inválido. Use o formato HH:mm (ex: 22:30).")
-
-            instance_id = None
-            if target.startswith("i-"): # Busca por ID de instância
+            # Agendamento recorrente: uma única linha com a expressão cron e a próxima ocorrência em 'horario'
+            recurrence = None
+            if len(agendar_parts) > 4:
                 try:
-                    res = ec2.describe_instances(InstanceIds=[target])
-                    if res['Reservations']:
-                        instance_id = target
-                except Exception as e:
-                    logger.warning(f"Instância com ID {target} não encontrada: {e}")
-            else: # Busca por tag 'Name'
-                res = ec2.describe_instances(Filters=[{'Name': 'tag:Name', 'Values': [target]}])
-                for r in res['Reservations']:
-                    for inst in r['Instances']:
-                        tags = {tag['Key']: tag['Value'] for tag in inst.get('Tags', [])}
-                        if tags.get('Name', '').lower() == target.lower():
-                            instance_id = inst['InstanceId']
-                            break
-                    if instance_id:
-                        break
-
-            if not instance_id:
+                    if time_str == "cron":
+                        recurrence = recorrencia.normalize_cron(" ".join(agendar_parts[4:]))
+                    else:
+                        recurrence = recorrencia.cron_from_time_and_days(time_str, agendar_parts[4])
+                    scheduled_local = recorrencia.next_occurrence(recurrence, datetime.now(timezone.utc)).astimezone(recorrencia.LOCAL_TZ)
+                    scheduled_utc = scheduled_local.astimezone(timezone.utc).isoformat()
+                except ValueError as e:
+                    return response(f"Recorrência inválida: {str(e)}. Ex: agendar stop dev-server 20:00 seg-sex")
+            else:
+                try:
+                    # O timezone aqui deve corresponder ao fuso horário que você espera para a entrada do usuário
+                    # Ex: UTC-3 para Brasília. Ajuste conforme sua necessidade.
+                    local_time = datetime.strptime(time_str, "%H:%M")
+                    now_local = datetime.now(timezone(timedelta(hours=-3))) 
+                    scheduled_local = now_local.replace(hour=local_time.hour, minute=local_time.minute, second=0, microsecond=0)
+                    
+                    # Se o horário agendado já passou para hoje, agenda para o dia seguinte
+                    if scheduled_local < now_local:
+                        scheduled_local += timedelta(days=1)
+                    
+                    # Converte para UTC para armazenamento no DynamoDB
+                    scheduled_utc = scheduled_local.astimezone(timezone.utc).isoformat()
+                except ValueError:
+                    return response("Horário inválido. Use o formato HH:mm (ex: 22:30).")
+
+            # Busca por ID de instância ou tag 'Name' no inventário em cache
+            instance = find_instance(target)
+            if not instance:
                 return response(f"Instância '{target}' não encontrada por ID ou Name.")
+            instance_id = instance['InstanceId']
 
-            schedule_id = str(uuid.uuid4())
+            # Conflitos e duplicatas no mesmo minuto (índice instancia-horario-index)
+            existing_response = merge_into_existing(find_same_minute_schedules(instance_id, scheduled_utc), action, user_email)
+            if existing_response:
+                return existing_response
+
+            schedule_id = str(uuid.uuid4()) if recurrence else schedule_slot_id(instance_id, scheduled_utc)
+            # Região/conta da instância, para o executor usar o cliente certo
+            alvo = alvos.get_target(instance.get('Alvo'))
 
             item = {
                 "id": schedule_id,
@@ -381,15 +1429,36 @@ def lambda_handler(event, context):
                 "acao": action,
                 "horario": scheduled_utc,
                 "solicitante": user_email, 
-                "status": "pendente"
+                "status": "pendente",
+                # Chave de partição do índice esparso de pendentes (fila-horario-index),
+                # removida pelo ExecutaAgendamentosEC2 quando o agendamento é finalizado
+                "fila": "pendente",
+                "alvo": alvo.id
             }
+            if alvo.region:
+                item["regiao"] = alvo.region
+            if recurrence:
+                item["recorrencia"] = recurrence
 
-            tabela_agendamentos.put_item(Item=item)
-
-            return response(f"✅ Agendamento registrado com sucesso!\n🕒 Horário UTC-3: {scheduled_local.strftime('%d/%m %H:%M')}\n💻 Instância: {instance_id}\n⚙️ Ação: {action.upper()}")
-
-        if message == "menu":
-            return build_instance_menu()
+            try:
+                with metrics.phase('dynamodb_write'):
+                    # Só sobrescreve um item com o mesmo ID se ele já tiver saído da fila (finalizado)
+                    tabela_agendamentos.put_item(
+                        Item=item,
+                        ConditionExpression="attribute_not_exists(id) OR attribute_not_exists(fila)"
+                    )
+            except tabela_agendamentos.meta.client.exceptions.ConditionalCheckFailedException:
+                # Outro pedido criou o mesmo minuto entre a consulta ao índice e a escrita
+                existing = tabela_agendamentos.get_item(Key={'id': schedule_id}, ConsistentRead=True).get('Item')
+                return (merge_into_existing([existing] if existing else [], action, user_email)
+                        or response("Não foi possível registrar o agendamento, tente novamente."))
+
+            recurrence_text = f"\n🔁 Recorrência: {recorrencia.describe(recurrence)}" if recurrence else ""
+            return response(f"✅ Agendamento registrado com sucesso!\n🕒 Horário UTC-3: {scheduled_local.strftime('%d/%m %H:%M')}{recurrence_text}\n💻 Instância: {instance_id}\n⚙️ Ação: {action.upper()}")
+
+        # Comando: menu [running|stopped|tag:<chave>=<valor>|<prefixo do nome>]
+        if message == "menu" or message.startswith("menu "):
+            return build_instance_menu(menu_filter_text(body))
             
         if message == "agendamentos":
             return list_scheduled_tasks(user_email)
@@ -404,12 +1473,38 @@ def lambda_handler(event, context):
             except IndexError:
                 return response("Uso correto: deletar agendamento <ID_DO_AGENDAMENTO>")
 
+        # Comando: relatorio [dias]
+        if parts and parts[0] == "relatorio":
+            if len(parts) > 2 or (len(parts) == 2 and not (parts[1].isdigit() and 1 <= int(parts[1]) <= USAGE_REPORT_MAX_DAYS)):
+                return response(f"Uso correto: relatorio [dias, de 1 a {USAGE_REPORT_MAX_DAYS}]")
+            return usage_report(int(parts[1]) if len(parts) == 2 else USAGE_REPORT_DEFAULT_DAYS)
+
+        # Comando: historico <instancia>
+        if parts and parts[0] == "historico":
+            if len(parts) != 2:
+                return response("Uso correto: historico <nome ou id da instância>")
+            return show_history(parts[1])
+
+        # Comando: aguardar <running|stopped> <id/nome|tag:<chave>=<valor>|padrão*> [...]
+        if parts and parts[0] == "aguardar":
+            if len(parts) < 3 or parts[1] not in WAIT_TARGET_STATES:
+                return response("Uso correto: aguardar <running|stopped> <id/nome|tag:<chave>=<valor>|padrão*> [...]")
+            return wait_for_state(parts[1], parts[2:], WAIT_MAX_SECONDS if deferred else WAIT_SYNC_MAX_SECONDS)
+
+        # Comando: status com vários alvos, tag ou padrão (describe_instance_status em lote)
+        if len(parts) >= 2 and parts[0] == "status" and (len(parts) > 2 or is_bulk_target(parts[1])):
+            return batch_status(parts[1:])
+
         # Processamento de comandos diretos (start, stop, status)
         if len(parts) != 2:
-            return response("Comando inválido. Use:\n- start <id/nome>\n- stop <id/nome>\n- status <id/nome>\n- agendar <start|stop> <id/nome> <HH:mm>\n- agendamentos\n- menu")
+            return response("Comando inválido. Use:\n- start <id/nome|tag:<chave>=<valor>|padrão*>\n- stop <id/nome|tag:<chave>=<valor>|padrão*>\n- status <id/nome|tag:<chave>=<valor>|padrão*> [...]\n- aguardar <running|stopped> <id/nome|tag:<chave>=<valor>|padrão*> [...]\n- agendar <start|stop> <id/nome> <HH:mm> [seg-sex]\n- agendamentos\n- historico <id/nome>\n- relatorio [dias]\n- menu [running|stopped|tag:<chave>=<valor>|<prefixo>]")
 
         command, target = parts
 
+        # Ações em massa: start/stop tag:<chave>=<valor> ou start/stop <padrão do nome, ex: web-*>
+        if command in ["start", "stop"] and is_bulk_target(target):
+            return bulk_instance_action(command, target, user_name, user_email)
+
         # Verifica se a instância é restrita e se o usuário tem permissão
         is_restricted_instance = True
         if not target.startswith("i-"): # Se for por nome, verifica se está na lista de não restritas
@@ -428,49 +1523,36 @@ def lambda_handler(event, context):
         #     return response("Por favor, mencione o bot com @SeuBot ao usar comandos como start, stop ou status.")
 
 
-        # Busca a instância pelo ID ou nome
-        instance = None
-        if target.startswith("i-"):
-            try:
-                res = ec2.describe_instances(InstanceIds=[target])
-                if res['Reservations']:
-                    instance = res['Reservations'][0]['Instances'][0]
-            except Exception as e:
-                logger.warning(f"Instância com ID {target} não encontrada: {e}")
-        else:
-            res = ec2.describe_instances(Filters=[{'Name': 'tag:Name', 'Values': [target]}])
-            for r in res['Reservations']:
-                for inst in r['Instances']:
-                    tags = {tag['Key']: tag['Value'] for tag in inst.get('Tags', [])}
-                    name_tag = tags.get('Name', '').lower()
-                    if name_tag == target.lower():
-                        instance = inst
-                        break
-                if instance:
-                    break
-        
+        # Busca a instância pelo ID ou nome (inventário em cache)
+        instance = find_instance(target)
         if not instance:
             return response(f"Nenhuma instância encontrada com o identificador '{target}'.")
 
         instance_id = instance['InstanceId']
 
         if command == "start":
-            ec2.start_instances(InstanceIds=[instance_id])
             # Adiciona tags para rastreamento de quem iniciou e quando
-            ec2.create_tags(Resources=[instance_id], Tags=[{
-                'Key': 'LastActionBy',
-                'Value': f"{user_name} - start"
-            }])
+            tags = action_tags(command, user_name)
+            with metrics.phase('ec2_action'):
+                ec2 = ec2_for(instance)
+                res = ec2.start_instances(InstanceIds=[instance_id])
+                ec2.create_tags(Resources=[instance_id], Tags=tags)
+            update_cached_instance(instance_id, state='pending', tags=tags, launch_time=datetime.now(timezone.utc))
+            # Start de uma instância já ligada não é uma transição (não reinicia o tempo ligado)
+            if state_changes(command, res).get(instance_id, True):
+                record_usage(command, [instance_id], user_email)
             return response(f"🚀 Instância {instance_id} iniciada por {user_name}.")
 
         elif command == "stop":
-            now = datetime.now(timezone(timedelta(hours=-3))).isoformat() # Armazena o tempo em UTC-3
-            ec2.stop_instances(InstanceIds=[instance_id])
             # Adiciona tags para rastreamento de quem parou e quando
-            ec2.create_tags(Resources=[instance_id], Tags=[
-                {'Key': 'LastActionBy', 'Value': f"{user_name} - stop"},
-                {'Key': 'StoppedAt', 'Value': now}
-            ])
+            tags = action_tags(command, user_name)
+            with metrics.phase('ec2_action'):
+                ec2 = ec2_for(instance)
+                res = ec2.stop_instances(InstanceIds=[instance_id])
+                ec2.create_tags(Resources=[instance_id], Tags=tags)
+            update_cached_instance(instance_id, state='stopping', tags=tags)
+            if state_changes(command, res).get(instance_id, True):
+                record_usage(command, [instance_id], user_email)
             return response(f"🛑 Instância {instance_id} desligada por {user_name}.")
 
         elif command == "status":
@@ -509,4 +1591,4 @@ def lambda_handler(event, context):
 
     except Exception as e:
         logger.error("Erro ao processar comando:", exc_info=True)
-        return response(f"Erro ao processar comando: {str(e)}")
\ No newline at end of file
+        return error_response(e)
\ No newline at end of file
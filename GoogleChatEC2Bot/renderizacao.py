@@ -0,0 +1,79 @@
+"""
+Renderização compacta e em cache dos cards do Google Chat.
+
+O 'menu' e o 'agendamentos' montavam a árvore inteira de widgets e a serializavam com o
+espaçamento padrão do json.dumps a cada clique, mesmo sem nada ter mudado desde o clique
+anterior. Aqui:
+- dumps() serializa sem espaços e sem escapar caracteres não ASCII (emojis, acentos);
+- RenderCache guarda trechos já serializados (os widgets de uma instância, a seção de um
+  agendamento, o corpo de uma página inteira) sob uma chave que inclui tudo o que muda o
+  trecho: a versão do inventário, os campos do agendamento, a classe de permissão de
+  quem vê (admins veem o botão "Deletar");
+- card_body() monta o corpo do card juntando os trechos, sem desserializá-los.
+
+Uma chave nunca é invalidada: quando o dado muda, a chave muda e a entrada antiga sai do
+LRU pelo limite de tamanho.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Trechos serializados mantidos em memória (widgets por instância/agendamento e páginas)
+RENDER_CACHE_SIZE = int(os.environ.get('RENDER_CACHE_SIZE', '4096'))
+
+
+def dumps(value):
+    """JSON compacto (sem espaços), em UTF-8 e não em escapes \\uXXXX."""
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+class RenderCache:
+    """LRU de trechos serializados, seguro entre threads."""
+
+    def __init__(self, max_size=RENDER_CACHE_SIZE):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def render(self, key, build):
+        """Trecho serializado da chave; na primeira vez, serializa o retorno de build()."""
+        value = self.get(key)
+        if value is None:
+            value = dumps(build())
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+def section(widget_lists):
+    """Seção {"widgets": [...]} a partir de listas de widgets já serializadas (ex: as de cada instância)."""
+    return '{"widgets":[' + ','.join(w[1:-1] for w in widget_lists if w != '[]') + ']}'
+
+
+def card_body(header, sections, action_response=None):
+    """
+    Corpo de um card com as seções já serializadas (cada uma um objeto JSON
+    {"widgets": [...]}), equivalente a dumps({'cards': [...], 'actionResponse': ...}).
+    """
+    body = '{"cards":[{"header":' + dumps(header) + ',"sections":[' + ','.join(sections) + ']}]'
+    if action_response:
+        body += ',"actionResponse":' + dumps(action_response)
+    return body + '}'
@@ -0,0 +1,136 @@
+"""
+Resposta diferida para comandos lentos do GoogleChatEC2Bot.
+
+O webhook do Google Chat precisa de uma resposta em poucos segundos. Para comandos
+lentos o bot cria uma mensagem provisória ("⏳ Processando...") pela API do Chat,
+responde ao webhook imediatamente e dispara uma continuação assíncrona que processa
+o comando e substitui a mensagem provisória pelo resultado final.
+
+Os dois pontos de integração são objetos substituíveis:
+- dispatcher: entrega a continuação (padrão: auto-invocação assíncrona da Lambda)
+- messenger:  cria/atualiza mensagens no Chat (padrão: API REST do Google Chat)
+
+Em testes ou execução local, LocalDispatcher executa a continuação no próprio processo.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+
+from comum.aws import get_client
+
+logger = logging.getLogger()
+
+CHAT_API_URL = 'https://chat.googleapis.com/v1'
+CHAT_SCOPES = ['https://www.googleapis.com/auth/chat.bot']
+
+
+class LambdaSelfInvokeDispatcher:
+    """Entrega a continuação invocando a própria função de forma assíncrona (InvocationType=Event)."""
+
+    def __init__(self, function_name=None):
+        self.function_name = function_name or os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+
+    def dispatch(self, payload):
+        get_client('lambda').invoke(
+            FunctionName=self.function_name,
+            InvocationType='Event',
+            Payload=json.dumps(payload).encode('utf-8')
+        )
+
+
+class LocalDispatcher:
+    """Executa a continuação no próprio processo (testes e execução local)."""
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def dispatch(self, payload):
+        self.handler(payload, None)
+
+
+class GoogleChatMessenger:
+    """
+    Cria e atualiza mensagens pela API REST do Google Chat, autenticando com a conta de
+    serviço do bot. As credenciais (JSON da conta de serviço) vêm da variável de ambiente
+    GOOGLE_CHAT_CREDENTIALS. Requer o pacote opcional 'google-auth'.
+    """
+
+    def __init__(self, credentials_json=None):
+        self.credentials_json = credentials_json or os.environ.get('GOOGLE_CHAT_CREDENTIALS')
+        self._credentials = None
+        self._lock = threading.Lock()
+
+    def available(self):
+        return bool(self.credentials_json)
+
+    def _token(self):
+        with self._lock:
+            if self._credentials is None:
+                from google.auth.transport.requests import Request
+                from google.oauth2 import service_account
+
+                self._credentials = service_account.Credentials.from_service_account_info(
+                    json.loads(self.credentials_json), scopes=CHAT_SCOPES
+                )
+                self._refresh_request = Request()
+            if not self._credentials.valid:
+                self._credentials.refresh(self._refresh_request)
+            return self._credentials.token
+
+    def _request(self, method, url, payload):
+        req = urllib.request.Request(
+            url,
+            data=json.dumps(payload).encode('utf-8'),
+            method=method,
+            headers={'Authorization': f"Bearer {self._token()}", 'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(req, timeout=10) as res:
+            return json.loads(res.read() or b'{}')
+
+    def create_message(self, space_name, payload, thread_name=None, message_id=None):
+        """Cria uma mensagem no espaço (na thread informada) e retorna seu 'name'."""
+        url = f"{CHAT_API_URL}/{space_name}/messages"
+        query = []
+        if message_id:
+            query.append(f"messageId={message_id}")
+        if thread_name:
+            payload = {**payload, 'thread': {'name': thread_name}}
+            query.append("messageReplyOption=REPLY_MESSAGE_FALLBACK_TO_NEW_THREAD")
+        if query:
+            url += "?" + "&".join(query)
+        return self._request('POST', url, payload)['name']
+
+    def update_message(self, message_name, payload):
+        """Substitui o texto e os cards de uma mensagem existente."""
+        url = f"{CHAT_API_URL}/{message_name}?updateMask=text,cards"
+        self._request('PATCH', url, {'text': payload.get('text', ''), 'cards': payload.get('cards', [])})
+
+
+class LocalMessenger:
+    """Guarda as mensagens em memória (testes e execução local)."""
+
+    def __init__(self):
+        self.messages = {}
+
+    def available(self):
+        return True
+
+    def create_message(self, space_name, payload, thread_name=None, message_id=None):
+        name = f"{space_name}/messages/{message_id or len(self.messages) + 1}"
+        self.messages[name] = payload
+        return name
+
+    def update_message(self, message_name, payload):
+        self.messages[message_name] = payload
+
+
+def placeholder_message_id(body):
+    """
+    ID atribuído pelo cliente para a mensagem provisória, derivado do evento original,
+    de modo que um mesmo evento reenviado não crie uma segunda mensagem provisória.
+    """
+    source = body.get('message', {}).get('name') or body.get('eventTime') or str(time.time())
+    return "client-" + "".join(c if c.isalnum() else "-" for c in source.lower())[-56:]
@@ -0,0 +1,115 @@
+"""
+Benchmark de cold start das funções Lambda.
+
+Cada amostra roda em um processo Python novo (equivalente a um container frio) e mede:
+- import_ms:       tempo de importação do lambda_function.py
+- first_call_ms:   primeira invocação de um caminho que não fala com a AWS
+                   (bot: "Comando inválido"; executor: não se aplica)
+- clients_ms:      construção dos clientes EC2 e DynamoDB na sessão compartilhada
+- boto3_imported:  se o boto3 já havia sido importado antes da construção dos clientes
+
+Uso:
+    python benchmarks/cold_start.py [--runs 15] [--max-import-ms 150] [--max-first-call-ms 50]
+
+Sai com código 1 se a mediana de algum tempo ultrapassar o limite (padrões em
+MAX_IMPORT_MS e MAX_FIRST_CALL_MS), se a importação de alguma função passar a importar o
+boto3 ou se o caminho sem AWS do bot passar a importá-lo.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Limites padrão das medianas. Sem o boto3, as duas importações ficam abaixo de ~60 ms;
+# o boto3 sozinho leva mais de 100 ms, então importá-lo no nível do módulo estoura o limite.
+MAX_IMPORT_MS = 150
+MAX_FIRST_CALL_MS = 50
+
+FUNCTIONS = {
+    'GoogleChatEC2Bot': {
+        'event': {'body': json.dumps({'message': {'sender': {'email': 'bench@example.com'}}, 'argumentText': 'ajuda'})},
+    },
+    'ExecutaAgendamentosEC2': {
+        'event': None,
+    },
+}
+
+CHILD = r'''
+import json, sys, time
+t0 = time.perf_counter()
+import lambda_function
+t1 = time.perf_counter()
+boto3_on_import = 'boto3' in sys.modules
+event = json.loads(sys.argv[1])
+first_call_ms = None
+if event is not None:
+    lambda_function.lambda_handler(event, None)
+    first_call_ms = (time.perf_counter() - t1) * 1000
+boto3_imported = 'boto3' in sys.modules
+t2 = time.perf_counter()
+from comum import alvos
+from comum.aws import get_table
+alvos.DEFAULT_TARGET.ec2()
+get_table(lambda_function.DYNAMODB_TABLE_NAME)
+t3 = time.perf_counter()
+print(json.dumps({
+    'import_ms': (t1 - t0) * 1000,
+    'first_call_ms': first_call_ms,
+    'clients_ms': (t3 - t2) * 1000,
+    'boto3_on_import': boto3_on_import,
+    'boto3_imported': boto3_imported,
+}))
+'''
+
+
+def run_sample(function_dir, event):
+    env = dict(os.environ)
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    env.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    env.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    env['PYTHONPATH'] = os.pathsep.join([os.path.join(REPO_ROOT, function_dir), REPO_ROOT])
+    out = subprocess.run(
+        [sys.executable, '-c', CHILD, json.dumps(event)],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--max-import-ms', type=float, default=MAX_IMPORT_MS)
+    parser.add_argument('--max-first-call-ms', type=float, default=MAX_FIRST_CALL_MS)
+    args = parser.parse_args()
+
+    failures = []
+    for function_dir, spec in FUNCTIONS.items():
+        samples = [run_sample(function_dir, spec['event']) for _ in range(args.runs)]
+        medians = {}
+        for key in ('import_ms', 'first_call_ms', 'clients_ms'):
+            values = [s[key] for s in samples if s[key] is not None]
+            medians[key] = statistics.median(values) if values else None
+        print(f"{function_dir}: " + ", ".join(
+            f"{k}={v:.1f}" for k, v in medians.items() if v is not None
+        ))
+
+        if medians['import_ms'] > args.max_import_ms:
+            failures.append(f"{function_dir}: import {medians['import_ms']:.1f}ms > {args.max_import_ms}ms")
+        if medians['first_call_ms'] is not None and medians['first_call_ms'] > args.max_first_call_ms:
+            failures.append(f"{function_dir}: primeira chamada {medians['first_call_ms']:.1f}ms > {args.max_first_call_ms}ms")
+        if any(s['boto3_on_import'] for s in samples):
+            failures.append(f"{function_dir}: a importação do lambda_function importou o boto3")
+        elif spec['event'] is not None and any(s['boto3_imported'] for s in samples):
+            failures.append(f"{function_dir}: o caminho sem AWS importou o boto3")
+
+    for failure in failures:
+        print(f"FALHA: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
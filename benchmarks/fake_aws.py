@@ -0,0 +1,774 @@
+"""
+Backend AWS em memória para os benchmarks.
+
+As chamadas são interceptadas no evento 'before-call' do botocore (o mesmo mecanismo
+do botocore.stub.Stubber): os clientes, paginadores e a serialização do resource do
+DynamoDB são os reais, apenas a requisição HTTP é substituída por uma resposta
+calculada aqui. Assim a contagem de chamadas feita por comum/metrics.py é exata.
+
+Operações suportadas:
+- EC2:      DescribeInstances, DescribeInstanceStatus, StartInstances, StopInstances, CreateTags
+- DynamoDB: GetItem, PutItem, DeleteItem, UpdateItem, Query, Scan, BatchWriteItem
+- Lambda:   Invoke (apenas registra a chamada)
+- S3:       PutObject, GetObject, ListObjectsV2
+
+As expressões do DynamoDB (KeyCondition/Condition/Filter/Update) são interpretadas
+para o subconjunto usado pelo projeto.
+"""
+import bisect
+import fnmatch
+import io
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.awsrequest import AWSResponse
+from botocore.response import StreamingBody
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+class FakeError(Exception):
+    def __init__(self, code, message, status=400, extra=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+        self.extra = extra or {}
+
+
+def _http(status):
+    return AWSResponse('https://fake.local', status, {}, None)
+
+
+# ---------------------------------------------------------------------------
+# Expressões do DynamoDB
+# ---------------------------------------------------------------------------
+
+_TOKEN = re.compile(r"\s*(<>|<=|>=|=|<|>|\(|\)|,|\+|-|[#:]?[A-Za-z_][A-Za-z0-9_.]*)")
+
+
+def _tokenize(expr):
+    tokens, pos = [], 0
+    expr = expr.strip()
+    while pos < len(expr):
+        m = _TOKEN.match(expr, pos)
+        if not m:
+            raise FakeError('ValidationException', f"Expressão inválida: {expr!r}")
+        tokens.append(m.group(1))
+        pos = m.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, expr, names, values):
+        self.tokens = _tokenize(expr)
+        self.pos = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self, expected=None):
+        tok = self.peek()
+        if expected is not None and (tok or '').upper() != expected:
+            raise FakeError('ValidationException', f"Esperado {expected}, encontrado {tok}")
+        self.pos += 1
+        return tok
+
+    # Operandos ------------------------------------------------------------
+    def path(self, tok):
+        return ('path', self.names.get(tok, tok))
+
+    def operand(self):
+        tok = self.take()
+        if tok.startswith(':'):
+            return ('value', self.values[tok])
+        if self.peek() == '(':
+            self.take()
+            args = [self.operand_expr()]
+            while self.peek() == ',':
+                self.take()
+                args.append(self.operand_expr())
+            self.take(')')
+            return ('func', tok, args)
+        return self.path(tok)
+
+    def operand_expr(self):
+        left = self.operand()
+        while self.peek() in ('+', '-'):
+            op = self.take()
+            left = ('arith', op, left, self.operand())
+        return left
+
+    # Condições -------------------------------------------------------------
+    def condition(self):
+        left = self.and_expr()
+        while (self.peek() or '').upper() == 'OR':
+            self.take()
+            left = ('or', left, self.and_expr())
+        return left
+
+    def and_expr(self):
+        left = self.not_expr()
+        while (self.peek() or '').upper() == 'AND':
+            self.take()
+            left = ('and', left, self.not_expr())
+        return left
+
+    def not_expr(self):
+        if (self.peek() or '').upper() == 'NOT':
+            self.take()
+            return ('not', self.not_expr())
+        return self.comparison()
+
+    def comparison(self):
+        if self.peek() == '(':
+            self.take()
+            cond = self.condition()
+            self.take(')')
+            return cond
+        left = self.operand_expr()
+        tok = (self.peek() or '')
+        if tok in ('=', '<>', '<', '<=', '>', '>='):
+            self.take()
+            return ('cmp', tok, left, self.operand_expr())
+        if tok.upper() == 'BETWEEN':
+            self.take()
+            low = self.operand_expr()
+            self.take('AND')
+            return ('between', left, low, self.operand_expr())
+        if tok.upper() == 'IN':
+            self.take()
+            self.take('(')
+            options = [self.operand_expr()]
+            while self.peek() == ',':
+                self.take()
+                options.append(self.operand_expr())
+            self.take(')')
+            return ('in', left, options)
+        if left[0] == 'func':
+            return ('funcbool', left)
+        raise FakeError('ValidationException', f"Condição inválida perto de {tok!r}")
+
+
+def _get(item, path):
+    value = item
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _eval_operand(node, item):
+    kind = node[0]
+    if kind == 'value':
+        return node[1]
+    if kind == 'path':
+        return _get(item, node[1])
+    if kind == 'arith':
+        left, right = _eval_operand(node[2], item), _eval_operand(node[3], item)
+        return left + right if node[1] == '+' else left - right
+    if kind == 'func':
+        name, args = node[1], node[2]
+        if name == 'if_not_exists':
+            current = _eval_operand(args[0], item)
+            return current if current is not None else _eval_operand(args[1], item)
+        if name == 'list_append':
+            return list(_eval_operand(args[0], item) or []) + list(_eval_operand(args[1], item) or [])
+        if name == 'size':
+            value = _eval_operand(args[0], item)
+            return Decimal(len(value)) if value is not None else None
+        raise FakeError('ValidationException', f"Função não suportada: {name}")
+    raise FakeError('ValidationException', f"Operando inválido: {node}")
+
+
+def _compare(op, left, right):
+    if left is None or right is None:
+        return op == '<>' and left != right
+    try:
+        return {
+            '=': left == right, '<>': left != right, '<': left < right,
+            '<=': left <= right, '>': left > right, '>=': left >= right,
+        }[op]
+    except TypeError:
+        return False
+
+
+def _eval_condition(node, item):
+    kind = node[0]
+    if kind == 'and':
+        return _eval_condition(node[1], item) and _eval_condition(node[2], item)
+    if kind == 'or':
+        return _eval_condition(node[1], item) or _eval_condition(node[2], item)
+    if kind == 'not':
+        return not _eval_condition(node[1], item)
+    if kind == 'cmp':
+        return _compare(node[1], _eval_operand(node[2], item), _eval_operand(node[3], item))
+    if kind == 'between':
+        value = _eval_operand(node[1], item)
+        return _compare('>=', value, _eval_operand(node[2], item)) and _compare('<=', value, _eval_operand(node[3], item))
+    if kind == 'in':
+        value = _eval_operand(node[1], item)
+        return any(value == _eval_operand(opt, item) for opt in node[2])
+    if kind == 'funcbool':
+        name, args = node[1][1], node[1][2]
+        if name == 'attribute_exists':
+            return _get(item, args[0][1]) is not None
+        if name == 'attribute_not_exists':
+            return _get(item, args[0][1]) is None
+        if name == 'begins_with':
+            value = _eval_operand(args[0], item)
+            return isinstance(value, str) and value.startswith(_eval_operand(args[1], item))
+        if name == 'contains':
+            value = _eval_operand(args[0], item)
+            return value is not None and _eval_operand(args[1], item) in value
+        raise FakeError('ValidationException', f"Função não suportada: {name}")
+    raise FakeError('ValidationException', f"Condição inválida: {node}")
+
+
+def _parse_condition(expr, names, values):
+    parser = _Parser(expr, names, values)
+    node = parser.condition()
+    if parser.peek() is not None:
+        raise FakeError('ValidationException', f"Sobra na expressão: {expr!r}")
+    return node
+
+
+def _apply_update(item, expr, names, values):
+    parser = _Parser(expr, names, values)
+    while parser.peek() is not None:
+        clause = parser.take().upper()
+        while True:
+            if clause == 'SET':
+                target = parser.path(parser.take())[1]
+                parser.take('=')
+                item[target] = _eval_operand(parser.operand_expr(), item)
+            elif clause == 'REMOVE':
+                item.pop(parser.path(parser.take())[1], None)
+            elif clause == 'ADD':
+                target = parser.path(parser.take())[1]
+                value = _eval_operand(parser.operand(), item)
+                if isinstance(value, set):
+                    item[target] = set(item.get(target) or set()) | value
+                else:
+                    item[target] = item.get(target, Decimal(0)) + value
+            elif clause == 'DELETE':
+                target = parser.path(parser.take())[1]
+                item[target] = set(item.get(target) or set()) - _eval_operand(parser.operand(), item)
+            else:
+                raise FakeError('ValidationException', f"Cláusula inválida: {clause}")
+            if parser.peek() == ',':
+                parser.take()
+                continue
+            break
+
+
+# ---------------------------------------------------------------------------
+# DynamoDB
+# ---------------------------------------------------------------------------
+
+class _Max:
+    """Sentinela maior que qualquer valor (limite superior nas buscas binárias)."""
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+    def __eq__(self, other):
+        return isinstance(other, _Max)
+
+
+MAX = _Max()
+
+
+def _sortable(value):
+    return (0, value) if isinstance(value, (Decimal, int, float)) else (1, str(value))
+
+
+# Dados lidos por página de Scan (1 MB no DynamoDB; o tamanho do item é aproximado pelo repr)
+SCAN_PAGE_BYTES = 1024 * 1024
+
+# Nome interno do "índice" da chave primária de tabelas com chave de ordenação
+PRIMARY_INDEX = '__primaria__'
+
+
+class FakeTable:
+    """
+    Tabela com chave de partição (e opcionalmente de ordenação) e índices secundários
+    globais ordenados. A chave primária composta é indexada como um índice a mais, para
+    que Query sem IndexName não percorra a tabela inteira.
+    """
+
+    def __init__(self, name, hash_key, range_key=None, indexes=None):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.items = {}
+        # nome do índice -> (hash, range)
+        self.index_keys = dict(indexes or {})
+        if range_key:
+            self.index_keys[PRIMARY_INDEX] = (hash_key, range_key)
+        # (índice, valor do hash) -> lista ordenada de (range, chave primária)
+        self.index_entries = {}
+
+    def primary(self, item):
+        if self.range_key:
+            return (item[self.hash_key], item[self.range_key])
+        return (item[self.hash_key],)
+
+    def _index_entry(self, index, item):
+        hash_attr, range_attr = self.index_keys[index]
+        if item.get(hash_attr) is None or (range_attr and item.get(range_attr) is None):
+            return None
+        range_value = _sortable(item.get(range_attr)) if range_attr else (0, '')
+        return (index, item[hash_attr]), (range_value, tuple(_sortable(v) for v in self.primary(item)), self.primary(item))
+
+    def _unindex(self, item):
+        for index in self.index_keys:
+            entry = self._index_entry(index, item)
+            if entry:
+                bucket = self.index_entries.get(entry[0], [])
+                pos = bisect.bisect_left(bucket, entry[1][:2])
+                if pos < len(bucket) and bucket[pos][:2] == entry[1][:2]:
+                    bucket.pop(pos)
+
+    def _index(self, item):
+        for index in self.index_keys:
+            entry = self._index_entry(index, item)
+            if entry:
+                bisect.insort(self.index_entries.setdefault(entry[0], []), entry[1])
+
+    def put(self, item):
+        key = self.primary(item)
+        old = self.items.get(key)
+        if old is not None:
+            self._unindex(old)
+        self.items[key] = item
+        self._index(item)
+
+    def delete(self, key):
+        old = self.items.pop(key, None)
+        if old is not None:
+            self._unindex(old)
+        return old
+
+
+class FakeDynamoDB:
+    def __init__(self):
+        self.tables = {}
+
+    def create_table(self, name, hash_key='id', range_key=None, indexes=None):
+        self.tables[name] = FakeTable(name, hash_key, range_key, indexes)
+        return self.tables[name]
+
+    def table(self, name):
+        if name not in self.tables:
+            raise FakeError('ResourceNotFoundException', f"Tabela {name} não existe")
+        return self.tables[name]
+
+    @staticmethod
+    def _load(typed):
+        return {k: _deserializer.deserialize(v) for k, v in typed.items()}
+
+    @staticmethod
+    def _dump(item):
+        return {k: _serializer.serialize(v) for k, v in item.items()}
+
+    def _key(self, table, key):
+        key = self._load(key)
+        return table.primary(key)
+
+    def _check(self, params, item):
+        expr = params.get('ConditionExpression')
+        if expr and not _eval_condition(
+                _parse_condition(expr, params.get('ExpressionAttributeNames'), self._load(params.get('ExpressionAttributeValues', {}))),
+                item or {}):
+            extra = {}
+            if params.get('ReturnValuesOnConditionCheckFailure') == 'ALL_OLD' and item is not None:
+                extra['Item'] = self._dump(item)
+            raise FakeError('ConditionalCheckFailedException', 'The conditional request failed', extra=extra)
+
+    def GetItem(self, params):
+        table = self.table(params['TableName'])
+        item = table.items.get(self._key(table, params['Key']))
+        return {'Item': self._dump(item)} if item is not None else {}
+
+    def PutItem(self, params):
+        table = self.table(params['TableName'])
+        item = self._load(params['Item'])
+        self._check(params, table.items.get(table.primary(item)))
+        table.put(item)
+        return {}
+
+    def DeleteItem(self, params):
+        table = self.table(params['TableName'])
+        key = self._key(table, params['Key'])
+        self._check(params, table.items.get(key))
+        old = table.delete(key)
+        if params.get('ReturnValues') == 'ALL_OLD' and old is not None:
+            return {'Attributes': self._dump(old)}
+        return {}
+
+    def UpdateItem(self, params):
+        table = self.table(params['TableName'])
+        key_values = self._load(params['Key'])
+        key = table.primary(key_values)
+        current = table.items.get(key)
+        self._check(params, current)
+        item = dict(current) if current is not None else dict(key_values)
+        _apply_update(item, params['UpdateExpression'], params.get('ExpressionAttributeNames'),
+                      self._load(params.get('ExpressionAttributeValues', {})))
+        table.put(item)
+        if params.get('ReturnValues') in ('ALL_NEW', 'UPDATED_NEW'):
+            return {'Attributes': self._dump(item)}
+        if params.get('ReturnValues') == 'ALL_OLD' and current is not None:
+            return {'Attributes': self._dump(current)}
+        return {}
+
+    def BatchWriteItem(self, params):
+        for table_name, requests in params['RequestItems'].items():
+            table = self.table(table_name)
+            for request in requests:
+                if 'PutRequest' in request:
+                    table.put(self._load(request['PutRequest']['Item']))
+                else:
+                    table.delete(self._key(table, request['DeleteRequest']['Key']))
+        return {'UnprocessedItems': {}}
+
+    def BatchGetItem(self, params):
+        responses = {}
+        for table_name, spec in params['RequestItems'].items():
+            table = self.table(table_name)
+            found = [table.items.get(self._key(table, key)) for key in spec['Keys']]
+            responses[table_name] = [self._dump(item) for item in found if item is not None]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def _page(self, params, candidates, key_of, max_bytes=None):
+        names = params.get('ExpressionAttributeNames')
+        values = self._load(params.get('ExpressionAttributeValues', {}))
+        filter_node = _parse_condition(params['FilterExpression'], names, values) if params.get('FilterExpression') else None
+        limit = params.get('Limit')
+        items, scanned, last, size = [], 0, None, 0
+        for item in candidates:
+            scanned += 1
+            if filter_node is None or _eval_condition(filter_node, item):
+                items.append(item)
+            if max_bytes:
+                size += len(repr(item))
+            if (limit and scanned >= limit) or (max_bytes and size >= max_bytes):
+                last = item
+                break
+        result = {'Items': [self._dump(i) for i in items], 'Count': len(items), 'ScannedCount': scanned}
+        if last is not None:
+            result['LastEvaluatedKey'] = self._dump(key_of(last))
+        return result
+
+    def Scan(self, params):
+        table = self.table(params['TableName'])
+        keys = sorted(table.items, key=lambda k: tuple(_sortable(v) for v in k))
+        start = params.get('ExclusiveStartKey')
+        if start:
+            start_key = tuple(_sortable(v) for v in self._key(table, start))
+            keys = [k for k in keys if tuple(_sortable(v) for v in k) > start_key]
+        return self._page(params, (table.items[k] for k in keys),
+                          lambda item: {a: item[a] for a in (table.hash_key, table.range_key) if a},
+                          max_bytes=SCAN_PAGE_BYTES)
+
+    def Query(self, params):
+        table = self.table(params['TableName'])
+        index = params.get('IndexName') or (PRIMARY_INDEX if table.range_key else None)
+        names = params.get('ExpressionAttributeNames')
+        values = self._load(params.get('ExpressionAttributeValues', {}))
+        node = _parse_condition(params['KeyConditionExpression'], names, values)
+        conditions = []
+        while node[0] == 'and':
+            conditions.append(node[2])
+            node = node[1]
+        conditions.append(node)
+
+        hash_attr, range_attr = table.index_keys[index] if index else (table.hash_key, table.range_key)
+        hash_value, range_node = None, None
+        for cond in conditions:
+            if cond[0] == 'cmp' and cond[1] == '=' and cond[2] == ('path', hash_attr):
+                hash_value = cond[3][1]
+            else:
+                range_node = cond
+
+        if index:
+            bucket = table.index_entries.get((index, hash_value), [])
+            entries = bucket
+            if range_node is not None and range_node[0] == 'cmp':
+                bound = _sortable(range_node[3][1])
+                op = range_node[1]
+                lo = bisect.bisect_left(bucket, (bound,)) if op in ('>=', '=') else (
+                    bisect.bisect_right(bucket, (bound, MAX)) if op == '>' else 0)
+                hi = bisect.bisect_right(bucket, (bound, MAX)) if op in ('<=', '=') else (
+                    bisect.bisect_left(bucket, (bound,)) if op == '<' else len(bucket))
+                entries = bucket[lo:hi]
+            elif range_node is not None and range_node[0] == 'funcbool' and range_node[1][1] == 'begins_with':
+                prefix = _eval_operand(range_node[1][2][1], {})
+                lo = bisect.bisect_left(bucket, (_sortable(prefix),))
+                hi = bisect.bisect_left(bucket, (_sortable(prefix + '\U0010ffff'),))
+                entries = bucket[lo:hi]
+            elif range_node is not None:
+                entries = [e for e in bucket if _eval_condition(range_node, table.items[e[2]])]
+            start = params.get('ExclusiveStartKey')
+            if start:
+                start_item = self._load(start)
+                marker = (_sortable(start_item.get(range_attr)) if range_attr else (0, ''),
+                          tuple(_sortable(v) for v in table.primary(start_item)))
+                entries = entries[bisect.bisect_right(entries, marker + (MAX,)):] if entries is bucket else \
+                    [e for e in entries if e[:2] > marker]
+            ordered = [table.items[e[2]] for e in entries]
+            if params.get('ScanIndexForward') is False:
+                ordered.reverse()
+
+            def key_of(item):
+                key = {a: item[a] for a in (table.hash_key, table.range_key) if a}
+                key[hash_attr] = item[hash_attr]
+                if range_attr:
+                    key[range_attr] = item[range_attr]
+                return key
+        else:
+            ordered = [item for item in table.items.values()
+                       if item.get(hash_attr) == hash_value
+                       and (range_node is None or _eval_condition(range_node, item))]
+            ordered.sort(key=lambda i: _sortable(i.get(range_attr)) if range_attr else (0, ''))
+            start = params.get('ExclusiveStartKey')
+            if start:
+                marker = _sortable(self._load(start).get(range_attr))
+                ordered = [i for i in ordered if _sortable(i.get(range_attr)) > marker]
+            if params.get('ScanIndexForward') is False:
+                ordered.reverse()
+
+            def key_of(item):
+                return {a: item[a] for a in (table.hash_key, table.range_key) if a}
+        return self._page(params, ordered, key_of)
+
+
+# ---------------------------------------------------------------------------
+# EC2
+# ---------------------------------------------------------------------------
+
+class FakeEC2:
+    def __init__(self):
+        self.instances = {}
+
+    def add_instance(self, instance_id, name=None, state='running', tags=None, launch_time=None,
+                     instance_type='t3.medium'):
+        all_tags = dict(tags or {})
+        if name:
+            all_tags['Name'] = name
+        self.instances[instance_id] = {
+            'InstanceId': instance_id,
+            'State': {'Name': state},
+            'InstanceType': instance_type,
+            'Tags': [{'Key': k, 'Value': v} for k, v in all_tags.items()],
+            'LaunchTime': launch_time or datetime(2026, 1, 1, tzinfo=timezone.utc),
+        }
+
+    def _matches(self, inst, filters):
+        tags = {t['Key']: t['Value'] for t in inst['Tags']}
+        for flt in filters or []:
+            name, values = flt['Name'], flt['Values']
+            if name == 'instance-state-name':
+                actual = inst['State']['Name']
+            elif name == 'instance-id':
+                actual = inst['InstanceId']
+            elif name.startswith('tag:'):
+                actual = tags.get(name[4:])
+            elif name == 'tag-key':
+                if not any(fnmatch.fnmatchcase(k, v) for k in tags for v in values):
+                    return False
+                continue
+            else:
+                raise FakeError('InvalidParameterValue', f"Filtro não suportado: {name}")
+            if actual is None or not any(fnmatch.fnmatchcase(actual, v) for v in values):
+                return False
+        return True
+
+    def _require(self, ids):
+        missing = [i for i in ids if i not in self.instances]
+        if missing:
+            raise FakeError('InvalidInstanceID.NotFound', f"The instance IDs '{', '.join(missing)}' do not exist")
+
+    def _paged(self, params, selected):
+        start = int(params.get('NextToken') or 0)
+        page_size = params.get('MaxResults') or 1000
+        page = selected[start:start + page_size]
+        result = {'page': page}
+        if start + page_size < len(selected):
+            result['NextToken'] = str(start + page_size)
+        return result
+
+    def DescribeInstances(self, params):
+        ids = params.get('InstanceIds')
+        if ids:
+            self._require(ids)
+            selected = [self.instances[i] for i in ids]
+        else:
+            selected = list(self.instances.values())
+        selected = [i for i in selected if self._matches(i, params.get('Filters'))]
+        paged = self._paged(params, selected)
+        result = {'Reservations': [{'ReservationId': f"r-{inst['InstanceId'][2:]}", 'Instances': [inst]} for inst in paged['page']]}
+        if 'NextToken' in paged:
+            result['NextToken'] = paged['NextToken']
+        return result
+
+    def DescribeInstanceStatus(self, params):
+        ids = params.get('InstanceIds')
+        if ids:
+            self._require(ids)
+            selected = [self.instances[i] for i in ids]
+        else:
+            selected = list(self.instances.values())
+        if not params.get('IncludeAllInstances'):
+            selected = [i for i in selected if i['State']['Name'] == 'running']
+        selected = [i for i in selected if self._matches(i, params.get('Filters'))]
+        paged = self._paged(params, selected)
+        result = {'InstanceStatuses': [{
+            'InstanceId': inst['InstanceId'],
+            'InstanceState': {'Name': inst['State']['Name']},
+            'InstanceStatus': {'Status': 'ok' if inst['State']['Name'] == 'running' else 'not-applicable'},
+            'SystemStatus': {'Status': 'ok' if inst['State']['Name'] == 'running' else 'not-applicable'},
+        } for inst in paged['page']]}
+        if 'NextToken' in paged:
+            result['NextToken'] = paged['NextToken']
+        return result
+
+    def _transition(self, params, target, result_key):
+        ids = params['InstanceIds']
+        self._require(ids)
+        changes = []
+        for instance_id in ids:
+            inst = self.instances[instance_id]
+            previous = inst['State']['Name']
+            inst['State'] = {'Name': target}
+            if target == 'running':
+                inst['LaunchTime'] = datetime.now(timezone.utc)
+            changes.append({
+                'InstanceId': instance_id,
+                'PreviousState': {'Name': previous},
+                'CurrentState': {'Name': target},
+            })
+        return {result_key: changes}
+
+    def StartInstances(self, params):
+        return self._transition(params, 'running', 'StartingInstances')
+
+    def StopInstances(self, params):
+        return self._transition(params, 'stopped', 'StoppingInstances')
+
+    def CreateTags(self, params):
+        self._require(params['Resources'])
+        for instance_id in params['Resources']:
+            inst = self.instances[instance_id]
+            tags = {t['Key']: t['Value'] for t in inst['Tags']}
+            tags.update({t['Key']: t['Value'] for t in params['Tags']})
+            inst['Tags'] = [{'Key': k, 'Value': v} for k, v in tags.items()]
+        return {}
+
+
+class FakeLambda:
+    def __init__(self):
+        self.invocations = []
+
+    def Invoke(self, params):
+        self.invocations.append(params)
+        return {'StatusCode': 202}
+
+
+class FakeS3:
+    def __init__(self):
+        self.buckets = {}
+
+    def _bucket(self, name):
+        if name not in self.buckets:
+            raise FakeError('NoSuchBucket', 'The specified bucket does not exist', 404)
+        return self.buckets[name]
+
+    def create_bucket(self, name):
+        self.buckets.setdefault(name, {})
+
+    def PutObject(self, params):
+        body = params.get('Body', b'')
+        self._bucket(params['Bucket'])[params['Key']] = body if isinstance(body, bytes) else body.read()
+        return {'ETag': '"fake"'}
+
+    def GetObject(self, params):
+        objects = self._bucket(params['Bucket'])
+        if params['Key'] not in objects:
+            raise FakeError('NoSuchKey', 'The specified key does not exist.', 404)
+        data = objects[params['Key']]
+        return {'Body': StreamingBody(io.BytesIO(data), len(data)), 'ContentLength': len(data)}
+
+    def ListObjectsV2(self, params):
+        prefix = params.get('Prefix', '')
+        start = params.get('ContinuationToken') or params.get('StartAfter') or ''
+        keys = [k for k in sorted(self._bucket(params['Bucket'])) if k.startswith(prefix) and k > start]
+        page = keys[:params.get('MaxKeys', 1000)]
+        result = {'Contents': [{'Key': k, 'Size': len(self.buckets[params['Bucket']][k])} for k in page],
+                  'KeyCount': len(page), 'IsTruncated': len(keys) > len(page)}
+        if result['IsTruncated']:
+            result['NextContinuationToken'] = page[-1]
+        return result
+
+
+# ---------------------------------------------------------------------------
+# Instalação na sessão
+# ---------------------------------------------------------------------------
+
+class FakeAWS:
+    """Conjunto de serviços falsos; install() os conecta a uma sessão boto3."""
+
+    def __init__(self):
+        self.ec2 = FakeEC2()
+        self.dynamodb = FakeDynamoDB()
+        self.awslambda = FakeLambda()
+        self.s3 = FakeS3()
+        self.services = {'ec2': self.ec2, 'dynamodb': self.dynamodb, 'lambda': self.awslambda, 's3': self.s3}
+        # As funções usam pools de threads; o backend processa uma chamada por vez
+        self.lock = threading.Lock()
+
+    def _before_parameter_build(self, params, context, **kwargs):
+        # Guarda os parâmetros já transformados (ex: tipos do DynamoDB) antes da serialização HTTP
+        context['fake_params'] = params
+
+    def _before_call(self, model, context, **kwargs):
+        service = self.services.get(model.service_model.service_id.hyphenize())
+        handler = getattr(service, model.name, None)
+        if handler is None:
+            raise NotImplementedError(f"{model.service_model.service_id}.{model.name} não suportado pelo backend falso")
+        try:
+            with self.lock:
+                parsed = handler(context['fake_params'])
+            parsed.setdefault('ResponseMetadata', {'HTTPStatusCode': 200})
+            return _http(200), parsed
+        except FakeError as e:
+            return _http(e.status), {
+                'Error': {'Code': e.code, 'Message': e.message},
+                'ResponseMetadata': {'HTTPStatusCode': e.status},
+                **e.extra,
+            }
+
+    def install(self, session):
+        # Registrado por último: os hooks de métricas de 'before-call' rodam antes e contam a chamada
+        session.events.register('before-parameter-build', self._before_parameter_build, unique_id='fake-aws-params')
+        session.events.register_last('before-call', self._before_call, unique_id='fake-aws-call')
+        return session
+
+
+def iso_utc(dt):
+    return dt.astimezone(timezone.utc).isoformat()
+
+
+def minutes_from_now(minutes):
+    return iso_utc(datetime.now(timezone.utc) + timedelta(minutes=minutes))
@@ -0,0 +1,486 @@
+"""
+Benchmark offline dos caminhos de comando com orçamento de chamadas à AWS.
+
+Roda os handlers reais das três funções contra o backend em memória de fake_aws.py,
+em frotas de 10, 1k e 10k instâncias e tabelas com 0, 1k e 100k agendamentos pendentes.
+Para cada cenário reporta latência p50/p99, pico de memória (tracemalloc) e o número
+exato de chamadas por operação da AWS (contadas por comum/metrics.py).
+
+As contagens são comparadas com benchmarks/budgets.json: uma operação nova ou acima
+do orçamento (ex: um describe_instances a mais em um caminho quente) faz o benchmark
+sair com código 1. Depois de uma mudança intencional, regrave com --update-budgets.
+
+Uso:
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --fleets 10,1000 --schedules 0,1000 --iterations 10
+    python benchmarks/run_benchmarks.py --update-budgets
+"""
+import argparse
+import copy
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+BUDGETS_FILE = os.path.join(BENCH_DIR, 'budgets.json')
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+os.environ['DYNAMODB_TABLE_NAME'] = 'EC2InstanceSchedules'
+os.environ['METRICS_ENABLED'] = 'false'
+os.environ['EVENT_LOG_SAMPLE_RATE'] = '0'
+os.environ['HISTORY_BUCKET'] = 'ec2-chatops-historico'
+os.environ['USAGE_TABLE_NAME'] = 'EC2InstanceUsage'
+os.environ['INVENTORY_TABLE_NAME'] = 'EC2InstanceInventory'
+# Container "quente" durante toda a grade: o inventário só é recarregado onde o cenário pede
+# (menu_cache_frio), e não quando um cenário lento passa do TTL padrão de 60 s
+os.environ['INVENTORY_TTL_SECONDS'] = '86400'
+# O limitador de taxa roda (e suas escritas no DynamoDB são contadas), mas com um balde que
+# nunca esvazia: nenhuma espera mascara a latência medida e, como o balde fica sempre "em uso",
+# cada chamada à EC2 custa exatamente um UpdateItem (contagem determinística)
+os.environ['EC2_RATE_LIMIT'] = '1'
+os.environ['EC2_RATE_BURST'] = '1000000000'
+sys.path[:0] = [REPO_ROOT, BENCH_DIR, os.path.join(REPO_ROOT, 'GoogleChatEC2Bot')]
+
+import boto3  # noqa: E402
+
+from comum import alvos, aws, historico, inventario, limitador, metrics  # noqa: E402
+from fake_aws import FakeAWS  # noqa: E402
+
+ADMIN = 'admin.user@example.com'
+PENDING_INDEX = 'fila-horario-index'
+INSTANCE_INDEX = 'instancia-horario-index'
+NAME_INDEX = 'nome-index'
+CHAT_SPACE = 'spaces/BENCH'
+BOT_MENTION = '@EC2Bot'
+DUE_FRACTION = 0.01
+# Histórico pré-existente da instância consultada no cenário 'historico'
+HISTORY_DAYS, HISTORY_BATCHES_PER_DAY, HISTORY_RUNS_PER_BATCH = 10, 4, 5
+# Dias de agregados de uso pré-existentes para toda a frota (cenário 'relatorio')
+USAGE_DAYS = 7
+# Minuto do dia (horário local) 12 h à frente: os agendamentos criados pelos cenários de
+# 'agendar' não vencem durante o benchmark nem entram no tick do executor
+_now_local = datetime.now(timezone(timedelta(hours=-3)))
+SCHEDULE_BASE_MINUTE = (_now_local.hour * 60 + _now_local.minute + 12 * 60) % (24 * 60)
+
+
+def load_handler(module_name, function_dir):
+    spec = importlib.util.spec_from_file_location(
+        module_name, os.path.join(REPO_ROOT, function_dir, 'lambda_function.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+bot = load_handler('bench_bot', 'GoogleChatEC2Bot')
+executor = load_handler('bench_executor', 'ExecutaAgendamentosEC2')
+inventory_handler = load_handler('bench_inventario', 'AtualizaInventarioEC2')
+logging.getLogger().setLevel(logging.WARNING)
+
+
+class FakeContext:
+    def get_remaining_time_in_millis(self):
+        return 600000
+
+
+# ---------------------------------------------------------------------------
+# Cenário de dados
+# ---------------------------------------------------------------------------
+
+def instance_id(n):
+    return f"i-{n:017x}"
+
+
+def instance_name(n):
+    return f"srv-{n:05d}"
+
+
+def schedule_item(n, fleet, horario):
+    return {
+        'id': f"ag-{n:06d}",
+        'instancia': instance_id(n % fleet),
+        'acao': 'stop' if n % 2 else 'start',
+        'horario': horario,
+        'solicitante': ADMIN,
+        'status': 'pendente',
+        'fila': 'pendente',
+    }
+
+
+def due_items(fleet, schedules):
+    """Agendamentos vencidos (1% da tabela), recriados antes de cada tick do executor."""
+    past = (datetime.now(timezone.utc) - timedelta(minutes=1)).isoformat()
+    return [schedule_item(n, fleet, past) for n in range(int(schedules * DUE_FRACTION))]
+
+
+def build_world(fleet, schedules):
+    fake = FakeAWS()
+    for n in range(fleet):
+        fake.ec2.add_instance(
+            instance_id(n), name=instance_name(n),
+            state='running' if n % 2 else 'stopped',
+            tags={'env': ('dev', 'qa', 'prod')[n % 3]}
+        )
+    table = fake.dynamodb.create_table('EC2InstanceSchedules', indexes={
+        PENDING_INDEX: ('fila', 'horario'),
+        INSTANCE_INDEX: ('instancia', 'horario'),
+    })
+    # Pendentes a partir de uma semana, longe dos horários criados pelos cenários de 'agendar'
+    start = datetime.now(timezone.utc) + timedelta(days=7)
+    for n in range(int(schedules * DUE_FRACTION), schedules):
+        table.put(schedule_item(n, fleet, (start + timedelta(seconds=n)).isoformat()))
+
+    session = boto3.session.Session()
+    metrics.instrument_session(session)
+    limitador.install(session)
+    fake.install(session)
+    aws.use_session(session)
+
+    fake.s3.create_bucket(os.environ['HISTORY_BUCKET'])
+    store = historico.S3HistoryStore(os.environ['HISTORY_BUCKET'])
+    # Lotes ancorados ao meio-dia (UTC): a quantidade de partições lidas não depende da hora da execução
+    noon = datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+    for day in range(HISTORY_DAYS):
+        for batch in range(HISTORY_BATCHES_PER_DAY):
+            executed_at = noon - timedelta(days=day, hours=batch)
+            records = [
+                historico.build_record({**schedule_item(run, fleet, executed_at.isoformat()), 'instancia': instance_id(5)},
+                                       'executado', executed_at)
+                for run in range(HISTORY_RUNS_PER_BATCH)
+            ]
+            for (shard, partition_day), group in historico.group_records(records).items():
+                store.append(shard, partition_day, group)
+
+    usage = fake.dynamodb.create_table(os.environ['USAGE_TABLE_NAME'], hash_key='dia', range_key='chave')
+    today = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=-3))).date()
+    for day in range(USAGE_DAYS):
+        for n in range(fleet):
+            usage.put({'dia': (today - timedelta(days=day)).isoformat(), 'chave': f"r#{instance_id(n)}", 'segundos': 3600 * (n % 24)})
+    for n in range(1, fleet, 2):
+        usage.put({'dia': 'estado', 'chave': f"s#{instance_id(n)}", 'ligada_desde': int(time.time()) - 7200})
+
+    # Tabela de inventário já sincronizada com a frota (como depois de um 'sincronizar_inventario')
+    inventory = fake.dynamodb.create_table(os.environ['INVENTORY_TABLE_NAME'], indexes={NAME_INDEX: ('nome_busca', None)})
+    for inst in fake.ec2.instances.values():
+        inventory.put(inventario.instance_to_item(inst, alvos.DEFAULT_TARGET))
+
+    bot._inventory['loaded_at'] = None
+    return fake
+
+
+# ---------------------------------------------------------------------------
+# Eventos
+# ---------------------------------------------------------------------------
+
+# Número das mensagens de text_event: cada chamada é uma mensagem nova do usuário
+_message_numbers = itertools.count(1)
+
+
+def chat_user(email):
+    return {'name': f"users/{email.split('@')[0]}", 'displayName': 'Benchmark', 'email': email, 'type': 'HUMAN'}
+
+
+def event_time():
+    return datetime.now(timezone.utc).isoformat(timespec='microseconds').replace('+00:00', 'Z')
+
+
+def text_event(text, email=ADMIN, message_number=None, sent_at=None):
+    """
+    Evento MESSAGE no formato enviado pelo Google Chat: o comando vem após a menção ao bot em
+    message.text (com a anotação USER_MENTION). Sem 'message_number'/'sent_at', cada chamada
+    é uma mensagem nova (nome e horário únicos), como em produção.
+    """
+    message_number = next(_message_numbers) if message_number is None else message_number
+    return {'body': json.dumps({
+        'type': 'MESSAGE',
+        'eventTime': sent_at or event_time(),
+        'space': {'name': CHAT_SPACE, 'type': 'ROOM'},
+        'user': chat_user(email),
+        'message': {
+            'name': f"{CHAT_SPACE}/messages/{message_number}",
+            'sender': chat_user(email),
+            'text': f"{BOT_MENTION} {text}",
+            'argumentText': f" {text}",
+            'annotations': [{
+                'type': 'USER_MENTION', 'startIndex': 0, 'length': len(BOT_MENTION),
+                'userMention': {'user': {'name': 'users/bot', 'displayName': 'EC2Bot', 'type': 'BOT'}, 'type': 'MENTION'},
+            }],
+            'space': {'name': CHAT_SPACE, 'type': 'ROOM'},
+        },
+    })}
+
+
+def retried_event(text, email=ADMIN):
+    """Reenvio pelo Google Chat: a mesma mensagem (nome e horário) a cada chamada."""
+    return text_event(text, email, message_number=0, sent_at='2026-01-01T00:00:00Z')
+
+
+def button_event(action_method, parameters=None, email=ADMIN):
+    """Evento CARD_CLICKED no formato do Google Chat, com horário único a cada chamada."""
+    action = {'actionMethodName': action_method}
+    if parameters:
+        action['parameters'] = [{'key': k, 'value': v} for k, v in parameters.items()]
+    return {'body': json.dumps({
+        'type': 'CARD_CLICKED',
+        'eventTime': event_time(),
+        'space': {'name': CHAT_SPACE, 'type': 'ROOM'},
+        'user': chat_user(email),
+        'message': {'name': f"{CHAT_SPACE}/messages/card", 'sender': {'name': 'users/bot', 'type': 'BOT'}},
+        'action': action,
+    })}
+
+
+def next_page_parameters(result):
+    """Extrai os parâmetros do botão 'Próxima página' de uma resposta em card."""
+    body = json.loads(result['body'])
+    for card in body.get('cards', []):
+        for section in card.get('sections', []):
+            for widget in section.get('widgets', []):
+                for button in widget.get('buttons', []):
+                    action = button['textButton']['onClick']['action']
+                    if action['actionMethodName'].endswith('proxima_pagina'):
+                        return {p['key']: p['value'] for p in action['parameters']}
+    return None
+
+
+def bot_call(make_event, *args):
+    """Chamada ao bot com um evento novo, make_event(*args), a cada execução."""
+    return lambda world: bot.lambda_handler(make_event(*args), None)
+
+
+def bot_schedule(template):
+    """'agendar' com um minuto diferente a cada chamada, para medir a criação e não a união com um existente."""
+    def run(world):
+        world['minute'] = world.get('minute', SCHEDULE_BASE_MINUTE) + 1
+        return bot.lambda_handler(text_event(template.format(hhmm=f"{world['minute'] // 60 % 24:02d}:{world['minute'] % 60:02d}")), None)
+    return run
+
+
+def bulk_toggle(target):
+    """start/stop em massa alternados, para que cada chamada encontre instâncias a mudar de estado."""
+    def run(world):
+        world['bulk_command'] = 'start' if world.get('bulk_command') == 'stop' else 'stop'
+        return bot.lambda_handler(text_event(f"{world['bulk_command']} {target}"), None)
+    return run
+
+
+def clear_inventory_cache():
+    """Cache de inventário vazio, como no primeiro comando de um container novo."""
+    bot._inventory.update(loaded_at=None, by_id={}, by_name={})
+
+
+def cold_call(text):
+    """Comando com o cache de inventário vazio a cada chamada."""
+    def run(world):
+        clear_inventory_cache()
+        return bot.lambda_handler(text_event(text), None)
+    return run
+
+
+def state_change_event(world):
+    """Evento de mudança de estado da EC2 (EventBridge), alternando parada e partida."""
+    world['event_state'] = 'pending' if world.get('event_state') == 'stopping' else 'stopping'
+    return inventory_handler.lambda_handler({
+        'source': 'aws.ec2',
+        'detail-type': 'EC2 Instance State-change Notification',
+        'region': alvos.DEFAULT_TARGET.region,
+        'account': '123456789012',
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'),
+        'detail': {'instance-id': instance_id(8), 'state': world['event_state']},
+    }, FakeContext())
+
+
+def tag_change_event(world):
+    """Evento de mudança de tags (EventBridge), com a versão crescente a cada chamada."""
+    world['tags_version'] = world.get('tags_version', 0) + 1
+    return inventory_handler.lambda_handler({
+        'source': 'aws.tag',
+        'detail-type': 'Tag Change on Resource',
+        'region': alvos.DEFAULT_TARGET.region,
+        'account': '123456789012',
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'),
+        'resources': [f"arn:aws:ec2:{alvos.DEFAULT_TARGET.region}:123456789012:instance/{instance_id(8)}"],
+        'detail': {
+            'service': 'ec2', 'resource-type': 'instance', 'version': world['tags_version'],
+            'changed-tag-keys': ['LastActionBy'],
+            'tags': {'Name': instance_name(8), 'env': 'qa', 'LastActionBy': f"Benchmark - {world['tags_version']}"},
+        },
+    }, FakeContext())
+
+
+def executor_tick(world):
+    return executor.lambda_handler({}, FakeContext())
+
+
+def prepare_executor_tick(world):
+    table = world['fake'].dynamodb.tables['EC2InstanceSchedules']
+    for item in due_items(world['fleet'], world['schedules']):
+        table.put(item)
+
+
+def bot_page_click(first_command, action_method):
+    def run(world):
+        parameters = world.setdefault('cursors', {}).get(action_method)
+        if parameters is None:
+            parameters = next_page_parameters(bot.lambda_handler(text_event(first_command), None)) or {}
+            world['cursors'][action_method] = parameters
+        if not parameters:
+            return None
+        return bot.lambda_handler(button_event(action_method, parameters), None)
+    return run
+
+
+SCENARIOS = {
+    'start': (bot_call(text_event, 'start srv-00001'), None),
+    'stop': (bot_call(text_event, 'stop srv-00002'), None),
+    'status': (bot_call(text_event, 'status srv-00003'), None),
+    'status_lote': (bot_call(text_event, 'status tag:env=qa'), None),
+    'aguardar': (bot_call(text_event, 'aguardar running srv-00003 srv-00005 srv-00009'), None),
+    'agendar': (bot_schedule('agendar stop srv-00004 {hhmm}'), None),
+    'agendar_recorrente': (bot_schedule('agendar stop srv-00004 {hhmm} seg-sex'), None),
+    'agendar_duplicado': (bot_call(text_event, f"agendar stop srv-00006 {SCHEDULE_BASE_MINUTE // 60:02d}:{SCHEDULE_BASE_MINUTE % 60:02d}"), None),
+    'menu': (bot_call(text_event, 'menu'), None),
+    'menu_filtro': (bot_call(text_event, 'menu tag:env=dev'), None),
+    'menu_cache_frio': (cold_call('menu'), None),
+    'status_cache_frio': (cold_call('status srv-00003'), None),
+    'status_lote_cache_frio': (cold_call('status srv-00003 srv-00005'), None),
+    'aguardar_cache_frio': (cold_call('aguardar running srv-00003 srv-00005'), None),
+    'agendamentos': (bot_call(text_event, 'agendamentos'), None),
+    'historico': (bot_call(text_event, 'historico srv-00005'), None),
+    'relatorio': (bot_call(text_event, 'relatorio'), None),
+    'reenvio_start': (bot_call(retried_event, 'start srv-00007'), None),
+    'massa_tag': (bulk_toggle('tag:env=qa'), None),
+    'botao_solicitar': (bot_call(button_event, f"solicitar_start_{instance_id(0)}"), None),
+    'botao_menu_pagina': (bot_page_click('menu', 'menu_proxima_pagina'), None),
+    'botao_agendamentos_pagina': (bot_page_click('agendamentos', 'agendamentos_proxima_pagina'), None),
+    'executor_tick': (executor_tick, prepare_executor_tick),
+    'evento_estado': (state_change_event, None),
+    'evento_tags': (tag_change_event, None),
+    'sincronizar_inventario': (lambda world: inventory_handler.lambda_handler({'sincronizar_inventario': True}, FakeContext()), None),
+}
+
+
+# ---------------------------------------------------------------------------
+# Execução
+# ---------------------------------------------------------------------------
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def reset_world(world):
+    """
+    Estado inicial de cada cenário: instâncias como em build_world, caches de cards e de
+    idempotência vazios e o inventário recém-carregado (container "quente"; os cenários
+    *_cache_frio o esvaziam). Assim o resultado de um cenário não depende dos que rodaram antes.
+    """
+    world['fake'].ec2.instances = copy.deepcopy(world['instances'])
+    bot.render_cache = bot.renderizacao.RenderCache()
+    bot.idempotency = bot.idempotencia.IdempotencyStore()
+    clear_inventory_cache()
+    bot.load_inventory()
+
+
+def run_scenario(world, run, prepare, iterations):
+    # Aquecimento: popula caches de módulo como em um container "quente"
+    if prepare:
+        prepare(world)
+    run(world)
+
+    durations, max_calls = [], {}
+    for _ in range(iterations):
+        if prepare:
+            prepare(world)
+        # Coletor limpo: cenários que não chegam a chamar o handler não herdam contagens
+        metrics.start_invocation('benchmark')
+        started = time.perf_counter()
+        run(world)
+        durations.append((time.perf_counter() - started) * 1000)
+        for operation, (count, _) in metrics.current().api_calls.items():
+            max_calls[operation] = max(max_calls.get(operation, 0), count)
+
+    if prepare:
+        prepare(world)
+    tracemalloc.start()
+    run(world)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'p50_ms': statistics.median(durations),
+        'p99_ms': percentile(durations, 99),
+        'peak_kb': peak / 1024,
+        'api_calls': dict(sorted(max_calls.items())),
+    }
+
+
+def check_budget(key, api_calls, budgets):
+    budget = budgets.get(key)
+    if budget is None:
+        return [f"{key}: sem orçamento registrado (rode com --update-budgets)"]
+    failures = []
+    for operation, count in api_calls.items():
+        allowed = budget.get(operation, 0)
+        if count > allowed:
+            failures.append(f"{key}: {operation} = {count} chamada(s), orçamento {allowed}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fleets', default='10,1000,10000')
+    parser.add_argument('--schedules', default='0,1000,100000')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--update-budgets', action='store_true')
+    args = parser.parse_args()
+
+    budgets = {}
+    if os.path.exists(BUDGETS_FILE):
+        with open(BUDGETS_FILE) as f:
+            budgets = json.load(f)
+
+    failures = []
+    print(f"{'cenário':<28}{'frota':>7}{'agend.':>8}{'p50 ms':>10}{'p99 ms':>10}{'pico KB':>10}  chamadas")
+    for fleet in [int(v) for v in args.fleets.split(',')]:
+        for schedules in [int(v) for v in args.schedules.split(',')]:
+            fake = build_world(fleet, schedules)
+            world = {'fake': fake, 'fleet': fleet, 'schedules': schedules,
+                     'instances': copy.deepcopy(fake.ec2.instances)}
+            for name in args.scenarios.split(','):
+                run, prepare = SCENARIOS[name]
+                reset_world(world)
+                result = run_scenario(world, run, prepare, args.iterations)
+                key = f"{name}@{fleet}x{schedules}"
+                calls = ", ".join(f"{op}={n}" for op, n in result['api_calls'].items()) or "-"
+                print(f"{name:<28}{fleet:>7}{schedules:>8}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+                      f"{result['peak_kb']:>10.0f}  {calls}")
+                if args.update_budgets:
+                    budgets[key] = result['api_calls']
+                else:
+                    failures.extend(check_budget(key, result['api_calls'], budgets))
+
+    if args.update_budgets:
+        with open(BUDGETS_FILE, 'w') as f:
+            json.dump(dict(sorted(budgets.items())), f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Orçamentos gravados em {BUDGETS_FILE}")
+        return 0
+
+    for failure in failures:
+        print(f"FALHA: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,6 @@
+"""
+Código compartilhado pelas funções Lambda do projeto.
+
+Deve ser empacotado junto com cada função (diretório 'comum/' ao lado do
+lambda_function.py) ou publicado como Lambda Layer (python/comum/).
+"""
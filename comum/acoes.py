@@ -0,0 +1,62 @@
+"""
+Start/stop de várias instâncias de um alvo (comum/alvos.py) em uma única chamada à EC2.
+
+Usado pelo ExecutaAgendamentosEC2 (lotes de agendamentos) e pelas ações em massa do bot.
+A EC2 rejeita a chamada inteira se um único ID for inválido ou estiver em um estado que
+não aceita a ação (ex: IncorrectInstanceState); nesse caso o lote é dividido ao meio até
+isolar os IDs com problema, e as demais instâncias são aplicadas normalmente.
+"""
+from comum import alvos, limitador
+
+# Ações suportadas: método do cliente EC2 e chave da resposta com o resultado por instância
+EC2_ACTIONS = {
+    'start': ('start_instances', 'StartingInstances'),
+    'stop': ('stop_instances', 'StoppingInstances'),
+}
+
+
+def error_message(e):
+    """Mensagem do erro da EC2 (sem o prefixo do botocore), usada nas respostas e nos logs."""
+    return e.response.get('Error', {}).get('Message') or str(e)
+
+
+def state_changes(acao, res):
+    """
+    {id aceito: mudou de estado} a partir da resposta de start/stop da EC2. 'mudou' é False
+    quando a instância já estava no estado pedido (PreviousState igual a CurrentState, ex:
+    start de uma instância ligada): nesse caso não há transição a registrar.
+    """
+    return {
+        inst['InstanceId']: inst.get('PreviousState', {}).get('Name') != inst.get('CurrentState', {}).get('Name')
+        for inst in res.get(EC2_ACTIONS[acao][1], [])
+    }
+
+
+def run_ec2_action(acao, instance_ids, alvo=None):
+    """
+    Executa start/stop para várias instâncias (do mesmo alvo; None = alvo padrão) em uma única chamada.
+    Retorna ({id aceito: mudou de estado}, {id: erro}), ver state_changes. Se a EC2 rejeitar
+    o lote inteiro, ele é dividido ao meio até isolar os IDs com problema.
+    Limitações de taxa não são culpa de nenhum ID: o erro é repassado sem dividir o lote.
+    """
+    from botocore.exceptions import ClientError
+
+    alvo = alvo or alvos.DEFAULT_TARGET
+    try:
+        res = getattr(alvo.ec2(), EC2_ACTIONS[acao][0])(InstanceIds=instance_ids)
+    except ClientError as e:
+        if limitador.is_throttle_error(e):
+            raise
+        if len(instance_ids) == 1:
+            return {}, {instance_ids[0]: error_message(e)}
+        meio = len(instance_ids) // 2
+        aceitas_esq, erros_esq = run_ec2_action(acao, instance_ids[:meio], alvo)
+        aceitas_dir, erros_dir = run_ec2_action(acao, instance_ids[meio:], alvo)
+        return {**aceitas_esq, **aceitas_dir}, {**erros_esq, **erros_dir}
+
+    aceitas = state_changes(acao, res)
+    erros = {
+        instance_id: "Instância não retornada pela EC2"
+        for instance_id in instance_ids if instance_id not in aceitas
+    }
+    return aceitas, erros
@@ -0,0 +1,161 @@
+"""
+Regiões e contas (alvos) onde ficam as instâncias EC2 gerenciadas.
+
+Por padrão há um único alvo: a região e a conta da própria Lambda. EC2_TARGETS lista os
+alvos em JSON, cada um com a região e, para outra conta, a role a assumir:
+
+    [{"regiao": "us-east-1"},
+     {"regiao": "sa-east-1"},
+     {"regiao": "us-east-1", "role_arn": "arn:aws:iam::111122223333:role/EC2ChatOps", "nome": "prod"}]
+
+'nome' (opcional) identifica o alvo nos agendamentos; o padrão é a região, ou
+'<conta>/<região>' com role. 'external_id' (opcional) é repassado ao AssumeRole.
+
+As leituras que cobrem a frota inteira rodam em todos os alvos ao mesmo tempo (fan_out),
+em um pool limitado a EC2_TARGET_WORKERS threads. Um alvo que falha ou não responde em
+EC2_TARGET_TIMEOUT_SECONDS fica de fora do resultado sem derrubar os demais. Como a thread
+de uma chamada abandonada não pode ser interrompida, com vários alvos os clientes EC2 têm
+os timeouts de conexão e de leitura limitados a EC2_TARGET_TIMEOUT_SECONDS: uma tentativa
+presa termina sozinha e libera a thread do pool.
+
+Variáveis de ambiente:
+- EC2_TARGETS                 lista dos alvos (JSON; vazio = só a região/conta da Lambda)
+- EC2_TARGET_WORKERS          consultas simultâneas a alvos diferentes (padrão 8)
+- EC2_TARGET_TIMEOUT_SECONDS  espera máxima pelas respostas dos alvos (padrão 10)
+"""
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from comum import metrics
+from comum.aws import get_client
+
+logger = logging.getLogger()
+
+EC2_TARGETS = os.environ.get('EC2_TARGETS', '')
+EC2_TARGET_WORKERS = int(os.environ.get('EC2_TARGET_WORKERS', '8'))
+EC2_TARGET_TIMEOUT_SECONDS = float(os.environ.get('EC2_TARGET_TIMEOUT_SECONDS', '10'))
+
+
+class Target:
+    """Uma região, na conta da Lambda ou em outra conta (role assumida)."""
+
+    def __init__(self, region=None, role_arn=None, name=None, external_id=None):
+        self.region = region or os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION')
+        self.role_arn = role_arn
+        self.external_id = external_id
+        # Conta do alvo (None = a da própria Lambda)
+        self.account = role_arn.split(':')[4] if role_arn else None
+        if name:
+            self.id = name
+        elif role_arn:
+            self.id = f"{self.account}/{self.region}"
+        else:
+            self.id = self.region or 'padrao'
+
+    def ec2(self):
+        """Cliente EC2 do alvo (criado no primeiro uso)."""
+        # Com um único alvo o fan_out roda na própria thread, sem timeout: o cliente é o de sempre
+        timeout = EC2_TARGET_TIMEOUT_SECONDS if is_multi_target() else None
+        return get_client('ec2', region_name=self.region, role_arn=self.role_arn, external_id=self.external_id,
+                          timeout=timeout)
+
+    def __repr__(self):
+        return f"Target({self.id})"
+
+
+def parse_targets(config):
+    """Converte o JSON de EC2_TARGETS em [Target, ...] (um alvo padrão se vazio)."""
+    targets = [
+        Target(entry.get('regiao'), entry.get('role_arn'), entry.get('nome'), entry.get('external_id'))
+        for entry in (json.loads(config) if config else [])
+    ] or [Target()]
+    ids = [target.id for target in targets]
+    duplicated = {target_id for target_id in ids if ids.count(target_id) > 1}
+    if duplicated:
+        raise ValueError(f"EC2_TARGETS com alvos repetidos: {', '.join(sorted(duplicated))} (use 'nome' para diferenciá-los)")
+    return targets
+
+
+TARGETS = parse_targets(EC2_TARGETS)
+DEFAULT_TARGET = TARGETS[0]
+_by_id = {target.id: target for target in TARGETS}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def is_multi_target():
+    return len(TARGETS) > 1
+
+
+def get_target(target_id):
+    """Alvo pelo ID gravado no inventário/agendamento; o padrão se ausente ou não mais configurado."""
+    return _by_id.get(target_id, DEFAULT_TARGET) if target_id else DEFAULT_TARGET
+
+
+def find_target(region, account, own_account=None):
+    """
+    Alvo de uma região/conta (ex: a de um evento do EventBridge): o da role dessa conta ou,
+    sem ele, o da conta da própria Lambda ('own_account', se conhecida) na região. None se
+    a região/conta não for gerenciada.
+    """
+    for target in TARGETS:
+        if target.region == region and target.account == account:
+            return target
+    if own_account is None or account == own_account:
+        for target in TARGETS:
+            if target.region == region and target.account is None:
+                return target
+    return None
+
+
+def group_by_target(items, target_id_of):
+    """Agrupa os itens pelo alvo: {Target: [itens]}, na ordem de TARGETS."""
+    groups = {}
+    for item in items:
+        groups.setdefault(get_target(target_id_of(item)), []).append(item)
+    return {target: groups[target] for target in TARGETS if target in groups}
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=EC2_TARGET_WORKERS, thread_name_prefix='alvo')
+    return _pool
+
+
+def fan_out(fn, targets=None, timeout=EC2_TARGET_TIMEOUT_SECONDS):
+    """
+    Executa fn(alvo) em todos os alvos ao mesmo tempo. Retorna ({id do alvo: resultado},
+    {id do alvo: erro}). Alvos que falham ou não respondem em 'timeout' segundos ficam em
+    'erros'; se nenhum alvo responder, o primeiro erro é repassado. Com um único alvo,
+    executa na própria thread (sem pool nem timeout, como antes dos alvos).
+    """
+    targets = list(TARGETS if targets is None else targets)
+    if len(targets) == 1:
+        return {targets[0].id: fn(targets[0])}, {}
+
+    futures = {_get_pool().submit(fn, target): target for target in targets}
+    done, not_done = wait(futures, timeout=timeout)
+    results, errors = {}, {}
+    for future, target in futures.items():
+        if future in not_done:
+            # Só desfaz chamadas ainda na fila do pool; as já iniciadas terminam pelos timeouts do cliente
+            future.cancel()
+            errors[target.id] = TimeoutError(f"sem resposta em {timeout:g}s")
+        elif future.exception() is not None:
+            errors[target.id] = future.exception()
+        else:
+            results[target.id] = future.result()
+    for target_id, error in errors.items():
+        logger.warning(f"Alvo {target_id} indisponível: {error}")
+    if errors:
+        metrics.add_value('AlvosIndisponiveis', len(errors))
+        if not results:
+            raise next(iter(errors.values()))
+    return results, errors
@@ -0,0 +1,190 @@
+"""
+Clientes AWS compartilhados, construídos sob demanda.
+
+Todos os clientes usam uma única sessão do botocore e são criados apenas no primeiro
+uso, de modo que caminhos que não falam com a AWS (ex: "Comando inválido") não pagam
+o custo de importar o boto3 nem de construir clientes. A configuração de conexão é
+lida das variáveis de ambiente:
+
+- BOTO_MAX_POOL_CONNECTIONS  tamanho do pool de conexões HTTP por cliente (padrão 10)
+- BOTO_RETRY_MODE            modo de retentativa do botocore: legacy, standard ou adaptive (padrão standard)
+- BOTO_MAX_ATTEMPTS          número máximo de tentativas por chamada (padrão 3)
+- BOTO_CONNECT_TIMEOUT       timeout de conexão em segundos (padrão 2)
+- BOTO_READ_TIMEOUT          timeout de leitura em segundos (padrão 5)
+- BOTO_TCP_KEEPALIVE         habilita TCP keep-alive nas conexões (padrão true)
+- EC2_RETRY_MODE             modo de retentativa dos clientes EC2 (padrão adaptive: backoff com jitter
+                             e limitação de taxa no próprio cliente ao receber RequestLimitExceeded)
+- EC2_MAX_ATTEMPTS           número máximo de tentativas das chamadas à EC2 (padrão 8)
+
+As chamadas à EC2 passam ainda pelo limitador de taxa compartilhado (comum/limitador.py).
+
+Clientes de outra região ou de outra conta (role assumida, ver comum/alvos.py) também são
+criados sob demanda: as credenciais temporárias da role são obtidas no primeiro uso e
+renovadas automaticamente antes de expirar.
+"""
+import os
+import threading
+
+_lock = threading.RLock()
+_session = None
+_clients = {}
+
+# Nome da sessão nas credenciais temporárias das roles assumidas (aparece no CloudTrail)
+ASSUME_ROLE_SESSION_NAME = os.environ.get('ASSUME_ROLE_SESSION_NAME', 'ec2-chatops')
+
+
+# Retentativas por serviço: (variável do modo, modo padrão, variável de tentativas, tentativas padrão)
+SERVICE_RETRIES = {
+    'ec2': ('EC2_RETRY_MODE', 'adaptive', 'EC2_MAX_ATTEMPTS', '8'),
+}
+
+
+def client_config(service_name=None, timeout=None):
+    """
+    Monta o botocore Config a partir das variáveis de ambiente. 'timeout' (s), se informado,
+    limita os timeouts de conexão e de leitura de cada tentativa.
+    """
+    from botocore.config import Config
+
+    connect_timeout = float(os.environ.get('BOTO_CONNECT_TIMEOUT', '2'))
+    read_timeout = float(os.environ.get('BOTO_READ_TIMEOUT', '5'))
+    if timeout is not None:
+        connect_timeout, read_timeout = min(connect_timeout, timeout), min(read_timeout, timeout)
+    mode_var, mode, attempts_var, attempts = SERVICE_RETRIES.get(
+        service_name, ('BOTO_RETRY_MODE', 'standard', 'BOTO_MAX_ATTEMPTS', '3'))
+    return Config(
+        max_pool_connections=int(os.environ.get('BOTO_MAX_POOL_CONNECTIONS', '10')),
+        retries={
+            'mode': os.environ.get(mode_var, mode),
+            'max_attempts': int(os.environ.get(attempts_var, attempts)),
+        },
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        tcp_keepalive=os.environ.get('BOTO_TCP_KEEPALIVE', 'true').lower() == 'true',
+    )
+
+
+def get_session():
+    """Retorna a sessão boto3 única do processo."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import boto3
+                from comum import limitador, metrics
+
+                session = boto3.session.Session()
+                metrics.instrument_session(session)
+                limitador.install(session)
+                _session = session
+    return _session
+
+
+def get_role_session(role_arn, external_id=None):
+    """
+    Sessão boto3 com as credenciais da role 'role_arn', assumida a partir da sessão do
+    processo e renovada automaticamente. Recebe as mesmas métricas e o limitador de taxa,
+    este com um balde próprio da conta.
+    """
+    def factory():
+        import boto3
+        import botocore.session
+        from botocore.credentials import (AssumeRoleCredentialFetcher, CredentialProvider, CredentialResolver,
+                                          DeferredRefreshableCredentials)
+        from comum import limitador, metrics
+
+        base = get_session()
+        extra_args = {'RoleSessionName': ASSUME_ROLE_SESSION_NAME}
+        if external_id:
+            extra_args['ExternalId'] = external_id
+        # O cliente STS vem da sessão do processo: as chamadas ao AssumeRole entram nas métricas
+        fetcher = AssumeRoleCredentialFetcher(
+            client_creator=base.client,
+            source_credentials=base.get_credentials(),
+            role_arn=role_arn,
+            extra_args=extra_args,
+        )
+
+        class AssumeRoleProvider(CredentialProvider):
+            METHOD = 'assume-role'
+
+            def load(self):
+                # Credenciais obtidas na primeira chamada e renovadas antes de expirar
+                return DeferredRefreshableCredentials(method=self.METHOD, refresh_using=fetcher.fetch_credentials)
+
+        core = botocore.session.Session()
+        # A role é a única fonte de credenciais da sessão (sem as do ambiente da Lambda)
+        core.register_component('credential_provider', CredentialResolver([AssumeRoleProvider()]))
+        session = boto3.session.Session(botocore_session=core, region_name=base.region_name)
+        metrics.instrument_session(session)
+        limitador.install(session, account=role_arn.split(':')[4])
+        return session
+
+    return _get_or_create(('session', role_arn, external_id), factory)
+
+
+def _get_or_create(key, factory):
+    obj = _clients.get(key)
+    if obj is None:
+        with _lock:
+            obj = _clients.get(key)
+            if obj is None:
+                obj = factory()
+                _clients[key] = obj
+    return obj
+
+
+def get_client(service_name, region_name=None, role_arn=None, external_id=None, timeout=None):
+    """
+    Retorna o cliente (thread-safe) do serviço, criando-o no primeiro uso. Por padrão na
+    região e conta da própria Lambda; 'region_name'/'role_arn' escolhem outro alvo.
+    'timeout' limita os timeouts de conexão e leitura do cliente (ver client_config).
+    """
+    def factory():
+        session = get_role_session(role_arn, external_id) if role_arn else get_session()
+        return session.client(service_name, region_name=region_name, config=client_config(service_name, timeout))
+
+    return _get_or_create(('client', service_name, region_name, role_arn, external_id, timeout), factory)
+
+
+def get_resource(service_name):
+    """Retorna o resource do serviço, criando-o no primeiro uso."""
+    return _get_or_create(
+        ('resource', service_name),
+        lambda: get_session().resource(service_name, config=client_config(service_name))
+    )
+
+
+def get_table(table_name):
+    """Retorna o Table do DynamoDB, criando-o no primeiro uso."""
+    return _get_or_create(('table', table_name), lambda: get_resource('dynamodb').Table(table_name))
+
+
+def use_session(session):
+    """Substitui a sessão compartilhada (benchmarks e execução local com backends falsos)."""
+    global _session
+    with _lock:
+        _session = session
+        _clients.clear()
+
+
+def reset():
+    """Descarta sessão e clientes (usado pelos benchmarks para simular um cold start)."""
+    global _session
+    with _lock:
+        _session = None
+        _clients.clear()
+
+
+class LazyAWS:
+    """
+    Referência de módulo para um cliente/Table que só é construído no primeiro acesso.
+    Ex: ec2 = LazyAWS(get_client, 'ec2'); ec2.start_instances(...)
+    """
+
+    def __init__(self, factory, *args):
+        self._factory = factory
+        self._args = args
+
+    def __getattr__(self, name):
+        return getattr(self._factory(*self._args), name)
@@ -0,0 +1,145 @@
+"""
+Histórico de execuções dos agendamentos, fora da tabela "quente" do DynamoDB.
+
+Cada execução finalizada pelo ExecutaAgendamentosEC2 vira uma linha JSON em um arquivo
+JSONL comprimido com gzip, somente de inclusão (nada é reescrito). As instâncias são
+distribuídas por hash em HISTORY_SHARDS partes, e cada lote grava um objeto por parte e dia
+(UTC) das execuções, então um tick com milhares de instâncias grava no máximo HISTORY_SHARDS
+objetos por dia. As partições ficam em
+
+    <prefixo>/parte=<NN>/dia=<AAAA-MM-DD>/<hora>-<uuid>.jsonl.gz
+
+de modo que o comando 'historico <instancia>' lista apenas a parte da instância a partir do
+primeiro dia pedido (StartAfter) e filtra as linhas da instância.
+
+HISTORY_SHARDS não deve mudar depois que houver histórico gravado: as instâncias mudariam de
+parte e as execuções anteriores deixariam de aparecer no comando.
+
+Dois backends com a mesma interface:
+- S3HistoryStore:    bucket S3 (HISTORY_BUCKET / HISTORY_PREFIX)
+- LocalHistoryStore: diretório local (testes e execução local)
+"""
+import gzip
+import json
+import os
+import uuid
+import zlib
+from datetime import datetime
+
+from comum.aws import get_client
+
+HISTORY_BUCKET = os.environ.get('HISTORY_BUCKET', '')
+HISTORY_PREFIX = os.environ.get('HISTORY_PREFIX', 'historico')
+# Diretório do backend local (usado quando HISTORY_BUCKET não está definido)
+HISTORY_DIR = os.environ.get('HISTORY_DIR', '')
+# Partes em que as instâncias são distribuídas (máximo de objetos por dia em cada lote)
+HISTORY_SHARDS = int(os.environ.get('HISTORY_SHARDS', '16'))
+
+# Atributos de cada agendamento copiados para o histórico
+RECORD_FIELDS = ('id', 'instancia', 'acao', 'horario', 'solicitante', 'recorrencia')
+
+
+def build_record(ag, status, executed_at):
+    """Linha compacta do histórico para uma execução."""
+    record = {k: ag[k] for k in RECORD_FIELDS if ag.get(k) is not None}
+    record['status'] = status
+    record['executado_em'] = executed_at.isoformat()
+    return record
+
+
+def _encode(records):
+    lines = "".join(json.dumps(r, ensure_ascii=False, separators=(',', ':'), default=str) + "\n" for r in records)
+    return gzip.compress(lines.encode('utf-8'))
+
+
+def _decode(data):
+    return [json.loads(line) for line in gzip.decompress(data).decode('utf-8').splitlines() if line]
+
+
+def shard_of(instance_id):
+    """Parte da instância (hash estável, o mesmo em todas as execuções)."""
+    return f"{zlib.crc32(instance_id.encode('utf-8')) % HISTORY_SHARDS:02d}"
+
+
+def group_records(records):
+    """Agrupa as linhas por parte e dia (UTC) da execução: {(parte, dia): [linhas]}, um objeto por grupo."""
+    groups = {}
+    for record in records:
+        day = datetime.fromisoformat(record['executado_em']).date().isoformat()
+        groups.setdefault((shard_of(record['instancia']), day), []).append(record)
+    return groups
+
+
+def _partition(shard, day):
+    return f"parte={shard}/dia={day}"
+
+
+def _object_name(executed_at):
+    return f"{executed_at.strftime('%H%M%S')}-{uuid.uuid4().hex[:12]}.jsonl.gz"
+
+
+class S3HistoryStore:
+    """Histórico em um bucket S3, um objeto por parte, dia e lote de execuções."""
+
+    def __init__(self, bucket, prefix=HISTORY_PREFIX):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+
+    def append(self, shard, day, records):
+        """Grava as linhas de uma parte e dia (ver group_records) em um objeto novo."""
+        executed_at = datetime.fromisoformat(records[0]['executado_em'])
+        key = f"{self.prefix}/{_partition(shard, day)}/{_object_name(executed_at)}"
+        get_client('s3').put_object(
+            Bucket=self.bucket, Key=key, Body=_encode(records),
+            ContentType='application/gzip'
+        )
+
+    def read(self, instance_id, since_day):
+        """Execuções da instância a partir de 'since_day' (AAAA-MM-DD), em ordem cronológica."""
+        s3 = get_client('s3')
+        prefix = f"{self.prefix}/parte={shard_of(instance_id)}/"
+        records = []
+        for page in s3.get_paginator('list_objects_v2').paginate(
+                Bucket=self.bucket, Prefix=prefix, StartAfter=f"{prefix}dia={since_day}"):
+            for obj in page.get('Contents', []):
+                records.extend(
+                    r for r in _decode(s3.get_object(Bucket=self.bucket, Key=obj['Key'])['Body'].read())
+                    if r.get('instancia') == instance_id
+                )
+        return sorted(records, key=lambda r: r['executado_em'])
+
+
+class LocalHistoryStore:
+    """Histórico em um diretório local, com o mesmo layout de partições do S3."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def append(self, shard, day, records):
+        executed_at = datetime.fromisoformat(records[0]['executado_em'])
+        partition = os.path.join(self.directory, _partition(shard, day))
+        os.makedirs(partition, exist_ok=True)
+        with open(os.path.join(partition, _object_name(executed_at)), 'wb') as f:
+            f.write(_encode(records))
+
+    def read(self, instance_id, since_day):
+        directory = os.path.join(self.directory, f"parte={shard_of(instance_id)}")
+        if not os.path.isdir(directory):
+            return []
+        records = []
+        for day_dir in sorted(os.listdir(directory)):
+            if day_dir < f"dia={since_day}":
+                continue
+            for name in sorted(os.listdir(os.path.join(directory, day_dir))):
+                with open(os.path.join(directory, day_dir, name), 'rb') as f:
+                    records.extend(r for r in _decode(f.read()) if r.get('instancia') == instance_id)
+        return sorted(records, key=lambda r: r['executado_em'])
+
+
+def store_from_env():
+    """Backend configurado pelas variáveis de ambiente, ou None se o histórico estiver desligado."""
+    if HISTORY_BUCKET:
+        return S3HistoryStore(HISTORY_BUCKET, HISTORY_PREFIX)
+    if HISTORY_DIR:
+        return LocalHistoryStore(HISTORY_DIR)
+    return None
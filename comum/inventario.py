@@ -0,0 +1,246 @@
+"""
+Tabela de inventário das instâncias EC2, mantida pelos eventos da própria EC2.
+
+O AtualizaInventarioEC2 consome do EventBridge as mudanças de estado ("EC2 Instance
+State-change Notification") e de tags ("Tag Change on Resource") e grava, por instância,
+um item na tabela INVENTORY_TABLE_NAME (chave de partição 'id'):
+
+    id           ID da instância
+    alvo         alvo (comum/alvos.py) da região/conta do evento; regiao e conta
+    estado       último estado recebido; estado_em = horário do evento
+    launch_time  horário do último 'pending' (o LaunchTime da EC2 muda a cada start)
+    tags         todas as tags (mapa); tags_versao = versão do evento de tags, tags_em = horário dele
+    nome         tag 'Name' (ou o ID); nome_busca = nome em minúsculas (índice INVENTORY_NAME_INDEX)
+    ultima_acao  tag 'LastActionBy' (quem fez a última ação pelo bot)
+    tipo         tipo da instância
+    expira_em    TTL das instâncias encerradas (INVENTORY_TERMINATED_TTL_HOURS)
+
+Eventos fora de ordem não sobrescrevem dados mais novos: o estado só é gravado se o
+evento for mais recente que 'estado_em', e as tags só se a versão for maior que
+'tags_versao'. O que os eventos não trazem (tipo, tags ou estado de uma instância ainda
+desconhecida) é completado com um describe_instances da própria instância. A sincronização
+completa (sync) também não sobrescreve uma instância alterada por um evento depois do seu
+início, e mantém a 'tags_versao' já gravada.
+
+O GoogleChatEC2Bot lê o estado das instâncias desta tabela (GetItem pelo ID, Query no
+índice de nomes ou Scan do inventário completo) e só consulta a EC2 quando a instância
+não está nela.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from comum.aws import get_resource, get_table
+
+INVENTORY_TABLE_NAME = os.environ.get('INVENTORY_TABLE_NAME', '')
+# Índice (GSI) da tabela de inventário por nome em minúsculas (nome_busca)
+INVENTORY_NAME_INDEX = os.environ.get('INVENTORY_NAME_INDEX', 'nome-index')
+# Tempo que uma instância encerrada ('terminated') continua na tabela
+INVENTORY_TERMINATED_TTL_HOURS = int(os.environ.get('INVENTORY_TERMINATED_TTL_HOURS', '24'))
+# Threads usadas para gravar as instâncias na sincronização completa (um UpdateItem condicional cada)
+INVENTORY_SYNC_WORKERS = int(os.environ.get('INVENTORY_SYNC_WORKERS', '16'))
+
+# Atributos que nem toda instância tem: a sincronização os remove quando o describe não os traz
+OPTIONAL_ATTRIBUTES = ('conta', 'launch_time', 'tipo', 'ultima_acao', 'expira_em')
+
+
+def _iso(moment):
+    """UTC em ISO 8601 com segundos: o mesmo formato em todos os itens, comparável como texto."""
+    return moment.astimezone(timezone.utc).isoformat(timespec='seconds')
+
+
+def _tag_attributes(instance_id, tags):
+    """Atributos derivados das tags: tags, nome, nome_busca e ultima_acao (se houver a tag)."""
+    name = tags.get('Name') or instance_id
+    attributes = {'tags': tags, 'nome': name, 'nome_busca': name.lower()}
+    if tags.get('LastActionBy'):
+        attributes['ultima_acao'] = tags['LastActionBy']
+    return attributes
+
+
+def item_to_instance(item):
+    """Item da tabela no formato do inventário do bot (os campos de describe_instances usados por ele)."""
+    instance = {
+        'InstanceId': item['id'],
+        'State': {'Name': item['estado']},
+        'Tags': [{'Key': k, 'Value': v} for k, v in (item.get('tags') or {}).items()],
+        'Alvo': item.get('alvo'),
+    }
+    if item.get('launch_time'):
+        instance['LaunchTime'] = datetime.fromisoformat(item['launch_time'])
+    if item.get('tipo'):
+        instance['InstanceType'] = item['tipo']
+    return instance
+
+
+def instance_to_item(inst, target, account=None, now=None):
+    """Item completo a partir de uma instância do describe_instances (sincronização e instâncias novas)."""
+    now = now or datetime.now(timezone.utc)
+    tags = {tag['Key']: tag['Value'] for tag in inst.get('Tags', [])}
+    item = {
+        'id': inst['InstanceId'],
+        'alvo': target.id,
+        'regiao': target.region,
+        'estado': inst['State']['Name'],
+        'estado_em': _iso(now),
+        'tags_versao': 0,
+        'tags_em': _iso(now),
+        **_tag_attributes(inst['InstanceId'], tags),
+    }
+    if account:
+        item['conta'] = account
+    if inst.get('LaunchTime'):
+        item['launch_time'] = _iso(inst['LaunchTime'])
+    if inst.get('InstanceType'):
+        item['tipo'] = inst['InstanceType']
+    if item['estado'] == 'terminated':
+        item['expira_em'] = int((now + timedelta(hours=INVENTORY_TERMINATED_TTL_HOURS)).timestamp())
+    return item
+
+
+class InventoryStore:
+    """Leitura e gravação da tabela de inventário."""
+
+    def __init__(self, table_name=INVENTORY_TABLE_NAME, name_index=INVENTORY_NAME_INDEX):
+        self.table_name = table_name
+        self.name_index = name_index
+
+    def _update(self, instance_id, attributes, condition, condition_values, remove=()):
+        """SET dos atributos (e REMOVE), condicional; retorna o item gravado ou None se o evento estiver atrasado."""
+        table = get_table(self.table_name)
+        names = {f"#{k}": k for k in attributes}
+        values = {f":{k}": v for k, v in attributes.items()}
+        expression = "SET " + ", ".join(f"#{k} = :{k}" for k in attributes)
+        if remove:
+            expression += " REMOVE " + ", ".join(remove)
+        try:
+            res = table.update_item(
+                Key={'id': instance_id},
+                UpdateExpression=expression,
+                ConditionExpression=condition,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues={**values, **condition_values},
+                ReturnValues='ALL_NEW'
+            )
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            return None
+        return res['Attributes']
+
+    def apply_state(self, instance_id, state, when, location):
+        """
+        Grava o estado de um evento de mudança de estado ('when' = horário do evento, 'location'
+        com alvo/regiao/conta). Retorna o item atualizado, ou None se já havia um estado mais novo.
+        """
+        attributes = {**location, 'estado': state, 'estado_em': _iso(when)}
+        remove = ()
+        if state == 'pending':
+            attributes['launch_time'] = _iso(when)
+        if state == 'terminated':
+            attributes['expira_em'] = int((when + timedelta(hours=INVENTORY_TERMINATED_TTL_HOURS)).timestamp())
+        else:
+            remove = ('expira_em',)
+        return self._update(
+            instance_id, attributes,
+            "attribute_not_exists(estado_em) OR estado_em <= :quando", {':quando': _iso(when)},
+            remove
+        )
+
+    def apply_tags(self, instance_id, tags, version, when, location):
+        """
+        Grava as tags de um evento de mudança de tags (todas as tags atuais, não só as
+        alteradas; 'when' = horário do evento). Retorna o item atualizado, ou None se já
+        havia uma versão mais nova.
+        """
+        attributes = {**location, **_tag_attributes(instance_id, tags), 'tags_versao': version, 'tags_em': _iso(when)}
+        return self._update(
+            instance_id, attributes,
+            "attribute_not_exists(tags_versao) OR tags_versao < :versao", {':versao': version},
+            () if 'ultima_acao' in attributes else ('ultima_acao',)
+        )
+
+    def fill_missing(self, item):
+        """Completa só os atributos ausentes na tabela (if_not_exists), sem sobrescrever os dos eventos."""
+        table = get_table(self.table_name)
+        attributes = {k: v for k, v in item.items() if k != 'id'}
+        table.update_item(
+            Key={'id': item['id']},
+            UpdateExpression="SET " + ", ".join(f"#{k} = if_not_exists(#{k}, :{k})" for k in attributes),
+            ExpressionAttributeNames={f"#{k}": k for k in attributes},
+            ExpressionAttributeValues={f":{k}": v for k, v in attributes.items()}
+        )
+
+    def sync(self, items, started_at):
+        """
+        Grava os itens de uma sincronização completa cujo describe_instances começou em
+        'started_at': um UpdateItem condicional por instância, em paralelo, com o cliente de
+        baixo nível (compartilhável entre threads). Uma instância cujo estado ou tags vieram de
+        um evento posterior a 'started_at' é mantida, pois o describe pode ser mais antigo que
+        ele; e a 'tags_versao' já gravada é preservada, para que um evento de tags atrasado
+        continue perdendo para um mais novo. Retorna quantas instâncias foram mantidas.
+        """
+        client = get_resource('dynamodb').meta.client
+        since = _iso(started_at)
+
+        def write(item):
+            attributes = {k: v for k, v in item.items() if k not in ('id', 'tags_versao')}
+            remove = [k for k in OPTIONAL_ATTRIBUTES if k not in item]
+            expression = "SET " + ", ".join(f"#{k} = :{k}" for k in attributes)
+            expression += ", #tags_versao = if_not_exists(#tags_versao, :tags_versao)"
+            if remove:
+                expression += " REMOVE " + ", ".join(f"#{k}" for k in remove)
+            try:
+                client.update_item(
+                    TableName=self.table_name,
+                    Key={'id': item['id']},
+                    UpdateExpression=expression,
+                    ConditionExpression="(attribute_not_exists(#estado_em) OR #estado_em < :inicio) AND "
+                                        "(attribute_not_exists(#tags_em) OR #tags_em < :inicio)",
+                    ExpressionAttributeNames={f"#{k}": k for k in [*attributes, 'tags_versao', *remove]},
+                    ExpressionAttributeValues={
+                        **{f":{k}": v for k, v in attributes.items()},
+                        ':tags_versao': item.get('tags_versao', 0),
+                        ':inicio': since,
+                    }
+                )
+                return False
+            except client.exceptions.ConditionalCheckFailedException:
+                return True
+
+        if not items:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(INVENTORY_SYNC_WORKERS, len(items))) as pool:
+            return sum(pool.map(write, items))
+
+    def get(self, instance_id):
+        """Instância pelo ID (GetItem), ou None se ausente."""
+        item = get_table(self.table_name).get_item(Key={'id': instance_id}).get('Item')
+        return item_to_instance(item) if item and item.get('estado') else None
+
+    def find_by_name(self, name):
+        """Instâncias com o nome (sem diferenciar maiúsculas), por Query no índice de nomes."""
+        from boto3.dynamodb.conditions import Key
+
+        res = get_table(self.table_name).query(
+            IndexName=self.name_index,
+            KeyConditionExpression=Key('nome_busca').eq(name.lower())
+        )
+        return [item_to_instance(item) for item in res.get('Items', []) if item.get('estado')]
+
+    def scan(self):
+        """Todas as instâncias da tabela (Scan paginado)."""
+        table = get_table(self.table_name)
+        kwargs = {}
+        instances = []
+        while True:
+            page = table.scan(**kwargs)
+            instances.extend(item_to_instance(item) for item in page.get('Items', []) if item.get('estado'))
+            if 'LastEvaluatedKey' not in page:
+                return instances
+            kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+
+def store_from_env():
+    """Backend configurado pelas variáveis de ambiente, ou None se a tabela de inventário estiver desligada."""
+    if INVENTORY_TABLE_NAME:
+        return InventoryStore(INVENTORY_TABLE_NAME, INVENTORY_NAME_INDEX)
+    return None
@@ -0,0 +1,221 @@
+"""
+Limitador de taxa compartilhado para as chamadas à API da EC2.
+
+Em janelas com muitos agendamentos, ou quando vários usuários abrem o 'menu' ao mesmo
+tempo, Lambdas concorrentes estouram o limite da conta (RequestLimitExceeded). Antes de
+cada chamada à EC2, o processo retira um token de um balde compartilhado por todas as
+instâncias das duas funções; sem token, espera (com jitter) até o balde reabastecer.
+
+O balde é implementado como GCRA: um único número, 'tat' (theoretical arrival time, em ms),
+guardado em um item do DynamoDB e avançado com um UpdateItem condicional atômico, sem
+leitura prévia nem transações. Um balde com 'tat' no passado está cheio; cada token
+adianta 'tat' em 1000/taxa ms e o balde está vazio quando 'tat' passa de agora + capacidade.
+
+Chamadas de leitura (Describe*) só podem usar EC2_DESCRIBE_SHARE da capacidade; o restante
+fica reservado para start/stop/create_tags, que assim têm prioridade quando o balde esvazia.
+
+O limite da EC2 vale por conta e região: chamadas a outra região ou, com role assumida,
+a outra conta (comum/alvos.py) usam um balde próprio, 'limite#ec2#<conta>#<região>' (com
+'propria' no lugar da conta para outras regiões da conta da Lambda).
+
+Dois backends com a mesma interface:
+- DynamoDBBucketState: item 'limite#ec2' na tabela de agendamentos (RATE_LIMIT_TABLE_NAME)
+- LocalBucketState:    em memória (testes e execução local)
+
+Variáveis de ambiente:
+- EC2_RATE_LIMIT               tokens por segundo compartilhados (padrão 20; 0 desliga o limitador)
+- EC2_RATE_BURST               capacidade do balde (padrão 40)
+- EC2_DESCRIBE_SHARE           fração da capacidade disponível para Describe* (padrão 0.7)
+- RATE_LIMIT_MAX_WAIT_SECONDS  espera máxima por token antes de seguir sem ele (padrão 5)
+- RATE_LIMIT_BACKEND           dynamodb ou local (padrão dynamodb)
+- RATE_LIMIT_TABLE_NAME        tabela do balde (padrão DYNAMODB_TABLE_NAME)
+"""
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger()
+
+EC2_RATE_LIMIT = float(os.environ.get('EC2_RATE_LIMIT', '20'))
+EC2_RATE_BURST = float(os.environ.get('EC2_RATE_BURST', '40'))
+EC2_DESCRIBE_SHARE = float(os.environ.get('EC2_DESCRIBE_SHARE', '0.7'))
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.environ.get('RATE_LIMIT_MAX_WAIT_SECONDS', '5'))
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'dynamodb')
+RATE_LIMIT_TABLE_NAME = os.environ.get('RATE_LIMIT_TABLE_NAME') or os.environ.get('DYNAMODB_TABLE_NAME', 'EC2InstanceSchedules')
+
+BUCKET_ID = 'limite#ec2'
+
+# Códigos de erro da AWS que indicam limitação de taxa
+THROTTLE_CODES = {
+    'RequestLimitExceeded', 'Throttling', 'ThrottlingException', 'ThrottledException',
+    'TooManyRequestsException', 'ProvisionedThroughputExceededException',
+    'RequestThrottled', 'RequestThrottledException', 'SlowDown',
+}
+
+# Prefixos das operações de leitura (as demais são tratadas como mutações)
+READ_PREFIXES = ('Describe', 'Get', 'List')
+
+
+def is_throttle_error(error):
+    """Indica se a exceção (ClientError) é uma limitação de taxa da AWS."""
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in THROTTLE_CODES
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+class LocalBucketState:
+    """Estado do balde em memória, compartilhado apenas pelas threads do processo."""
+
+    def __init__(self):
+        self.tat = 0
+        self._lock = threading.Lock()
+
+    def take(self, cost_ms, now_ms, limit_ms):
+        """Consome 'cost_ms' se o balde permitir; retorna 0 ou quantos ms esperar."""
+        with self._lock:
+            new_tat = max(self.tat, now_ms) + cost_ms
+            if new_tat > limit_ms:
+                return new_tat - limit_ms
+            self.tat = new_tat
+            return 0
+
+
+class DynamoDBBucketState:
+    """Estado do balde em um item do DynamoDB, compartilhado por todas as Lambdas."""
+
+    # Tentativas de avançar 'tat' antes de desistir por disputa com outros processos
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, table_name=RATE_LIMIT_TABLE_NAME, bucket_id=BUCKET_ID):
+        self.table_name = table_name
+        self.bucket_id = bucket_id
+
+    def _update(self, table, update, condition, values):
+        """UpdateItem condicional; retorna None se aplicado ou o 'tat' atual (-1 se ausente) se a condição falhou."""
+        try:
+            table.update_item(
+                Key={'id': self.bucket_id},
+                UpdateExpression=update,
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values,
+                ReturnValuesOnConditionCheckFailure='ALL_OLD'
+            )
+            return None
+        except table.meta.client.exceptions.ConditionalCheckFailedException as e:
+            # O resource não desserializa o item devolvido junto com o erro
+            old = (e.response.get('Item') or {}).get('tat')
+            return int(old['N']) if old else -1
+
+    def take(self, cost_ms, now_ms, limit_ms):
+        """Consome 'cost_ms' se o balde permitir; retorna 0 ou quantos ms esperar."""
+        from comum.aws import get_table
+
+        table = get_table(self.table_name)
+        for _ in range(self.MAX_ATTEMPTS):
+            # Balde em uso ('tat' no futuro) e com tokens suficientes
+            tat = self._update(
+                table, "SET tat = tat + :custo", "tat BETWEEN :agora AND :maximo",
+                {':custo': cost_ms, ':agora': now_ms, ':maximo': limit_ms - cost_ms}
+            )
+            if tat is None:
+                return 0
+            if tat >= now_ms:
+                return tat + cost_ms - limit_ms
+            # Balde cheio ('tat' no passado ou item inexistente): recomeça a partir de agora
+            tat = self._update(
+                table, "SET tat = :novo", "attribute_not_exists(tat) OR tat < :agora",
+                {':novo': now_ms + cost_ms, ':agora': now_ms}
+            )
+            if tat is None:
+                return 0
+        # Outro processo avançou 'tat' entre as duas escritas em todas as tentativas
+        return int(1000 / EC2_RATE_LIMIT)
+
+
+class RateLimiter:
+    """Token bucket (GCRA) com reserva de capacidade para as mutações."""
+
+    def __init__(self, state, rate=EC2_RATE_LIMIT, burst=EC2_RATE_BURST,
+                 describe_share=EC2_DESCRIBE_SHARE, max_wait_seconds=RATE_LIMIT_MAX_WAIT_SECONDS):
+        self.state = state
+        self.interval_ms = 1000 / rate
+        self.burst_ms = burst * self.interval_ms
+        self.describe_share = describe_share
+        self.max_wait_seconds = max_wait_seconds
+
+    def acquire(self, mutating=True, tokens=1):
+        """
+        Espera até haver 'tokens' no balde e os consome. Retorna o tempo esperado (s).
+        Se a espera passar de max_wait_seconds, segue sem o token: as retentativas
+        adaptativas do botocore tratam um eventual RequestLimitExceeded.
+        """
+        waited = 0.0
+        # Nunca menos que um token, para que o intervalo da condição no DynamoDB seja válido
+        capacity = max(self.burst_ms * (1 if mutating else self.describe_share), tokens * self.interval_ms)
+        while True:
+            now_ms = _now_ms()
+            wait_ms = self.state.take(max(1, int(tokens * self.interval_ms)), now_ms, now_ms + int(capacity))
+            if wait_ms <= 0:
+                return waited
+            # Jitter para que processos que esperam o mesmo token não acordem juntos
+            wait = wait_ms / 1000 * random.uniform(1.0, 1.5)
+            if waited + wait > self.max_wait_seconds:
+                logger.warning(f"Limitador de taxa: token não obtido em {self.max_wait_seconds}s, seguindo sem ele")
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+
+def limiter_from_env(bucket_id=BUCKET_ID):
+    """Limitador configurado pelas variáveis de ambiente, ou None se estiver desligado."""
+    if EC2_RATE_LIMIT <= 0:
+        return None
+    state = LocalBucketState() if RATE_LIMIT_BACKEND == 'local' else DynamoDBBucketState(bucket_id=bucket_id)
+    return RateLimiter(state)
+
+
+def install(session, limiter=None, service='ec2', account=None):
+    """
+    Registra o limitador na sessão boto3: toda chamada ao serviço retira um token antes
+    de ser enviada. 'limiter' vale para a conta e a região padrão da sessão; clientes de
+    outra região, ou de outra conta ('account'), recebem limitadores próprios sob demanda.
+    Falhas do backend do limitador não bloqueiam a chamada.
+    """
+    if limiter is None and EC2_RATE_LIMIT <= 0:
+        return None
+    # Sessão de outra conta: nenhuma região usa o balde padrão
+    default = None if account else (limiter or limiter_from_env())
+    limiters = {}
+    lock = threading.Lock()
+
+    def limiter_for(region):
+        if default is not None and region in (None, session.region_name):
+            return default
+        with lock:
+            if region not in limiters:
+                limiters[region] = limiter_from_env(f"{BUCKET_ID}#{account or 'propria'}#{region}")
+            return limiters[region]
+
+    def _before_call(model, request_signer=None, **kwargs):
+        from comum import metrics
+
+        try:
+            region = request_signer.region_name if request_signer is not None else None
+            current = limiter_for(region)
+            if current is None:
+                return
+            waited = current.acquire(mutating=not model.name.startswith(READ_PREFIXES))
+        except Exception as e:
+            logger.warning(f"Limitador de taxa indisponível, seguindo sem ele: {e}")
+            return
+        if waited:
+            metrics.add_value('EsperaLimitador', round(waited, 3), 'Seconds')
+
+    # Primeiro da fila: a espera pelo token não entra na duração medida da chamada
+    session.events.register_first(f'before-call.{service}', _before_call, unique_id=f'limitador-{service}')
+    return default
@@ -0,0 +1,227 @@
+"""
+Métricas de latência por invocação no formato CloudWatch Embedded Metric Format (EMF).
+
+Cada invocação abre um coletor com start_invocation(), mede fases com
+`with phase('nome'):` e emite ao final uma única linha JSON (emit()) que o CloudWatch
+Logs transforma em métricas. As chamadas à AWS são contadas e cronometradas
+automaticamente por hooks registrados na sessão compartilhada (ver comum/aws.py), assim
+como as respostas de limitação de taxa (RequestLimitExceeded, Throttling...) que o botocore
+retentou.
+
+Variáveis de ambiente:
+- METRICS_NAMESPACE       namespace das métricas (padrão EC2ChatOps)
+- METRICS_ENABLED         'false' desliga a emissão (padrão true)
+- EVENT_LOG_SAMPLE_RATE   fração dos eventos cujo payload é logado, já mascarado (padrão 0.01)
+"""
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from comum.limitador import THROTTLE_CODES
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'EC2ChatOps')
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+EVENT_LOG_SAMPLE_RATE = float(os.environ.get('EVENT_LOG_SAMPLE_RATE', '0.01'))
+
+# Máximo de valores por métrica em um registro EMF (limite do CloudWatch)
+EMF_MAX_VALUES = 100
+
+# Chaves cujo valor nunca é logado
+REDACTED_KEYS = {'email', 'displayName', 'avatarUrl', 'token', 'authorization', 'Authorization', 'text', 'argumentText'}
+
+
+def summarize_values(values, limit=EMF_MAX_VALUES):
+    """
+    Reduz uma lista longa a 'limit' quantis igualmente espaçados (inclusive o mínimo e o
+    máximo), para caber no limite do EMF sem distorcer o máximo e os percentis da métrica.
+    """
+    if len(values) <= limit:
+        return values
+    ordered = sorted(values)
+    return [ordered[round(i * (len(ordered) - 1) / (limit - 1))] for i in range(limit)]
+
+
+class InvocationMetrics:
+    """Acumula fases, chamadas à AWS e valores avulsos de uma invocação."""
+
+    def __init__(self, function_name, dimensions=None):
+        self.function_name = function_name
+        self.dimensions = {'Funcao': function_name, **(dimensions or {})}
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.api_calls = {}
+        self.throttles = {}
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def add_phase(self, name, ms):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + ms
+
+    def add_api_call(self, operation, ms):
+        with self.lock:
+            count, total = self.api_calls.get(operation, (0, 0.0))
+            self.api_calls[operation] = (count + 1, total + ms)
+
+    def add_throttle(self, operation):
+        with self.lock:
+            self.throttles[operation] = self.throttles.get(operation, 0) + 1
+
+    def add_value(self, name, value, unit='Count'):
+        """
+        Registra um valor avulso; valores repetidos viram uma lista (ex: tamanho de cada lote),
+        resumida a EMF_MAX_VALUES quantis na emissão (ver summarize_values).
+        """
+        with self.lock:
+            values, _ = self.values.get(name, ([], unit))
+            values.append(value)
+            self.values[name] = (values, unit)
+
+    def to_emf(self):
+        record = dict(self.dimensions)
+        metrics = [{'Name': 'DuracaoTotal', 'Unit': 'Milliseconds'}]
+        record['DuracaoTotal'] = round((time.perf_counter() - self.started) * 1000, 2)
+        for name, ms in self.phases.items():
+            key = f"Fase.{name}"
+            metrics.append({'Name': key, 'Unit': 'Milliseconds'})
+            record[key] = round(ms, 2)
+        for operation, (count, total) in self.api_calls.items():
+            metrics.append({'Name': f"AWS.{operation}.Chamadas", 'Unit': 'Count'})
+            metrics.append({'Name': f"AWS.{operation}.Duracao", 'Unit': 'Milliseconds'})
+            record[f"AWS.{operation}.Chamadas"] = count
+            record[f"AWS.{operation}.Duracao"] = round(total, 2)
+        record['AWS.Chamadas'] = sum(count for count, _ in self.api_calls.values())
+        metrics.append({'Name': 'AWS.Chamadas', 'Unit': 'Count'})
+        for operation, count in self.throttles.items():
+            metrics.append({'Name': f"AWS.{operation}.Limitacoes", 'Unit': 'Count'})
+            record[f"AWS.{operation}.Limitacoes"] = count
+        record['AWS.Limitacoes'] = sum(self.throttles.values())
+        metrics.append({'Name': 'AWS.Limitacoes', 'Unit': 'Count'})
+        for name, (values, unit) in self.values.items():
+            metrics.append({'Name': name, 'Unit': unit})
+            record[name] = values[0] if len(values) == 1 else summarize_values(values)
+            if len(values) > EMF_MAX_VALUES:
+                # A contagem de amostras do CloudWatch passa a ser a dos quantis: a real vai à parte
+                metrics.append({'Name': f"{name}.Quantidade", 'Unit': 'Count'})
+                record[f"{name}.Quantidade"] = len(values)
+        record['_aws'] = {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [sorted(self.dimensions)],
+                'Metrics': metrics,
+            }]
+        }
+        return record
+
+
+_current = None
+
+
+def start_invocation(function_name, **dimensions):
+    """Abre o coletor da invocação atual (substitui o anterior)."""
+    global _current
+    _current = InvocationMetrics(function_name, dimensions)
+    return _current
+
+
+def current():
+    return _current
+
+
+def set_dimension(name, value):
+    if _current is not None:
+        _current.dimensions[name] = value
+
+
+def add_value(name, value, unit='Count'):
+    if _current is not None:
+        _current.add_value(name, value, unit)
+
+
+@contextmanager
+def phase(name):
+    """Mede a duração de um trecho da invocação (durações repetidas são somadas)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _current is not None:
+            _current.add_phase(name, (time.perf_counter() - started) * 1000)
+
+
+def emit():
+    """Escreve a linha EMF da invocação atual na saída padrão."""
+    if _current is not None and METRICS_ENABLED:
+        print(json.dumps(_current.to_emf(), separators=(',', ':'), default=str))
+
+
+def _before_call(model, context, **kwargs):
+    context['metrics_started'] = time.perf_counter()
+    context['metrics_operation'] = f"{model.service_model.service_id.hyphenize()}.{model.name}"
+
+
+def _after_call(context, **kwargs):
+    # Também registrado em 'after-call-error' (erro de conexão/timeout), que recebe só
+    # 'exception' e 'context': a operação vem do contexto gravado em _before_call
+    started = context.get('metrics_started')
+    if _current is not None and started is not None:
+        _current.add_api_call(context['metrics_operation'], (time.perf_counter() - started) * 1000)
+
+
+def _needs_retry(response, operation, **kwargs):
+    # Chamado a cada tentativa; 'response' é (http, resposta parseada) ou None em erro de conexão
+    if _current is None or response is None:
+        return None
+    if response[1].get('Error', {}).get('Code') in THROTTLE_CODES:
+        _current.add_throttle(f"{operation.service_model.service_id.hyphenize()}.{operation.name}")
+    return None
+
+
+def instrument_session(session):
+    """Registra os hooks de contagem/tempo das chamadas e de limitações na sessão boto3."""
+    session.events.register('before-call', _before_call)
+    session.events.register('after-call', _after_call)
+    session.events.register('after-call-error', _after_call)
+    session.events.register('needs-retry', _needs_retry)
+
+
+def instrumented(function_name):
+    """Decorador do handler: abre o coletor da invocação e emite as métricas ao final."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            start_invocation(function_name)
+            try:
+                return handler(event, context)
+            finally:
+                emit()
+        return wrapper
+    return decorator
+
+
+def _redact(value):
+    if isinstance(value, dict):
+        return {k: ('***' if k in REDACTED_KEYS else _redact(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact(v) for v in value]
+    return value
+
+
+def log_event_sample(logger, event):
+    """Loga uma amostra (EVENT_LOG_SAMPLE_RATE) dos eventos, com dados pessoais mascarados."""
+    if random.random() >= EVENT_LOG_SAMPLE_RATE:
+        return
+    sample = dict(event)
+    if isinstance(sample.get('body'), str):
+        try:
+            sample['body'] = json.loads(sample['body'])
+        except ValueError:
+            sample['body'] = '***'
+    sample.pop('headers', None)
+    sample.pop('multiValueHeaders', None)
+    logger.info(f"Evento recebido (amostra): {json.dumps(_redact(sample), default=str)}")
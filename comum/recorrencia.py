@@ -0,0 +1,152 @@
+"""
+Agendamentos recorrentes no formato cron (minuto hora dia mês dia-da-semana).
+
+Cada agendamento recorrente é uma única linha no DynamoDB com a expressão cron normalizada
+em 'recorrencia' e a próxima ocorrência já calculada em 'horario' (a chave de ordenação do
+índice de pendentes). O executor apenas avança 'horario' com next_occurrence() após cada
+execução, então a busca por agendamentos vencidos continua sendo uma leitura por intervalo
+no índice, sem expandir as regras a cada tick.
+
+As expressões são interpretadas no fuso local do bot (UTC-3). No campo de dia da semana
+são aceitos 0-7 (0 e 7 = domingo) e as abreviações dom, seg, ter, qua, qui, sex, sab.
+"""
+import re
+from datetime import datetime, time, timedelta, timezone
+
+# Fuso em que os horários digitados no chat são interpretados (mesmo do comando 'agendar')
+LOCAL_TZ = timezone(timedelta(hours=-3))
+
+WEEKDAY_NAMES = {'dom': 0, 'seg': 1, 'ter': 2, 'qua': 3, 'qui': 4, 'sex': 5, 'sab': 6, 'sáb': 6}
+# Atalhos aceitos no lugar da lista de dias
+DAY_ALIASES = {'diario': '*', 'diariamente': '*', 'todos': '*', 'util': '1-5', 'uteis': '1-5', 'fds': '0,6'}
+
+# (nome, mínimo, máximo) de cada campo
+CRON_FIELDS = (
+    ('minuto', 0, 59),
+    ('hora', 0, 23),
+    ('dia', 1, 31),
+    ('mes', 1, 12),
+    ('dia da semana', 0, 7),
+)
+
+# Limite de busca da próxima ocorrência (cobre expressões como "29 de fevereiro")
+MAX_SEARCH_DAYS = 366 * 8
+
+
+def _parse_value(value, field_name, names):
+    if value in names:
+        return names[value]
+    if not value.isdigit():
+        raise ValueError(f"Valor inválido no campo {field_name}: '{value}'")
+    return int(value)
+
+
+def _parse_field(expr, field_name, low, high, names=None):
+    """Converte um campo cron (*, */n, a, a-b, a-b/n, listas com vírgula) no conjunto de valores."""
+    names = names or {}
+    values = set()
+    for part in expr.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            if not step_text.isdigit() or int(step_text) == 0:
+                raise ValueError(f"Passo inválido no campo {field_name}: '{step_text}'")
+            step = int(step_text)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            start = _parse_value(start_text, field_name, names)
+            end = _parse_value(end_text, field_name, names)
+        else:
+            start = end = _parse_value(part, field_name, names)
+            if step != 1:
+                end = high
+        if not (low <= start <= high and low <= end <= high):
+            raise ValueError(f"Valor fora do intervalo {low}-{high} no campo {field_name}: '{part}'")
+        if start <= end:
+            values.update(range(start, end + 1, step))
+        else:
+            # Intervalo que atravessa o fim (ex: sex-seg)
+            values.update(v for n, v in enumerate(list(range(start, high + 1)) + list(range(low, end + 1))) if n % step == 0)
+    return values
+
+
+def parse_cron(expr):
+    """
+    Valida uma expressão cron de 5 campos e retorna (minutos, horas, dias, meses, dias da semana,
+    dia restrito, dia da semana restrito). Lança ValueError se a expressão for inválida.
+    """
+    fields = expr.split()
+    if len(fields) != 5:
+        raise ValueError("A expressão cron deve ter 5 campos: minuto hora dia mês dia-da-semana")
+    parsed = [
+        _parse_field(field, name, low, high, WEEKDAY_NAMES if name == 'dia da semana' else None)
+        for field, (name, low, high) in zip(fields, CRON_FIELDS)
+    ]
+    weekdays = {0 if d == 7 else d for d in parsed[4]}
+    return (*parsed[:4], weekdays, fields[2] != '*', fields[4] != '*')
+
+
+def normalize_cron(expr):
+    """Valida a expressão e a devolve normalizada (espaços simples, minúsculas)."""
+    expr = " ".join(expr.lower().split())
+    parse_cron(expr)
+    return expr
+
+
+def cron_from_time_and_days(time_str, days):
+    """
+    Converte a forma amigável do chat ('20:00' + 'seg-sex', 'seg,qua', 'diario', ...)
+    em uma expressão cron. Lança ValueError se o horário ou os dias forem inválidos.
+    """
+    try:
+        horario = datetime.strptime(time_str, "%H:%M")
+    except ValueError:
+        raise ValueError(f"Horário inválido '{time_str}', use o formato HH:mm")
+    days = DAY_ALIASES.get(days.lower(), days.lower())
+    return normalize_cron(f"{horario.minute} {horario.hour} * * {days}")
+
+
+def _day_matches(day, days, months, weekdays, dom_restricted, dow_restricted):
+    if day.month not in months:
+        return False
+    # Convenção do cron: com dia do mês e dia da semana restritos, basta um dos dois coincidir
+    dom_ok = day.day in days
+    dow_ok = (day.weekday() + 1) % 7 in weekdays
+    if dom_restricted and dow_restricted:
+        return dom_ok or dow_ok
+    return dom_ok and dow_ok
+
+
+def next_occurrence(expr, after):
+    """
+    Próxima ocorrência da expressão estritamente depois de 'after' (datetime com fuso),
+    retornada em UTC.
+    """
+    minutes, hours, days, months, weekdays, dom_restricted, dow_restricted = parse_cron(expr)
+    start = after.astimezone(LOCAL_TZ).replace(second=0, microsecond=0) + timedelta(minutes=1)
+    times = sorted(time(h, m) for h in hours for m in minutes)
+
+    day = start.date()
+    for _ in range(MAX_SEARCH_DAYS):
+        if _day_matches(day, days, months, weekdays, dom_restricted, dow_restricted):
+            for t in times:
+                if day != start.date() or t >= start.time():
+                    return datetime.combine(day, t, tzinfo=LOCAL_TZ).astimezone(timezone.utc)
+        day += timedelta(days=1)
+    raise ValueError(f"A expressão '{expr}' não tem ocorrências futuras")
+
+
+def describe(expr):
+    """Texto curto para exibição no chat: '0 20 * * 1-5' vira '20:00 seg-sex'; outras expressões ficam como estão."""
+    minute, hour, day, month, weekday = expr.split()
+    if not (minute.isdigit() and hour.isdigit() and day == '*' and month == '*'):
+        return f"cron {expr}"
+    if weekday == '*':
+        days = "todos os dias"
+    else:
+        names = {str(n): name for name, n in WEEKDAY_NAMES.items() if name != 'sáb'}
+        names['7'] = 'dom'
+        days = re.sub(r'\d+', lambda m: names.get(m.group(), m.group()), weekday)
+    return f"{int(hour):02d}:{int(minute):02d} {days}"
@@ -0,0 +1,211 @@
+"""
+Tempo ligado e custo estimado das instâncias, a partir de agregados diários incrementais.
+
+Todo start/stop feito pelo bot ou pelo ExecutaAgendamentosEC2 é registrado em uma tabela
+própria do DynamoDB (USAGE_TABLE_NAME, chave de partição 'dia' e de ordenação 'chave'):
+
+    evento de transição   dia=<AAAA-MM-DD>  chave=e#<ms>#<instância>#<ação>   (com TTL em 'expira_em')
+    estado da instância   dia=estado        chave=s#<instância>               ligada_desde=<epoch>
+    agregado diário       dia=<AAAA-MM-DD>  chave=r#<instância>               segundos=<N>
+
+Só são registradas as transições que mudaram o estado da instância (PreviousState diferente
+de CurrentState na resposta da EC2): um start de uma instância já ligada não reinicia a
+contagem. Os eventos vão em lotes de BatchWriteItem. No start, o estado é gravado com um
+PutItem condicional (attribute_not_exists), que não sobrescreve um intervalo já aberto. No
+stop, o estado é removido (DeleteItem condicional, para que dois stops concorrentes não
+contem o mesmo intervalo) e o intervalo ligado é somado (ADD atômico) ao agregado de cada
+dia que ele cobre. O relatório lê só os agregados dos dias pedidos (uma Query por dia, begins_with 'r#') e o
+estado das instâncias ainda ligadas: O(dias × instâncias), sem reler os eventos nem
+consultar a EC2.
+
+Os dias seguem o fuso do bot (UTC-3).
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta, timezone
+
+from comum.aws import get_resource, get_table
+from comum.recorrencia import LOCAL_TZ
+
+USAGE_TABLE_NAME = os.environ.get('USAGE_TABLE_NAME', '')
+# Validade dos eventos de transição (os agregados não expiram)
+USAGE_EVENT_TTL_DAYS = int(os.environ.get('USAGE_EVENT_TTL_DAYS', '90'))
+# Threads usadas para gravar as transições de ações em massa
+USAGE_WRITE_WORKERS = int(os.environ.get('USAGE_WRITE_WORKERS', '16'))
+# Custo por hora (USD) por tipo de instância, em JSON; sobrescreve/complementa DEFAULT_HOURLY_COSTS
+USAGE_HOURLY_COSTS = os.environ.get('USAGE_HOURLY_COSTS', '')
+# Custo por hora dos tipos sem preço conhecido
+USAGE_DEFAULT_HOURLY_COST = float(os.environ.get('USAGE_DEFAULT_HOURLY_COST', '0.10'))
+
+STATE_PARTITION = 'estado'
+
+# On-demand Linux em us-east-1; ajuste com USAGE_HOURLY_COSTS para a sua região
+DEFAULT_HOURLY_COSTS = {
+    't3.micro': 0.0104, 't3.small': 0.0208, 't3.medium': 0.0416, 't3.large': 0.0832, 't3.xlarge': 0.1664,
+    'm5.large': 0.096, 'm5.xlarge': 0.192, 'm5.2xlarge': 0.384,
+    'c5.large': 0.085, 'c5.xlarge': 0.17, 'r5.large': 0.126, 'r5.xlarge': 0.252,
+}
+HOURLY_COSTS = {**DEFAULT_HOURLY_COSTS, **(json.loads(USAGE_HOURLY_COSTS) if USAGE_HOURLY_COSTS else {})}
+
+
+def hourly_cost(instance_type):
+    return HOURLY_COSTS.get(instance_type, USAGE_DEFAULT_HOURLY_COST)
+
+
+def local_day(moment):
+    return moment.astimezone(LOCAL_TZ).date().isoformat()
+
+
+def split_by_day(start, end):
+    """Divide o intervalo [start, end) em [(dia local, segundos), ...]."""
+    parts = []
+    cursor = start.astimezone(LOCAL_TZ)
+    end = end.astimezone(LOCAL_TZ)
+    while cursor < end:
+        segment_end = min(end, datetime.combine(cursor.date() + timedelta(days=1), time.min, tzinfo=LOCAL_TZ))
+        parts.append((cursor.date().isoformat(), (segment_end - cursor).total_seconds()))
+        cursor = segment_end
+    return parts
+
+
+class UsageStore:
+    """Eventos de transição, estado e agregados diários em uma tabela do DynamoDB."""
+
+    def __init__(self, table_name=USAGE_TABLE_NAME):
+        self.table_name = table_name
+
+    def _open(self, client, instance_id, when):
+        """Grava o início do intervalo ligado, sem sobrescrever um intervalo já aberto."""
+        try:
+            client.put_item(
+                TableName=self.table_name,
+                Item={'dia': STATE_PARTITION, 'chave': f"s#{instance_id}", 'ligada_desde': int(when.timestamp())},
+                ConditionExpression="attribute_not_exists(ligada_desde)"
+            )
+        except client.exceptions.ConditionalCheckFailedException:
+            # Já ligada desde antes (start repetido): o intervalo continua contando do início original
+            pass
+
+    def _close(self, client, instance_id, when):
+        """Fecha o intervalo ligado e soma o tempo ao agregado de cada dia coberto."""
+        try:
+            res = client.delete_item(
+                TableName=self.table_name,
+                Key={'dia': STATE_PARTITION, 'chave': f"s#{instance_id}"},
+                ConditionExpression="attribute_exists(ligada_desde)",
+                ReturnValues='ALL_OLD'
+            )
+        except client.exceptions.ConditionalCheckFailedException:
+            # Ligada antes do início do registro (ou já parada): intervalo desconhecido
+            return
+        started = datetime.fromtimestamp(int(res['Attributes']['ligada_desde']), timezone.utc)
+        for day, seconds in split_by_day(started, when):
+            client.update_item(
+                TableName=self.table_name,
+                Key={'dia': day, 'chave': f"r#{instance_id}"},
+                UpdateExpression="ADD segundos :segundos",
+                ExpressionAttributeValues={':segundos': int(round(seconds))}
+            )
+
+    def record(self, transitions, origin, pool=None):
+        """
+        Registra transições [(instance_id, 'start'|'stop', quando, solicitante), ...] vindas de
+        'origin' ('bot' ou 'agendamento'), que devem ser só as que mudaram o estado da instância:
+        os eventos em lotes de BatchWriteItem e, por instância, a abertura (PutItem condicional)
+        ou o fechamento (DeleteItem condicional e UpdateItem atômicos) do intervalo ligado.
+        As gravações por instância rodam em 'pool' (ou em um pool próprio) com o cliente de
+        baixo nível, que ao contrário do Table pode ser compartilhado entre threads.
+        """
+        if not transitions:
+            return
+        table = get_table(self.table_name)
+        last = {}
+        for transition in sorted(transitions, key=lambda t: t[2]):
+            last[transition[0]] = transition
+
+        expires_at = int((datetime.now(timezone.utc) + timedelta(days=USAGE_EVENT_TTL_DAYS)).timestamp())
+        with table.batch_writer(overwrite_by_pkeys=['dia', 'chave']) as batch:
+            for instance_id, action, when, requester in transitions:
+                event = {
+                    'dia': local_day(when),
+                    'chave': f"e#{int(when.timestamp() * 1000)}#{instance_id}#{action}",
+                    'origem': origin,
+                    'expira_em': expires_at,
+                }
+                if requester:
+                    event['por'] = requester
+                batch.put_item(Item=event)
+
+        client = get_resource('dynamodb').meta.client
+        writes = [(self._open if action == 'start' else self._close, instance_id, when)
+                  for instance_id, action, when, _ in last.values()]
+
+        def write(item):
+            method, instance_id, when = item
+            method(client, instance_id, when)
+
+        if pool is not None:
+            list(pool.map(write, writes))
+        elif len(writes) > 1:
+            with ThreadPoolExecutor(max_workers=min(USAGE_WRITE_WORKERS, len(writes))) as own_pool:
+                list(own_pool.map(write, writes))
+        else:
+            for item in writes:
+                write(item)
+
+    def _query_all(self, table, condition):
+        kwargs = {'KeyConditionExpression': condition}
+        while True:
+            page = table.query(**kwargs)
+            yield from page.get('Items', [])
+            if 'LastEvaluatedKey' not in page:
+                return
+            kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+    def read(self, days):
+        """
+        Agregados dos dias pedidos e instâncias ainda ligadas.
+        Retorna ({dia: {instância: segundos}}, {instância: ligada desde (datetime UTC)}).
+        """
+        from boto3.dynamodb.conditions import Key
+
+        table = get_table(self.table_name)
+        rollups = {}
+        for day in days:
+            rollups[day] = {
+                item['chave'][2:]: int(item.get('segundos', 0))
+                for item in self._query_all(table, Key('dia').eq(day) & Key('chave').begins_with('r#'))
+            }
+        running = {
+            item['chave'][2:]: datetime.fromtimestamp(int(item['ligada_desde']), timezone.utc)
+            for item in self._query_all(table, Key('dia').eq(STATE_PARTITION) & Key('chave').begins_with('s#'))
+            if item.get('ligada_desde') is not None
+        }
+        return rollups, running
+
+
+def summarize(rollups, running, window_start, now):
+    """
+    Soma os agregados e os intervalos ainda abertos (cortados no início da janela).
+    Retorna ({dia: segundos}, {instância: segundos}).
+    """
+    by_day = {day: 0 for day in rollups}
+    by_instance = {}
+    for day, instances in rollups.items():
+        for instance_id, seconds in instances.items():
+            by_day[day] += seconds
+            by_instance[instance_id] = by_instance.get(instance_id, 0) + seconds
+    for instance_id, since in running.items():
+        for day, seconds in split_by_day(max(since, window_start), now):
+            if day in by_day:
+                by_day[day] += seconds
+                by_instance[instance_id] = by_instance.get(instance_id, 0) + seconds
+    return by_day, by_instance
+
+
+def store_from_env():
+    """Backend configurado pelas variáveis de ambiente, ou None se o registro de uso estiver desligado."""
+    if USAGE_TABLE_NAME:
+        return UsageStore(USAGE_TABLE_NAME)
+    return None
@@ -0,0 +1,41 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# As funções importam o pacote compartilhado 'comum' da raiz do repositório
+sys.path.insert(0, ROOT)
+# Backend AWS em memória dos benchmarks (fake_aws.py), reaproveitado pelos testes
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+
+def load_lambda(directory, module_name):
+    """
+    Carrega o lambda_function.py de uma função com um nome de módulo próprio. O diretório da
+    função entra no sys.path, como no runtime da Lambda (o bot importa os módulos vizinhos).
+    """
+    function_dir = os.path.join(ROOT, directory)
+    if function_dir not in sys.path:
+        sys.path.append(function_dir)
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT, directory, 'lambda_function.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def fake_aws():
+    """Backend AWS em memória (benchmarks/fake_aws.py) instalado na sessão compartilhada de comum/aws.py."""
+    import boto3
+    from comum import aws
+    from fake_aws import FakeAWS
+
+    fake = FakeAWS()
+    session = boto3.session.Session(aws_access_key_id='teste', aws_secret_access_key='teste', region_name='us-east-1')
+    fake.install(session)
+    aws.use_session(session)
+    yield fake
+    aws.reset()
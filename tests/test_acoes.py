@@ -0,0 +1,85 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from comum.acoes import run_ec2_action
+
+
+class FakeEC2:
+    """Cliente EC2 mínimo: rejeita a chamada inteira se algum ID for inválido, como a EC2."""
+
+    def __init__(self, states, throttle=False):
+        self.states = states
+        self.throttle = throttle
+        self.calls = []
+
+    def start_instances(self, InstanceIds):
+        self.calls.append(list(InstanceIds))
+        if self.throttle:
+            raise ClientError({'Error': {'Code': 'RequestLimitExceeded', 'Message': 'Request limit exceeded.'}},
+                              'StartInstances')
+        invalid = [i for i in InstanceIds if i not in self.states]
+        if invalid:
+            raise ClientError({'Error': {'Code': 'InvalidInstanceID.NotFound',
+                                         'Message': f"The instance ID '{invalid[0]}' does not exist"}},
+                              'StartInstances')
+        changes = []
+        for instance_id in InstanceIds:
+            previous = self.states[instance_id]
+            self.states[instance_id] = 'running' if previous == 'running' else 'pending'
+            changes.append({'InstanceId': instance_id, 'PreviousState': {'Name': previous},
+                            'CurrentState': {'Name': self.states[instance_id]}})
+        return {'StartingInstances': changes}
+
+
+class FakeTarget:
+    id = 'teste'
+
+    def __init__(self, client):
+        self.client = client
+
+    def ec2(self):
+        return self.client
+
+
+def test_one_call_when_every_id_is_accepted():
+    client = FakeEC2({'i-1': 'stopped', 'i-2': 'stopped'})
+    aceitas, erros = run_ec2_action('start', ['i-1', 'i-2'], FakeTarget(client))
+    assert aceitas == {'i-1': True, 'i-2': True}
+    assert erros == {}
+    assert len(client.calls) == 1
+
+
+def test_bisect_isolates_rejected_ids():
+    ids = [f"i-{n}" for n in range(8)]
+    client = FakeEC2({i: 'stopped' for i in ids if i != 'i-5'})
+    aceitas, erros = run_ec2_action('start', ids, FakeTarget(client))
+    assert set(aceitas) == set(ids) - {'i-5'}
+    assert list(erros) == ['i-5']
+    assert "does not exist" in erros['i-5']
+    # Só as metades com o ID inválido são divididas de novo: 1 + 2 + 2 + 2 chamadas
+    assert len(client.calls) == 7
+
+
+def test_throttling_is_raised_without_splitting():
+    client = FakeEC2({'i-1': 'stopped', 'i-2': 'stopped'}, throttle=True)
+    with pytest.raises(ClientError):
+        run_ec2_action('start', ['i-1', 'i-2'], FakeTarget(client))
+    assert len(client.calls) == 1
+
+
+def test_instance_already_in_the_requested_state_is_not_a_change():
+    client = FakeEC2({'i-1': 'running', 'i-2': 'stopped'})
+    aceitas, _ = run_ec2_action('start', ['i-1', 'i-2'], FakeTarget(client))
+    assert aceitas == {'i-1': False, 'i-2': True}
+
+
+def test_ids_missing_from_the_response_are_errors():
+    class Partial(FakeEC2):
+        def start_instances(self, InstanceIds):
+            res = super().start_instances(InstanceIds)
+            res['StartingInstances'] = res['StartingInstances'][:1]
+            return res
+
+    aceitas, erros = run_ec2_action('start', ['i-1', 'i-2'], FakeTarget(Partial({'i-1': 'stopped', 'i-2': 'stopped'})))
+    assert list(aceitas) == ['i-1']
+    assert erros == {'i-2': "Instância não retornada pela EC2"}
@@ -0,0 +1,28 @@
+from comum import alvos, aws
+
+ROLE_ARN = 'arn:aws:iam::111122223333:role/EC2ChatOps'
+
+
+def test_timeout_caps_connect_and_read_timeouts(monkeypatch):
+    monkeypatch.setenv('BOTO_CONNECT_TIMEOUT', '2')
+    monkeypatch.setenv('BOTO_READ_TIMEOUT', '30')
+
+    config = aws.client_config('ec2', timeout=4)
+    assert (config.connect_timeout, config.read_timeout) == (2, 4)
+    assert aws.client_config('ec2').read_timeout == 30
+
+
+def test_target_clients_get_the_fan_out_timeout(fake_aws, monkeypatch):
+    monkeypatch.setattr(alvos, 'TARGETS', [alvos.Target('us-east-1'), alvos.Target('sa-east-1')])
+    monkeypatch.setattr(alvos, 'EC2_TARGET_TIMEOUT_SECONDS', 1.5)
+
+    config = alvos.TARGETS[1].ec2().meta.config
+    assert (config.connect_timeout, config.read_timeout) == (1.5, 1.5)
+
+
+def test_role_session_only_uses_the_assumed_role(fake_aws):
+    credentials = aws.get_role_session(ROLE_ARN, 'externo').get_credentials()
+
+    # Credenciais da role, obtidas só no primeiro uso (nenhuma chamada ao STS ainda)
+    assert credentials.method == 'assume-role'
+    assert aws.get_role_session(ROLE_ARN, 'externo') is aws.get_role_session(ROLE_ARN, 'externo')
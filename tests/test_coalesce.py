@@ -0,0 +1,61 @@
+import pytest
+
+from conftest import load_lambda
+
+
+@pytest.fixture(scope='module')
+def executor():
+    return load_lambda('ExecutaAgendamentosEC2', 'executa_agendamentos')
+
+
+def schedule(schedule_id, instance_id, action, horario):
+    return {'id': schedule_id, 'instancia': instance_id, 'acao': action, 'horario': horario}
+
+
+def statuses(resultados):
+    return {ag['id']: status for ag, status in resultados}
+
+
+def test_latest_minute_wins(executor):
+    antigo = schedule('a', 'i-1', 'start', '2026-10-17T10:00:00+00:00')
+    novo = schedule('b', 'i-1', 'stop', '2026-10-17T10:05:00+00:00')
+    principais, repetidos, resultados = executor.coalesce_schedules([antigo, novo])
+    assert principais == [novo]
+    assert repetidos == {}
+    assert statuses(resultados) == {'a': 'substituido'}
+
+
+def test_same_minute_repeats_follow_the_main_schedule(executor):
+    primeiro = schedule('a', 'i-1', 'stop', '2026-10-17T10:00:00+00:00')
+    segundo = schedule('b', 'i-1', 'stop', '2026-10-17T10:00:30+00:00')
+    principais, repetidos, resultados = executor.coalesce_schedules([primeiro, segundo])
+    assert principais == [primeiro]
+    assert repetidos == {'a': [segundo]}
+    assert resultados == []
+
+
+def test_contradictory_actions_in_the_same_minute_conflict(executor):
+    start = schedule('a', 'i-1', 'start', '2026-10-17T10:00:00+00:00')
+    stop = schedule('b', 'i-1', 'stop', '2026-10-17T10:00:10+00:00')
+    anterior = schedule('c', 'i-1', 'start', '2026-10-17T09:00:00+00:00')
+    principais, repetidos, resultados = executor.coalesce_schedules([start, stop, anterior])
+    assert principais == []
+    assert statuses(resultados) == {'a': 'conflito', 'b': 'conflito', 'c': 'substituido'}
+
+
+def test_minutes_are_compared_in_utc(executor):
+    # Mesmo minuto em fusos diferentes: repetição, não substituição
+    utc = schedule('a', 'i-1', 'start', '2026-10-17T13:00:00+00:00')
+    local = schedule('b', 'i-1', 'start', '2026-10-17T10:00:20-03:00')
+    principais, repetidos, _ = executor.coalesce_schedules([utc, local])
+    assert principais == [utc]
+    assert repetidos == {'a': [local]}
+
+
+def test_instances_are_independent(executor):
+    a = schedule('a', 'i-1', 'start', '2026-10-17T10:00:00+00:00')
+    b = schedule('b', 'i-2', 'stop', '2026-10-17T10:00:00+00:00')
+    principais, repetidos, resultados = executor.coalesce_schedules([a, b])
+    assert principais == [a, b]
+    assert repetidos == {}
+    assert resultados == []
@@ -0,0 +1,76 @@
+import pytest
+
+from comum import aws
+from conftest import load_lambda
+
+KEY = 'idempotencia#teste'
+RESPONSE = {'statusCode': 200, 'body': '{"text": "ok"}', 'headers': {'Content-Type': 'application/json'}}
+
+
+@pytest.fixture(scope='module')
+def idempotencia():
+    return load_lambda('GoogleChatEC2Bot', 'bot_idempotencia').idempotencia
+
+
+@pytest.fixture
+def new_store(fake_aws, idempotencia):
+    """Cada store é um container: LRU próprio, registro compartilhado no DynamoDB."""
+    fake_aws.dynamodb.create_table('Agendamentos')
+    return lambda: idempotencia.IdempotencyStore('Agendamentos')
+
+
+class Process:
+    def __init__(self, action=lambda: RESPONSE):
+        self.action = action
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.action()
+
+
+def record():
+    return aws.get_table('Agendamentos').get_item(Key={'id': KEY}).get('Item')
+
+
+def test_duplicate_event_is_processed_once(new_store, idempotencia):
+    store, process = new_store(), Process()
+
+    assert store.run(KEY, process) == (RESPONSE, False)
+    assert store.run(KEY, process) == (RESPONSE, True)
+    # Outro container, sem a resposta no LRU, a encontra no registro
+    assert new_store().run(KEY, process) == (RESPONSE, True)
+    assert process.calls == 1
+    assert record()['estado'] == idempotencia.DONE
+
+
+def test_duplicate_while_the_first_delivery_is_running(new_store, idempotencia):
+    first, second = new_store(), new_store()
+    duplicate = Process()
+    seen = []
+
+    def slow_first_delivery():
+        # O reenvio chega a outro container antes de a primeira entrega terminar
+        seen.append(second.run(KEY, duplicate))
+        return RESPONSE
+
+    assert first.run(KEY, Process(slow_first_delivery)) == (RESPONSE, False)
+    assert seen == [(idempotencia.IN_PROGRESS_RESPONSE, True)]
+    assert duplicate.calls == 0
+    # Terminada a primeira entrega, o reenvio recebe a resposta gravada
+    assert second.run(KEY, duplicate) == (RESPONSE, True)
+
+
+def test_failure_releases_the_key_for_a_retry(new_store):
+    store = new_store()
+
+    def fail():
+        raise RuntimeError('falha no comando')
+
+    with pytest.raises(RuntimeError):
+        store.run(KEY, Process(fail))
+    assert record() is None
+
+    retry = Process()
+    assert store.run(KEY, retry) == (RESPONSE, False)
+    assert retry.calls == 1
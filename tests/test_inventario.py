@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from comum import alvos, aws, inventario
+
+SYNC_STARTED = datetime(2026, 10, 17, 12, 0, 0, tzinfo=timezone.utc)
+LOCATION = {'alvo': alvos.DEFAULT_TARGET.id, 'regiao': alvos.DEFAULT_TARGET.region}
+
+
+@pytest.fixture
+def store(fake_aws):
+    fake_aws.dynamodb.create_table('Inventario')
+    return inventario.InventoryStore('Inventario')
+
+
+def described(instance_id, state, **tags):
+    """Instância como lida pelo describe_instances da sincronização."""
+    return inventario.instance_to_item({
+        'InstanceId': instance_id, 'State': {'Name': state}, 'InstanceType': 't3.micro',
+        'Tags': [{'Key': k, 'Value': v} for k, v in tags.items()],
+    }, alvos.DEFAULT_TARGET, now=SYNC_STARTED)
+
+
+def row(instance_id):
+    return aws.get_table('Inventario').get_item(Key={'id': instance_id})['Item']
+
+
+def test_events_applied_during_the_sync_are_kept(fake_aws, store):
+    during = SYNC_STARTED + timedelta(seconds=5)
+    store.apply_state('i-1', 'running', during, LOCATION)
+    store.apply_tags('i-2', {'Name': 'web', 'env': 'prod'}, 7, during, LOCATION)
+
+    kept = store.sync([described('i-1', 'stopped', Name='app'), described('i-2', 'running', Name='web', env='qa')],
+                      SYNC_STARTED)
+
+    assert kept == 2
+    assert row('i-1')['estado'] == 'running'
+    assert row('i-2')['tags'] == {'Name': 'web', 'env': 'prod'}
+    assert row('i-2')['tags_versao'] == 7
+
+
+def test_sync_keeps_the_tag_version_so_late_events_still_lose(fake_aws, store):
+    before = SYNC_STARTED - timedelta(minutes=5)
+    store.apply_state('i-1', 'running', before, LOCATION)
+    store.apply_tags('i-1', {'Name': 'app', 'env': 'qa', 'LastActionBy': 'Ana'}, 5, before, LOCATION)
+
+    assert store.sync([described('i-1', 'stopped', Name='app', env='dev')], SYNC_STARTED) == 0
+    item = row('i-1')
+    assert (item['estado'], item['tags'], item['tags_versao']) == ('stopped', {'Name': 'app', 'env': 'dev'}, 5)
+    # O describe não traz LastActionBy: o atributo derivado sai do item, como na sobrescrita completa
+    assert 'ultima_acao' not in item
+
+    # Evento de tags atrasado (versão anterior à já aplicada) chega depois da sincronização
+    assert store.apply_tags('i-1', {'Name': 'app', 'env': 'old'}, 3, before, LOCATION) is None
+    assert row('i-1')['tags']['env'] == 'dev'
+
+
+def test_new_instances_start_at_version_zero(fake_aws, store):
+    store.sync([described('i-9', 'running', Name='novo')], SYNC_STARTED)
+    assert row('i-9')['tags_versao'] == 0
+    assert store.apply_tags('i-9', {'Name': 'novo', 'env': 'qa'}, 1, SYNC_STARTED, LOCATION) is not None
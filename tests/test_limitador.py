@@ -0,0 +1,145 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from comum import limitador
+
+NOW_MS = 1_000_000
+
+
+class Clock:
+    """Relógio parado: só avança quando o limitador dorme."""
+
+    def __init__(self, monkeypatch, jitter=1.0):
+        self.now_ms = NOW_MS
+        self.sleeps = []
+        monkeypatch.setattr(limitador, '_now_ms', lambda: self.now_ms)
+        monkeypatch.setattr(limitador.time, 'sleep', self.sleep)
+        monkeypatch.setattr(limitador.random, 'uniform', lambda low, high: jitter)
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now_ms += round(seconds * 1000)
+
+
+class StubTable:
+    """
+    Tabela com respostas programadas para o update_item: None aplica a escrita; um número
+    (ou 'ausente') falha a condição devolvendo esse 'tat' no item antigo.
+    """
+
+    class ConditionalCheckFailedException(ClientError):
+        pass
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+        self.meta = self
+        self.client = self
+        self.exceptions = self
+
+    def update_item(self, **kwargs):
+        self.calls.append((kwargs['UpdateExpression'], kwargs['ConditionExpression'], kwargs['ExpressionAttributeValues']))
+        outcome = self.outcomes.pop(0)
+        if outcome is None:
+            return {}
+        item = {} if outcome == 'ausente' else {'tat': {'N': str(outcome)}}
+        raise self.ConditionalCheckFailedException(
+            {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'},
+             'Item': item}, 'UpdateItem')
+
+
+@pytest.fixture
+def stub_table(monkeypatch):
+    def install(*outcomes):
+        table = StubTable(outcomes)
+        monkeypatch.setattr('comum.aws.get_table', lambda name: table)
+        return table
+    return install
+
+
+def test_empty_bucket_is_started_by_the_second_update(stub_table):
+    table = stub_table('ausente', None)
+
+    assert limitador.DynamoDBBucketState('Agendamentos').take(50, NOW_MS, NOW_MS + 2000) == 0
+    (first, _, first_values), (second, condition, values) = table.calls
+    # Primeiro o avanço de um balde em uso; sem 'tat', recomeça a partir de agora
+    assert (first, first_values[':maximo']) == ("SET tat = tat + :custo", NOW_MS + 2000 - 50)
+    assert (second, condition) == ("SET tat = :novo", "attribute_not_exists(tat) OR tat < :agora")
+    assert values[':novo'] == NOW_MS + 50
+
+
+def test_bucket_in_use_is_advanced_with_a_single_update(stub_table):
+    table = stub_table(None)
+
+    assert limitador.DynamoDBBucketState('Agendamentos').take(50, NOW_MS, NOW_MS + 2000) == 0
+    assert table.calls == [("SET tat = tat + :custo", "tat BETWEEN :agora AND :maximo",
+                            {':custo': 50, ':agora': NOW_MS, ':maximo': NOW_MS + 1950})]
+
+
+def test_empty_tokens_return_the_wait_for_the_next_one(stub_table):
+    stub_table(NOW_MS + 1980)
+
+    assert limitador.DynamoDBBucketState('Agendamentos').take(50, NOW_MS, NOW_MS + 2000) == 30
+
+
+def test_restart_lost_to_another_process_is_retried(stub_table):
+    # 'tat' no passado, mas outro processo recomeça o balde entre as duas escritas
+    table = stub_table(NOW_MS - 10, NOW_MS + 50, None)
+
+    assert limitador.DynamoDBBucketState('Agendamentos').take(50, NOW_MS, NOW_MS + 2000) == 0
+    assert len(table.calls) == 3
+
+
+def test_gives_up_after_losing_every_attempt(stub_table):
+    stub_table(*[NOW_MS - 10, NOW_MS + 50] * limitador.DynamoDBBucketState.MAX_ATTEMPTS)
+
+    assert limitador.DynamoDBBucketState('Agendamentos').take(50, NOW_MS, NOW_MS + 2000) == \
+        int(1000 / limitador.EC2_RATE_LIMIT)
+
+
+def limiter(**overrides):
+    options = dict(rate=10, burst=10, describe_share=0.5, max_wait_seconds=10)
+    options.update(overrides)
+    return limitador.RateLimiter(limitador.LocalBucketState(), **options)
+
+
+def test_describe_calls_only_use_their_share(monkeypatch):
+    clock = Clock(monkeypatch)
+    bucket = limiter()
+
+    assert [bucket.acquire(mutating=False) for _ in range(5)] == [0] * 5
+    # Leituras esgotaram a sua parte (5 de 10 tokens): a sexta espera um intervalo
+    assert bucket.acquire(mutating=False) == pytest.approx(0.1)
+    assert clock.sleeps == [pytest.approx(0.1)]
+
+
+def test_mutations_keep_the_reserved_capacity(monkeypatch):
+    clock = Clock(monkeypatch)
+    bucket = limiter()
+
+    for _ in range(5):
+        bucket.acquire(mutating=False)
+    assert [bucket.acquire(mutating=True) for _ in range(5)] == [0] * 5
+    assert clock.sleeps == []
+    assert bucket.acquire(mutating=True) == pytest.approx(0.1)
+
+
+def test_wait_is_computed_from_the_bucket_and_jittered(monkeypatch):
+    clock = Clock(monkeypatch, jitter=1.5)
+    bucket = limiter()
+
+    for _ in range(10):
+        bucket.acquire()
+    # Pedido de 3 tokens com o balde vazio: espera 3 intervalos, com o jitter aplicado
+    assert bucket.acquire(tokens=3) == pytest.approx(0.45)
+    assert clock.sleeps == [pytest.approx(0.45)]
+
+
+def test_gives_up_without_sleeping_past_the_max_wait(monkeypatch):
+    clock = Clock(monkeypatch)
+    bucket = limiter(max_wait_seconds=0.05)
+
+    for _ in range(10):
+        bucket.acquire()
+    assert bucket.acquire() == 0
+    assert clock.sleeps == []
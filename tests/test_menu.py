@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+from conftest import load_lambda
+
+
+@pytest.fixture(scope='module')
+def bot():
+    return load_lambda('GoogleChatEC2Bot', 'bot_menu')
+
+
+def chat_event(text):
+    return {'message': {'text': f"@EC2Bot {text}", 'annotations': [
+        {'type': 'USER_MENTION', 'startIndex': 0, 'length': len('@EC2Bot')}]}}
+
+
+def instance(name, state='running', **tags):
+    return {'InstanceId': f"i-{name}", 'State': {'Name': state},
+            'Tags': [{'Key': 'Name', 'Value': name}] + [{'Key': k, 'Value': v} for k, v in tags.items()]}
+
+
+def test_filter_terms_keep_their_case(bot):
+    assert bot.menu_filter_text(chat_event('MENU Running tag:Env=QA Web-')) == 'running tag:Env=QA Web-'
+
+
+def test_tag_and_name_filters_are_case_sensitive(bot):
+    web_prod = instance('Web-Prod', Env='QA')
+    qa_box = instance('qa-box', env='qa')
+    terms = bot.menu_filter_text(chat_event('menu tag:Env=QA')).split()
+    assert [i['InstanceId'] for i in (web_prod, qa_box) if bot.matches_menu_filters(i, terms)] == ['i-Web-Prod']
+    assert bot.matches_menu_filters(web_prod, bot.menu_filter_text(chat_event('menu Web-')).split())
+    assert bot.parse_menu_filters(['Web-']) == [{'Name': 'tag:Name', 'Values': ['Web-*']}]
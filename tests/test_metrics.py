@@ -0,0 +1,29 @@
+import boto3
+import pytest
+from botocore.config import Config
+from botocore.exceptions import EndpointConnectionError
+
+from comum import metrics
+
+
+def unreachable_client():
+    """Cliente DynamoDB instrumentado apontando para uma porta sem nada escutando."""
+    session = boto3.session.Session(aws_access_key_id='teste', aws_secret_access_key='teste',
+                                    region_name='us-east-1')
+    metrics.instrument_session(session)
+    return session.client('dynamodb', endpoint_url='http://127.0.0.1:9',
+                          config=Config(connect_timeout=1, read_timeout=1, retries={'max_attempts': 1}))
+
+
+def test_connection_error_reaches_the_caller():
+    metrics.start_invocation('teste')
+    with pytest.raises(EndpointConnectionError):
+        unreachable_client().list_tables()
+    # A chamada com erro de conexão também é contada, pela operação gravada antes da chamada
+    assert metrics.current().api_calls['dynamodb.ListTables'][0] == 1
+
+
+def test_connection_error_without_an_open_invocation():
+    metrics._current = None
+    with pytest.raises(EndpointConnectionError):
+        unreachable_client().list_tables()
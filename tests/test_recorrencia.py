@@ -0,0 +1,49 @@
+from datetime import datetime
+
+import pytest
+
+from comum.recorrencia import LOCAL_TZ, next_occurrence, parse_cron
+
+
+def local(*args):
+    return datetime(*args, tzinfo=LOCAL_TZ)
+
+
+def next_local(expr, after):
+    return next_occurrence(expr, after).astimezone(LOCAL_TZ)
+
+
+def test_weekday_range_wraps_around_the_week():
+    assert parse_cron("0 8 * * sex-seg")[4] == {5, 6, 0, 1}
+
+
+def test_wrap_around_range_keeps_the_step():
+    assert parse_cron("0 22-2/2 * * *")[1] == {22, 0, 2}
+
+
+def test_seven_is_sunday():
+    assert parse_cron("0 8 * * 7")[4] == {0}
+    assert parse_cron("0 8 * * sab-7")[4] == {6, 0}
+    # 17/10/2026 é um sábado
+    assert next_local("0 8 * * 7", local(2026, 10, 17, 12, 0)) == local(2026, 10, 18, 8, 0)
+
+
+def test_day_of_month_or_weekday_when_both_are_restricted():
+    # Dia 15 ou sexta-feira: vale o primeiro que chegar
+    expr = "0 9 15 * 5"
+    assert next_local(expr, local(2026, 10, 17, 0, 0)) == local(2026, 10, 23, 9, 0)
+    assert next_local(expr, local(2026, 11, 13, 10, 0)) == local(2026, 11, 15, 9, 0)
+
+
+def test_unrestricted_weekday_does_not_widen_day_of_month():
+    assert next_local("0 9 15 * *", local(2026, 10, 17, 0, 0)) == local(2026, 11, 15, 9, 0)
+
+
+def test_next_occurrence_is_strictly_after():
+    assert next_local("30 20 * * *", local(2026, 10, 17, 20, 30)) == local(2026, 10, 18, 20, 30)
+
+
+@pytest.mark.parametrize("expr", ["0 8 * *", "60 8 * * *", "0 8 * * 8", "0 8 * * */0", "0 8 * * xyz"])
+def test_invalid_expressions(expr):
+    with pytest.raises(ValueError):
+        parse_cron(expr)